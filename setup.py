@@ -58,6 +58,7 @@ setup(
     },
     package_dir={"": "src"},
     packages=find_packages(where='src', exclude=['tests']),
+    package_data={"doctor.rules": ["manifest.json"]},
     long_description=read('README.rst'),
     classifiers=[
         "Development Status :: 3 - Alpha",
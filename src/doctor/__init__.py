@@ -18,20 +18,70 @@ This tool will provide recommendations regarding your timeseries
 database.
 """
 
+# The database driver and the modules using it are imported when they
+# are needed, so that listing rules does not need to load them.
+# pylint: disable=import-outside-toplevel
+
+import json
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
 from textwrap import dedent, fill, TextWrapper
-from os.path import dirname, basename, isfile, join
 from abc import ABC
-from packaging.version import parse
-
-import psycopg2
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
-from psycopg2.extras import RealDictCursor
+if TYPE_CHECKING:
+    from doctor.capabilities import Capabilities
+    from doctor.catalog import Snapshot
+    from doctor.profile import Profile
 
 # Rules are organized in a two-level hierarchy with the category as
 # the top-level object and the functions below.
 RULES = {}
 
+
+@dataclass
+class Context:
+    """Shared state and settings for executing rules.
+
+    capabilities: Capabilities of the database, used to check the
+      dependencies of rules. If not set, they are read from the
+      connection.
+
+    snapshot: Catalog snapshot shared between rules. If not set, a
+      new snapshot is created for each rule that needs one.
+
+    fetch_size: If set, query results are read through a server-side
+      cursor with this many rows at a time, so that memory usage does
+      not depend on the size of the result. If not set, the full
+      result is read at once.
+
+    profile: If set, the execution of each rule is recorded in this
+      `doctor.profile.Profile`.
+
+    records: If set, each finding is reported as a record with the
+      fields of the row and the rendered messages, as produced by
+      `Rule.records`, instead of as a message.
+
+    statements: If set, a dictionary from full rule name to the name
+      of a prepared statement for the query of the rule, which is
+      executed instead of the query.
+
+    sample: If set, rules that support sampling examine a stratified
+      sample with this many chunks in each stratum of each hypertable
+      instead of all chunks. See `doctor.sample`.
+    """
+
+    capabilities: 'Capabilities' = None
+    snapshot: 'Snapshot' = None
+    fetch_size: int = None
+    profile: 'Profile' = None
+    records: bool = False
+    statements: dict = None
+    sample: int = None
+
 # pylint: disable-next=too-few-public-methods
 class Rule(ABC):
     """Superclass for all rules to check.
@@ -42,7 +92,17 @@ class Rule(ABC):
 
     The following fields are available for the subclass:
 
-    query: The SQL query to execute. This is a required field.
+    query: The SQL query to execute. Either this field or the
+      "evaluate" method is required.
+
+    relations: Catalog relations needed by the "evaluate" method. The
+      relations are read into a snapshot that is shared between all
+      rules. See `doctor.catalog` for the available relations.
+
+    evaluate: Method that receives a `doctor.catalog.Snapshot` and
+      yields a dictionary for each mismatching object. It is used
+      instead of "query" to evaluate the rule in Python. A rule
+      defines either "query" or this method, never both.
 
     message: The message to show for each object. This is a required
       field.
@@ -59,33 +119,137 @@ class Rule(ABC):
     dependencies: Dictionary with dependencies on packages and what
     versions that are required.
 
+    cost: Estimated execution time of the rule in seconds, used to
+      order rules when running with a time budget. This is an
+      optional field, and by default the cost is estimated by
+      `doctor.schedule.Scheduler.estimate`.
+
+    timeout: Statement timeout for the rule in seconds, overriding
+      the default statement timeout. This is an optional field.
+
+    inputs: What the rule depends on when checking incrementally, as
+      a tuple of components from `doctor.state.COMPONENTS`. Rules that
+      compare with the current time depend on ``time``, so that they
+      are executed on every run. This is an optional field, and by
+      default the rule depends on `doctor.state.DEFAULT_INPUTS`.
+
+    interval: Time in seconds between executions of the rule in watch
+      mode. This is an optional field, and by default the interval
+      given to the watch mode is used.
+
+    sampled: If true, the query reads chunks through
+      `doctor.sample.CHUNK_SAMPLE` and reports estimated counts when
+      executed with a sample size. This is an optional field.
+
     """
 
-    def get_versions(self, conn):
-        """Get extension versions."""
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT extname, extversion FROM pg_extension WHERE extname IN %s",
-                           (tuple(self.dependencies.keys()),)) # pylint: disable=E1101
-            return {row["extname"]: row["extversion"] for row in cursor}
-
-
-    def execute(self, conn, text):
-        """Execute rule and return one string for each mismatching object."""
-        with conn.cursor() as cursor:
-            # Check that all dependencies are met. If not, we do not
-            # execute the rule.
-            if hasattr(self, 'dependencies'):
-                versions = self.get_versions(conn)
-                for ext,req in self.dependencies.items(): # pylint: disable=E1101
-                    if ext not in versions or parse(req) > parse(versions[ext]):
-                        return []
-            cursor.execute(self.query) # pylint: disable=E1101
-            return [text.format(**kwrds) for kwrds in cursor]
+    def fetch(self, conn, context=None):
+        """Execute rule and yield one dictionary for each mismatching object.
+
+        The rows are produced lazily as they are read, so the result
+        has to be consumed before the connection is used for anything
+        else. See `Context` for how the rule is executed.
+        """
+        from doctor.capabilities import Capabilities
+        from doctor.catalog import Snapshot
+        if context is None:
+            context = Context()
+        capabilities = context.capabilities
+        # Check that all dependencies are met. If not, we do not
+        # execute the rule.
+        if hasattr(self, 'dependencies'):
+            if capabilities is None:
+                capabilities = Capabilities.fetch(conn)
+            if not capabilities.satisfies(self):
+                return
+        if hasattr(self, 'evaluate'):
+            snapshot = context.snapshot
+            if snapshot is None:
+                snapshot = Snapshot(capabilities)
+            snapshot.load(conn, self.relations) # pylint: disable=E1101
+            yield from self.evaluate(snapshot) # pylint: disable=E1101
+            return
+        if context.sample and getattr(self, 'sampled', False):
+            from doctor.sample import SETTING
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT set_config(%s, %s, true)", (SETTING, str(context.sample)))
+        if context.profile is not None and context.profile.explain:
+            context.profile.analyze(self.fullname(), conn, self.query) # pylint: disable=E1101
+        statement = (context.statements or {}).get(self.fullname())
+        # A named cursor is a server-side cursor, which is read in
+        # batches of "itersize" rows when iterating over it. Prepared
+        # statements cannot be used with a named cursor.
+        name = None
+        if context.fetch_size and statement is None:
+            name = f"doctor_{type(self).__name__.lower()}"
+        with conn.cursor(name=name) as cursor:
+            if name is not None:
+                cursor.itersize = context.fetch_size
+            if statement is not None:
+                cursor.execute(f"EXECUTE {statement}")
+            else:
+                cursor.execute(self.query) # pylint: disable=E1101
+            yield from cursor
+
+    def execute(self, conn, text, context=None):
+        """Execute rule and yield one string for each mismatching object.
+
+        If the context has a profile, the execution of the rule is
+        recorded in the profile.
+        """
+        rows = self.fetch(conn, context)
+        if context is not None and context.profile is not None:
+            yield from context.profile.measure(self.fullname(), rows,
+                                               lambda row: text.format(**row))
+        else:
+            for kwrds in rows:
+                yield text.format(**kwrds)
+
+    def records(self, conn, context=None):
+        """Execute rule and yield one record for each mismatching object.
+
+        See `record` for the contents of each record. If the context
+        has a profile, the execution of the rule is recorded in the
+        profile.
+        """
+        rows = self.fetch(conn, context)
+        if context is not None and context.profile is not None:
+            yield from context.profile.measure(self.fullname(), rows, self.record)
+        else:
+            for row in rows:
+                yield self.record(row)
+
+    def record(self, row):
+        """Get the record for a row of the rule.
+
+        The record is a dictionary with the full name and the category
+        of the rule, the fields of the row, and the message, detail,
+        and hint of the rule rendered using the row.
+        """
+        fullname = self.fullname()
+        message = self.message.format(**row) # pylint: disable=E1101
+        return {
+            'rule': fullname,
+            'category': fullname.partition('.')[0],
+            'fields': row,
+            'message': message,
+            'detail': self.detail.format(**row) if hasattr(self, 'detail') else message,
+            'hint': self.hint.format(**row) if hasattr(self, 'hint') else message,
+        }
+
+    @classmethod
+    def fullname(cls):
+        """Get the full name of the rule, including the category."""
+        return f"{cls.__module__.rpartition('.')[2]}.{cls.__name__}"
 
 def register(cls):
     """Register a rule."""
-    if not hasattr(cls, 'query'):
+    if not hasattr(cls, 'query') and not hasattr(cls, 'evaluate'):
         raise NameError('Class did not define a query', name='query')
+    if hasattr(cls, 'evaluate') and not hasattr(cls, 'relations'):
+        raise NameError('Class did not define relations', name='relations')
+    if hasattr(cls, 'evaluate') and hasattr(cls, 'query'):
+        raise NameError('Class defined both a query and evaluate', name='query')
     if not hasattr(cls, 'message'):
         raise NameError('Class did not define a message', name='message')
     category = cls.__module__.rpartition('.')[2]
@@ -93,30 +257,312 @@ def register(cls):
     return cls
 
 
-def list_rules(pattern, show):
+def list_rules(infos, pattern, show, capabilities=None):
     """List all rules matching pattern.
 
+    The rules are given as descriptions in `infos`, for example from
+    `doctor.manifest.rule_infos`, so that rule modules do not have to
+    be imported to list them.
+
     Will list rules matching `pattern`, and print detailed message if
     `details` is true. Note that since the detailed message contains
     variables for expansion, and there is no replacements to use, the
     message with the placeholders will be printed.
+
+    If `capabilities` is given, rules with dependencies that are not
+    met are marked as skipped together with the reason.
     """
     wrapper = TextWrapper(initial_indent="    ", subsequent_indent="    ")
-    for category, rules in RULES.items():
-        for name, cls in rules.items():
-            fullname = f"{category}.{name}"
-            if fnmatch(fullname, pattern):
+    for info in infos:
+        fullname = f"{info.category}.{info.name}"
+        if fnmatch(fullname, pattern):
+            unmet = capabilities.unmet(info) if capabilities else []
+            if unmet:
+                print(f"{fullname}: skipped, {', '.join(unmet)}")
+            else:
                 print(f"{fullname}:")
-                print(wrapper.fill(cls.__doc__))
-                if show in ("details", "message"):
-                    print("\n    == MESSAGE ==", end="\n\n")
-                    print(wrapper.fill(cls.message), end="\n\n")
-                    if show == "details" and hasattr(cls, 'detail'):
-                        print(wrapper.fill(cls.detail), end="\n\n")
+            # Paragraphs of the description are wrapped separately.
+            print("\n\n".join(wrapper.fill(paragraph) for paragraph in info.doc.split("\n\n")))
+            if show in ("details", "message"):
+                print("\n    == MESSAGE ==", end="\n\n")
+                print(wrapper.fill(info.message), end="\n\n")
+                if show == "details" and info.detail is not None:
+                    print(wrapper.fill(info.detail), end="\n\n")
 
 
-def check_rules(args):
-    """Check all rules with the database."""
+def _reports(conn, rule, context):
+    """Execute a rule and yield the messages or records for it."""
+    if context.records:
+        return rule.records(conn, context)
+    return rule.execute(conn, rule.message, context)
+
+
+def _collect(conn, rule, context):
+    """Execute a rule and return the reports as a list."""
+    return list(_reports(conn, rule, context))
+
+
+def _run_rule(pool, cls, context, scheduler=None):
+    """Run a single rule on a connection borrowed from the pool.
+
+    Returns the list of reports for the rule, or the exception if the
+    rule failed, so that a failing rule does not affect other rules.
+    """
+    conn = pool.getconn()
+    try:
+        rule = cls()
+        if scheduler is not None:
+            return scheduler.run(conn, cls, _collect, conn, rule, context)
+        return _collect(conn, rule, context)
+    except Exception as err: # pylint: disable=broad-exception-caught
+        return err
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+
+def _guard(conn, reports, errors):
+    """Yield reports and record any error instead of raising it.
+
+    On error, the transaction is rolled back so that the connection
+    can be used for the next rule.
+    """
+    try:
+        yield from reports
+    except Exception as err: # pylint: disable=broad-exception-caught
+        conn.rollback()
+        errors.append(err)
+
+
+def run_rules(conninfo, jobs=1, scheduler=None, pattern='*', **options):
+    """Run all rules and yield the reports for each rule.
+
+    Each item is a tuple ``(category, name, reports)``, where
+    `reports` is either an iterable of reports or an exception if the
+    rule failed. Items are produced in category order. The reports of
+    a rule have to be consumed before the next item is requested.
+
+    If `jobs` is more than one, rules are executed concurrently on a
+    pool with at most `jobs` connections, and the reports for each
+    rule are collected before they are returned. Otherwise, reports
+    are produced as rows are read.
+
+    If a `doctor.schedule.Scheduler` is given, rules are executed in
+    the order decided by the scheduler and within its time limits.
+    Rules that did not complete are reported with an `Incomplete`
+    exception. The reports of all rules are collected before they are
+    returned, so that they can be returned in category order.
+
+    Only rules with a full name matching `pattern` are executed.
+
+    Additional keyword arguments are the settings in `Context`, for
+    example `fetch_size` and `profile`.
+
+    The capabilities of the database are read once before running
+    any rules, and rules with dependencies that are not met are not
+    executed. All rules share a single catalog snapshot, so each
+    catalog relation is only read once for the run.
+    """
+    rules = [(category, name, cls)
+             for category, rules in RULES.items()
+             for name, cls in rules.items()
+             if fnmatch(f"{category}.{name}", pattern)]
+    if scheduler is not None:
+        scheduler.start()
+    if jobs > 1:
+        yield from _run_concurrent(conninfo, rules, jobs, options, scheduler)
+    elif scheduler is not None:
+        yield from _run_scheduled(conninfo, rules, options, scheduler)
+    else:
+        yield from _run_sequential(conninfo, rules, options)
+
+
+def _connect(conninfo):
+    """Connect to a database with cursors returning dictionaries."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    return psycopg2.connect(**conninfo, cursor_factory=RealDictCursor)
+
+
+def _connect_pool(conninfo, jobs):
+    """Create a pool of at most `jobs` connections like `_connect`."""
+    from psycopg2.extras import RealDictCursor
+    from psycopg2.pool import ThreadedConnectionPool
+    return ThreadedConnectionPool(1, jobs, **conninfo, cursor_factory=RealDictCursor)
+
+
+def _prepare(conn, rules, options, scheduler=None):
+    """Read the capabilities of a database and create a context for a run.
+
+    The catalog relations needed by the rules that will be executed
+    are read into the snapshot at once, in the same REPEATABLE READ
+    transaction as the capabilities, so that all rules see the catalog
+    at the same moment. If a scheduler is given, they are read within
+    its default time limits, see `doctor.schedule.Scheduler.load`. If
+    the context has a profile, reading each relation is recorded in
+    the profile.
+    """
+    from doctor.capabilities import Capabilities
+    from doctor.catalog import Snapshot
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    try:
+        if scheduler is not None:
+            scheduler.limit(conn)
+        capabilities = Capabilities.fetch(conn)
+        snapshot = Snapshot(capabilities)
+        names = {name for _, _, cls in rules
+                 if hasattr(cls, 'evaluate') and capabilities.satisfies(cls)
+                 for name in cls.relations}
+        if scheduler is not None:
+            scheduler.load(conn, snapshot, names)
+        else:
+            snapshot.load(conn, names)
+    finally:
+        conn.rollback()
+    context = Context(capabilities, snapshot, **options)
+    if context.profile is not None:
+        context.profile.record_snapshot(snapshot)
+    return context
+
+
+def _run_concurrent(conninfo, rules, jobs, options, scheduler):
+    """Run rules concurrently on a connection pool."""
+    pool = _connect_pool(conninfo, jobs)
+    try:
+        conn = pool.getconn()
+        try:
+            context = _prepare(conn, rules, options, scheduler)
+            rules = [rule for rule in rules if context.capabilities.satisfies(rule[2])]
+            if scheduler is not None:
+                scheduler.estimate(conn, rules, context.snapshot)
+        finally:
+            conn.rollback()
+            pool.putconn(conn)
+        order = rules if scheduler is None else scheduler.order(rules)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # The map() function returns results in submission
+            # order, so the output order is kept unless the rules
+            # were reordered by the scheduler.
+            results = executor.map(lambda rule: _run_rule(pool, rule[2], context, scheduler),
+                                   order)
+            if scheduler is not None:
+                results = dict(zip(order, results))
+                results = [results[rule] for rule in rules]
+            for (category, name, _), reports in zip(rules, results):
+                yield category, name, reports
+    finally:
+        pool.closeall()
+
+
+def _run_sequential(conninfo, rules, options):
+    """Run rules one at a time on a single connection."""
+    conn = _connect(conninfo)
+    try:
+        context = _prepare(conn, rules, options)
+        for category, name, cls in rules:
+            if not context.capabilities.satisfies(cls):
+                continue
+            rule = cls()
+            errors = []
+            yield category, name, _guard(conn, _reports(conn, rule, context), errors)
+            if errors:
+                yield category, name, errors[0]
+    finally:
+        conn.close()
+
+
+def _run_scheduled(conninfo, rules, options, scheduler):
+    """Run rules one at a time in the order decided by the scheduler."""
+    conn = _connect(conninfo)
+    try:
+        context = _prepare(conn, rules, options, scheduler)
+        rules = [rule for rule in rules if context.capabilities.satisfies(rule[2])]
+        scheduler.estimate(conn, rules, context.snapshot)
+        results = {}
+        for category, name, cls in scheduler.order(rules):
+            try:
+                results[category, name] = scheduler.run(conn, cls, _collect, conn, cls(), context)
+            except Exception as err: # pylint: disable=broad-exception-caught
+                conn.rollback()
+                results[category, name] = err
+    finally:
+        conn.close()
+    for category, name, _ in rules:
+        if (category, name) in results:
+            yield category, name, results[category, name]
+
+
+def print_reports(results, file=None):
+    """Print reports from `run_rules` grouped by category.
+
+    Returns a list of ``(fullname, error)`` for all rules that failed,
+    which are not printed.
+    """
+    failed = []
+    printed = set()
+    for category, name, reports in results:
+        if isinstance(reports, Exception):
+            failed.append((f"{category}.{name}", reports))
+            continue
+        for report in reports:
+            if category not in printed:
+                print(f"{category}:", file=file)
+                printed.add(category)
+            clean = dedent(report)
+            print(fill(clean, initial_indent="- ", subsequent_indent="  "), file=file)
+    return failed
+
+
+def print_records(results, array=False, file=None):
+    """Print records from `run_rules` as JSON, one line per record.
+
+    The results have to be produced with `records` set in the context.
+    Records are written as soon as they are produced. If `array` is
+    true, the records are written as a single JSON array instead of
+    as one JSON object per line.
+
+    Returns a list of ``(fullname, error)`` for all rules that failed,
+    which are not printed.
+    """
+    if file is None:
+        file = sys.stdout
+    failed = []
+    count = 0
+    for category, name, records in results:
+        if isinstance(records, Exception):
+            failed.append((f"{category}.{name}", records))
+            continue
+        for record in records:
+            if array:
+                file.write(',\n' if count else '[')
+            file.write(json.dumps(record, default=str))
+            if not array:
+                file.write('\n')
+            count += 1
+    if array:
+        file.write(']\n' if count else '[]\n')
+    return failed
+
+
+def print_results(results, output='text', file=None):
+    """Print results from `run_rules` in the given output format.
+
+    With 'text', the reports are printed using `print_reports`, and
+    otherwise the results have to be produced with `records` set in
+    the context and are printed using `print_records`, as a single
+    JSON array for 'json'.
+
+    Returns a list of ``(fullname, error)`` for all rules that failed.
+    """
+    if output == 'text':
+        return print_reports(results, file=file)
+    return print_records(results, array=output == 'json', file=file)
+
+
+def get_conninfo(args):
+    """Get connection parameters from the command-line arguments."""
     conninfo = {
         'dbname': args.dbname,
         'user': args.user,
@@ -124,14 +570,46 @@ def check_rules(args):
         'host': '/var/run/postgresql' if args.host is None else args.host,
         'port': args.port,
     }
-    conn = psycopg2.connect(**conninfo, cursor_factory=RealDictCursor)
-    for category, rules in RULES.items():
-        header_printed = False
-        for _, cls in rules.items():
-            rule = cls()
-            for report in rule.execute(conn, rule.message):
-                if not header_printed:
-                    print(f"{category}:")
-                    header_printed = True
-                clean = dedent(report)
-                print(fill(clean, initial_indent="- ", subsequent_indent="  "))
+    if getattr(args, 'sslmode', None) is not None:
+        conninfo['sslmode'] = args.sslmode
+    return conninfo
+
+
+def get_capabilities(args):
+    """Connect to the database and read its capabilities."""
+    from doctor.capabilities import Capabilities
+    conn = _connect(get_conninfo(args))
+    try:
+        return Capabilities.fetch(conn)
+    finally:
+        conn.close()
+
+
+def check_rules(args):
+    """Check all rules with the database."""
+    from doctor.profile import Profile
+    from doctor.schedule import Incomplete, Scheduler
+    conninfo = get_conninfo(args)
+    profile = None
+    if getattr(args, 'profile', None):
+        profile = Profile(explain=args.profile == 'explain')
+    scheduler = None
+    if any(getattr(args, option, None) is not None
+           for option in ('time_budget', 'statement_timeout', 'lock_timeout')):
+        scheduler = Scheduler(args.time_budget, args.statement_timeout,
+                              args.lock_timeout, args.history)
+    output = getattr(args, 'format', 'text')
+    results = run_rules(conninfo, getattr(args, 'jobs', 1), scheduler,
+                        getattr(args, 'rules', '*'),
+                        fetch_size=getattr(args, 'fetch_size', None), profile=profile,
+                        records=output != 'text', sample=getattr(args, 'sample', None))
+    failed = print_results(results, output)
+    for fullname, error in failed:
+        if isinstance(error, Incomplete):
+            print(f"rule {fullname} did not complete: {error}", file=sys.stderr)
+        else:
+            print(f"rule {fullname} failed: {error}".rstrip(), file=sys.stderr)
+    if scheduler is not None:
+        scheduler.save()
+    if profile is not None:
+        profile.report(file=sys.stderr)
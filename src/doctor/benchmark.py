@@ -0,0 +1,278 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark how the execution time of rules scales with the catalog.
+
+For each combination of sizes, a synthetic database is created with
+the given number of hypertables, chunks for each hypertable, indexes
+for each hypertable, and compressed hypertables. Each rule and the
+full check of all rules are then executed a number of times, and the
+timings are written as JSON::
+
+    python -m doctor.benchmark -h localhost --hypertables 10,100 \\
+        --chunks 10,1000 --indexes 4 --compressed 0,10 --output bench.json
+
+The database given on the command line is only used to create and
+drop the benchmark database, which is replaced for each size.
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import statistics
+import sys
+import time
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+from psycopg2.extras import RealDictCursor
+
+from doctor import RULES, Context, check_rules, get_conninfo
+from doctor.capabilities import Capabilities
+from doctor.cli import add_connection_arguments
+from doctor.rules import load_rules
+from timescaledb import Hypertable, Index
+
+Size = namedtuple('Size', ['hypertables', 'chunks', 'indexes', 'compressed'])
+
+COLUMNS = {
+    'time': 'timestamptz not null',
+    'device': 'int',
+    'value': 'float',
+}
+
+# Columns of the indexes created for each hypertable, in order. If
+# more indexes are requested, the list is repeated, which creates
+# duplicate indexes.
+INDEX_COLUMNS = [['device', 'time'], ['value'], ['device'], ['time', 'device']]
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+INTERVAL = timedelta(hours=1)
+
+# Number of chunks created or compressed in each transaction, to stay
+# within the lock table of the server.
+BATCH = 500
+
+
+def recreate_database(conninfo, dbname):
+    """Drop and create the benchmark database."""
+    conn = psycopg2.connect(**conninfo)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {dbname}")
+            cursor.execute(f"CREATE DATABASE {dbname}")
+    finally:
+        conn.close()
+
+
+def drop_database(conninfo, dbname):
+    """Drop the benchmark database."""
+    conn = psycopg2.connect(**conninfo)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {dbname}")
+    finally:
+        conn.close()
+
+
+def populate(conn, size):
+    """Create the hypertables, chunks, and indexes for a size."""
+    if size.hypertables > 0:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+        conn.commit()
+    for number in range(size.hypertables):
+        table = Hypertable(f"bench_{number}", 'time', COLUMNS, INTERVAL)
+        table.create(conn)
+        for index in range(size.indexes):
+            columns = INDEX_COLUMNS[index % len(INDEX_COLUMNS)]
+            Index(f"bench_{number}_{index}", table.name, columns).create(conn)
+        conn.commit()
+        with conn.cursor() as cursor:
+            for first in range(0, size.chunks, BATCH):
+                last = min(first + BATCH, size.chunks) - 1
+                cursor.execute(f"INSERT INTO {table.name}"
+                               " SELECT t, 1, 0.0 FROM generate_series(%s, %s, %s) t",
+                               (START + first * INTERVAL, START + last * INTERVAL, INTERVAL))
+                conn.commit()
+        if number < size.compressed:
+            table.compress(conn, segmentby='device')
+            compress_chunks(conn, table.name)
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    conn.commit()
+
+
+def compress_chunks(conn, table):
+    """Compress all chunks of a hypertable, in batches."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT show_chunks(%s)::text AS chunk", (table,))
+        chunks = [row['chunk'] for row in cursor.fetchall()]
+        for first in range(0, len(chunks), BATCH):
+            for chunk in chunks[first:first + BATCH]:
+                cursor.execute("SELECT compress_chunk(%s)", (chunk,))
+            conn.commit()
+
+
+def summarize(timings, **extra):
+    """Summarize a list of timings in seconds."""
+    return dict(extra, min=min(timings), median=statistics.median(timings),
+                max=max(timings))
+
+
+def time_rules(conn, repeat):
+    """Time each rule that can be executed in the database.
+
+    Each execution uses a new context, so reading the catalog
+    snapshot is part of the time of each rule using it.
+    """
+    capabilities = Capabilities.fetch(conn)
+    results = {}
+    for category, rules in RULES.items():
+        for name, cls in rules.items():
+            if not capabilities.satisfies(cls):
+                continue
+            timings = []
+            try:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    reports = list(cls().execute(conn, cls.message, Context(capabilities)))
+                    timings.append(time.perf_counter() - start)
+                    conn.rollback()
+            except psycopg2.Error as err:
+                conn.rollback()
+                results[f"{category}.{name}"] = {'error': str(err).strip()}
+                continue
+            results[f"{category}.{name}"] = summarize(timings, reports=len(reports))
+    return results
+
+
+def time_check(args, dbname, repeat):
+    """Time the full check of all rules, discarding the output."""
+    options = argparse.Namespace(**vars(args))
+    options.dbname = dbname
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), \
+             contextlib.redirect_stderr(io.StringIO()):
+            check_rules(options)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def catalog_size(conn):
+    """Get the number of relations and chunks in the database."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) AS relations FROM pg_catalog.pg_class")
+        sizes = dict(cursor.fetchone())
+        cursor.execute("SELECT to_regclass('_timescaledb_catalog.chunk') IS NOT NULL AS found")
+        sizes['chunks'] = 0
+        if cursor.fetchone()['found']:
+            cursor.execute("SELECT count(*) AS chunks FROM _timescaledb_catalog.chunk")
+            sizes['chunks'] = cursor.fetchone()['chunks']
+    conn.commit()
+    return sizes
+
+
+def benchmark(args, size):
+    """Create a database for a size and time all rules against it."""
+    conninfo = get_conninfo(args)
+    recreate_database(conninfo, args.database)
+    conninfo['dbname'] = args.database
+    conn = psycopg2.connect(**conninfo, cursor_factory=RealDictCursor)
+    try:
+        start = time.perf_counter()
+        populate(conn, size)
+        result = {
+            'size': size._asdict(),
+            'setup': time.perf_counter() - start,
+            'catalog': catalog_size(conn),
+            'server_version': conn.server_version,
+            'rules': time_rules(conn, args.repeat),
+        }
+    finally:
+        conn.close()
+    result['check_rules'] = time_check(args, args.database, args.repeat)
+    return result
+
+
+def size_list(text):
+    """Parse a comma-separated list of sizes."""
+    values = [int(value) for value in text.split(',')]
+    if any(value < 0 for value in values):
+        raise argparse.ArgumentTypeError("sizes cannot be negative")
+    return values
+
+
+def parse_arguments():
+    """Parse arguments to the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], add_help=False)
+    add_connection_arguments(parser)
+    parser.add_argument('dbname', metavar='DBNAME', nargs='?', default='postgres',
+                        help='database used to create the benchmark database')
+    parser.add_argument('--database', metavar='NAME', default='doctor_benchmark',
+                        help='name of the benchmark database, which is dropped and created')
+    parser.add_argument('--hypertables', metavar='N,...', type=size_list, default=[10],
+                        help='number of hypertables')
+    parser.add_argument('--chunks', metavar='N,...', type=size_list, default=[10],
+                        help='number of chunks for each hypertable')
+    parser.add_argument('--indexes', metavar='N,...', type=size_list, default=[2],
+                        help='number of indexes for each hypertable')
+    parser.add_argument('--compressed', metavar='N,...', type=size_list, default=[0],
+                        help='number of hypertables with all chunks compressed')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help='number of rules to run concurrently in the full check')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3,
+                        help='number of times to execute each rule')
+    parser.add_argument('-o', '--output', metavar='FILE', default='benchmark.json',
+                        help='file to write the results to, as JSON')
+    parser.add_argument('--help', action='help', default=argparse.SUPPRESS,
+                        help='show this help message and exit')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("argument --repeat: must be at least 1")
+    return args
+
+
+def main():
+    """Run the benchmark for all combinations of sizes."""
+    args = parse_arguments()
+    load_rules()
+    results = []
+    try:
+        for values in itertools.product(args.hypertables, args.chunks,
+                                        args.indexes, args.compressed):
+            size = Size(*values)
+            if size.compressed > size.hypertables:
+                continue
+            print(f"benchmarking {size}", file=sys.stderr)
+            results.append(benchmark(args, size))
+            # Results are written after each size, so that they are
+            # available even if a later size fails.
+            with open(args.output, 'w', encoding='utf-8') as outfile:
+                json.dump(results, outfile, indent=2)
+    finally:
+        drop_database(get_conninfo(args), args.database)
+
+
+if __name__ == '__main__':
+    main()
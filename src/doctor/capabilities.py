@@ -0,0 +1,120 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capabilities of a database.
+
+The capabilities are read once for each connection and contain the
+server version, the installed extensions and their versions, the
+libraries loaded at server start, and the catalog tables and views
+that are available. They are used to decide
+what rules can be executed before executing any of them.
+"""
+
+import os
+
+from functools import lru_cache
+
+from packaging.version import parse
+
+CAPABILITIES_QUERY = """
+SELECT 'extension' AS kind, extname AS name, extversion AS version
+  FROM pg_catalog.pg_extension
+UNION ALL
+SELECT 'relation', format('%s.%s', nspname, relname), NULL
+  FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+ WHERE relkind IN ('r', 'v', 'm', 'p')
+   AND (nspname IN ('pg_catalog', 'timescaledb_information', 'timescaledb_experimental')
+        OR nspname LIKE '\\_timescaledb%'
+        OR c.oid IN (SELECT objid FROM pg_catalog.pg_depend
+                      WHERE classid = 'pg_catalog.pg_class'::regclass AND deptype = 'e'))
+UNION ALL
+SELECT 'library', name, NULL
+  FROM unnest(string_to_array(current_setting('shared_preload_libraries'), ',')) AS name
+"""
+
+# Extensions that only collect data if their library is loaded at
+# server start. Rules depending on them are not executed otherwise.
+PRELOADED = ('pg_stat_statements',)
+
+
+@lru_cache(maxsize=None)
+def parse_version(version):
+    """Parse a version string.
+
+    Versions are cached since the same requirements are compared many
+    times in a run.
+    """
+    return parse(version)
+
+
+class Capabilities:
+    """Capabilities of a database connection.
+
+    server_version: The server version as an integer, in the same
+      format as `server_version_num`.
+
+    extensions: Dictionary from extension name to the parsed version.
+
+    relations: Set of available catalog tables and views, as
+      schema-qualified names.
+
+    libraries: Set of libraries in ``shared_preload_libraries``,
+      without directory and quotes.
+    """
+
+    def __init__(self, server_version, extensions, relations, libraries=()):
+        self.server_version = server_version
+        self.extensions = {name: parse_version(version) for name, version in extensions.items()}
+        self.relations = set(relations)
+        self.libraries = {os.path.basename(name.strip().strip('"')) for name in libraries}
+
+    @classmethod
+    def fetch(cls, conn):
+        """Read the capabilities using a connection."""
+        extensions = {}
+        relations = []
+        libraries = []
+        with conn.cursor() as cursor:
+            cursor.execute(CAPABILITIES_QUERY)
+            for row in cursor:
+                if row['kind'] == 'extension':
+                    extensions[row['name']] = row['version']
+                elif row['kind'] == 'library':
+                    libraries.append(row['name'])
+                else:
+                    relations.append(row['name'])
+        return cls(conn.server_version, extensions, relations, libraries)
+
+    def has_relation(self, name):
+        """Check if a schema-qualified table or view is available."""
+        return name in self.relations
+
+    def unmet(self, cls):
+        """Return a list of reasons why a rule cannot be executed.
+
+        The list is empty if all dependencies of the rule are met.
+        """
+        reasons = []
+        for ext, req in getattr(cls, 'dependencies', {}).items():
+            if ext not in self.extensions:
+                reasons.append(f"requires extension {ext}")
+            elif parse_version(req) > self.extensions[ext]:
+                reasons.append(f"requires {ext} {req}, but {self.extensions[ext]} is installed")
+            elif ext in PRELOADED and ext not in self.libraries:
+                reasons.append(f"requires {ext} in shared_preload_libraries")
+        return reasons
+
+    def satisfies(self, cls):
+        """Check if all dependencies of a rule are met."""
+        return not self.unmet(cls)
@@ -0,0 +1,41 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for database capabilities."""
+
+import unittest
+
+from doctor.capabilities import Capabilities
+from doctor.rules.workload import MissingTimePredicate
+
+
+class TestCapabilities(unittest.TestCase):
+    """Test checking the dependencies of rules."""
+
+    EXTENSIONS = {'timescaledb': '2.13.0', 'pg_stat_statements': '1.10'}
+
+    def test_preloaded(self):
+        """Test that rules need pg_stat_statements to be preloaded."""
+        capabilities = Capabilities(160000, self.EXTENSIONS, [], ['timescaledb'])
+        self.assertEqual(capabilities.unmet(MissingTimePredicate),
+                         ["requires pg_stat_statements in shared_preload_libraries"])
+        capabilities = Capabilities(160000, self.EXTENSIONS, [],
+                                    ['timescaledb', ' "$libdir/pg_stat_statements"'])
+        self.assertTrue(capabilities.satisfies(MissingTimePredicate))
+
+    def test_missing_extension(self):
+        """Test that a missing extension is reported before the library."""
+        capabilities = Capabilities(160000, {'timescaledb': '2.13.0'}, [], [])
+        self.assertEqual(capabilities.unmet(MissingTimePredicate),
+                         ["requires extension pg_stat_statements"])
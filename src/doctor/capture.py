@@ -0,0 +1,320 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capture database state to a file and analyze it offline.
+
+A capture contains the capabilities of the database, all relations
+of the catalog snapshot, see `doctor.catalog`, and the result of the
+query of each rule that is not evaluated in Python, all read in a
+single transaction. Rules evaluated in Python are then evaluated
+against the captured relations without a connection to the database,
+which includes such rules added after the capture was made, while the
+findings of the other rules are read from their captured results.
+
+The file starts with a magic string with the format version and the
+length of a table of contents, followed by the table of contents as
+JSON and then the data. Data is stored column by column, with each
+column compressed separately. Values that JSON cannot represent are
+stored as strings or lists and the type of each column is recorded in
+the table of contents. The file is memory-mapped when reading, and
+columns are only decompressed when a rule needs them.
+"""
+
+import json
+import mmap
+import struct
+import sys
+import zlib
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from fnmatch import fnmatch
+
+import psycopg2
+
+from psycopg2.extras import NamedTupleCursor, RealDictCursor
+
+from doctor import RULES, Context, print_results
+from doctor.capabilities import Capabilities
+from doctor.catalog import CATALOG, Snapshot, Table, fetch_tables
+from doctor.sample import SETTING
+
+# Version of the file format, which is part of the magic string.
+VERSION = 2
+MAGIC = b'TSDRCAP' + str(VERSION).encode('ascii')
+HEADER = struct.Struct('>8sQ')
+
+# Encoders and decoders for values that JSON cannot represent, by
+# the name of the type stored in the table of contents.
+ENCODERS = {
+    datetime: ('datetime', datetime.isoformat),
+    timedelta: ('timedelta', lambda value: [value.days, value.seconds, value.microseconds]),
+    Decimal: ('decimal', str),
+}
+DECODERS = {
+    'datetime': datetime.fromisoformat,
+    'timedelta': lambda value: timedelta(*value),
+    'decimal': Decimal,
+}
+
+
+def _column_encoder(values):
+    """Get the stored type and encoder of a column.
+
+    Returns ``(None, None)`` if JSON can represent the values.
+    """
+    for value in values:
+        if value is not None:
+            return ENCODERS.get(type(value), (None, None))
+    return None, None
+
+
+def _pack_columns(columns, rows, data):
+    """Compress rows column by column and append them to data.
+
+    Returns the table of contents entry for the rows.
+    """
+    blobs = []
+    types = []
+    for index in range(len(columns)):
+        values = [row[index] for row in rows]
+        kind, encode = _column_encoder(values)
+        if encode is not None:
+            values = [None if value is None else encode(value) for value in values]
+        blob = zlib.compress(json.dumps(values, separators=(',', ':')).encode('utf-8'))
+        blobs.append((len(data), len(blob)))
+        types.append(kind)
+        data.extend(blob)
+    return {'columns': columns, 'types': types, 'count': len(rows), 'blobs': blobs}
+
+
+def write_capture(path, capabilities, tables, results=None):
+    """Write a capture file.
+
+    `tables` is a dictionary from relation name to `Table`, and
+    `results` a dictionary from the full name of a rule to a `Table`
+    with the result of its query.
+    """
+    data = bytearray()
+    toc = {
+        'version': VERSION,
+        'capabilities': {
+            'server_version': capabilities.server_version,
+            'extensions': {name: str(version)
+                           for name, version in capabilities.extensions.items()},
+            'relations': sorted(capabilities.relations),
+            'libraries': sorted(capabilities.libraries),
+        },
+        'relations': {},
+        'results': {},
+    }
+    for name, table in tables.items():
+        toc['relations'][name] = _pack_columns(table.columns, table.rows, data)
+        toc['relations'][name]['key'] = table.key
+    for name, table in (results or {}).items():
+        toc['results'][name] = _pack_columns(table.columns, table.rows, data)
+    header = json.dumps(toc).encode('utf-8')
+    with open(path, 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, len(header)))
+        outfile.write(header)
+        outfile.write(data)
+
+
+def fetch_results(conn, capabilities, sample=None):
+    """Execute the queries of the rules that are not evaluated in Python.
+
+    Each query is executed in a savepoint of the current transaction,
+    so that a failing query does not affect the other rules. A rule
+    that fails is reported and left out of the result. Returns a
+    dictionary from the full name of the rule to a `Table` with the
+    rows of the query. If `sample` is set, rules that support sampling
+    examine a sample of the chunks, see `doctor.sample`.
+    """
+    results = {}
+    if sample:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT set_config(%s, %s, true)", (SETTING, str(sample)))
+    for rules in RULES.values():
+        for cls in rules.values():
+            if hasattr(cls, 'evaluate') or not capabilities.satisfies(cls):
+                continue
+            with conn.cursor(cursor_factory=NamedTupleCursor) as cursor:
+                cursor.execute("SAVEPOINT doctor_capture")
+                try:
+                    cursor.execute(cls.query)
+                except psycopg2.Error as err:
+                    cursor.execute("ROLLBACK TO SAVEPOINT doctor_capture")
+                    print(f"rule {cls.fullname()} failed: {err}".rstrip(), file=sys.stderr)
+                    continue
+                columns = [column.name for column in cursor.description]
+                results[cls.fullname()] = Table(cursor.fetchall(), None, columns)
+                cursor.execute("RELEASE SAVEPOINT doctor_capture")
+    return results
+
+
+def capture(conn, path, sample=None):
+    """Capture the state needed by the rules to a file.
+
+    The catalog relations and the results of the rule queries are all
+    read in a single REPEATABLE READ transaction, so that they are
+    consistent with each other. See `fetch_results` for `sample`.
+    """
+    capabilities = Capabilities.fetch(conn)
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    try:
+        tables = fetch_tables(conn, CATALOG, capabilities)
+        results = fetch_results(conn, capabilities, sample)
+    finally:
+        conn.rollback()
+    write_capture(path, capabilities, tables, results)
+
+
+def capture_database(conninfo, path, sample=None):
+    """Connect to a database and capture its state to a file."""
+    conn = psycopg2.connect(**conninfo, cursor_factory=RealDictCursor)
+    try:
+        capture(conn, path, sample)
+    finally:
+        conn.close()
+
+
+class CaptureFile:
+    """Memory-mapped capture file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = HEADER.unpack_from(self._map)
+        if magic[:-1] != MAGIC[:-1]:
+            self._map.close()
+            raise ValueError(f"{path} is not a capture file")
+        if magic != MAGIC:
+            self._map.close()
+            version = magic[-1:].decode('ascii', 'replace')
+            raise ValueError(f"{path} has capture format version {version},"
+                             f" but only version {VERSION} is supported")
+        self._base = HEADER.size + length
+        self.toc = json.loads(self._map[HEADER.size:self._base])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the capture file."""
+        self._map.close()
+
+    def _unpack_columns(self, entry):
+        """Decompress all columns of an entry and return the rows as tuples."""
+        columns = []
+        for (offset, length), kind in zip(entry['blobs'], entry['types']):
+            start = self._base + offset
+            values = json.loads(zlib.decompress(self._map[start:start + length]))
+            if kind is not None:
+                decode = DECODERS[kind]
+                values = [None if value is None else decode(value) for value in values]
+            columns.append(values)
+        return list(zip(*columns)) if columns else [()] * entry['count']
+
+    def capabilities(self):
+        """Get the captured capabilities."""
+        info = self.toc['capabilities']
+        return Capabilities(info['server_version'], info['extensions'], info['relations'],
+                            info.get('libraries', ()))
+
+    def table(self, name):
+        """Get a captured catalog relation as a `Table`.
+
+        Raises `LookupError` if the relation is not part of the
+        capture.
+        """
+        entry = self.toc['relations'].get(name)
+        if entry is None:
+            raise LookupError(f"relation {name} is not part of the capture")
+        row = namedtuple('Row', entry['columns'])
+        return Table([row(*values) for values in self._unpack_columns(entry)],
+                     entry['key'], entry['columns'])
+
+    def results(self, fullname):
+        """Get the captured result of the query of a rule.
+
+        Returns a list with a dictionary for each row. Raises
+        `LookupError` if the rule is not part of the capture.
+        """
+        entry = self.toc.get('results', {}).get(fullname)
+        if entry is None:
+            raise LookupError(f"rule {fullname} is not part of the capture")
+        return [dict(zip(entry['columns'], values)) for values in self._unpack_columns(entry)]
+
+# pylint: disable-next=too-few-public-methods
+class FileSnapshot(Snapshot):
+    """Catalog snapshot read from a capture file instead of a database."""
+
+    def __init__(self, capture_file, capabilities=None):
+        super().__init__(capabilities)
+        self.capture_file = capture_file
+
+    def load(self, conn, names):
+        """Read the relations in `names` from the capture file.
+
+        The connection is ignored, and can be None.
+        """
+        for name in names:
+            if name not in self:
+                self._tables[name] = self.capture_file.table(name)
+
+
+def analyze(path, records=False, pattern='*'):
+    """Check rules matching `pattern` against a capture file.
+
+    Yields the same items as `doctor.run_rules`, with records instead
+    of messages if `records` is true. Rules with an `evaluate` method
+    are evaluated against the captured relations, and the findings of
+    other rules are the captured results of their queries. A rule that
+    fails is reported with the error, so that it does not affect other
+    rules.
+    """
+    with CaptureFile(path) as capture_file:
+        capabilities = capture_file.capabilities()
+        context = Context(capabilities, FileSnapshot(capture_file, capabilities))
+        for category, rules in RULES.items():
+            for name, cls in rules.items():
+                if not fnmatch(f"{category}.{name}", pattern) or not capabilities.satisfies(cls):
+                    continue
+                rule = cls()
+                try:
+                    if hasattr(rule, 'evaluate'):
+                        rows = rule.fetch(None, context)
+                    else:
+                        rows = capture_file.results(rule.fullname())
+                    if records:
+                        yield category, name, [rule.record(row) for row in rows]
+                    else:
+                        yield category, name, [rule.message.format(**row) for row in rows]
+                except Exception as err: # pylint: disable=broad-exception-caught
+                    yield category, name, err
+
+
+def check_capture(path, output='text', pattern='*'):
+    """Check rules against a capture file and print the results.
+
+    See `doctor.print_results` for the output formats.
+    """
+    for fullname, error in print_results(analyze(path, output != 'text', pattern), output):
+        print(f"rule {fullname} failed: {error}".rstrip(), file=sys.stderr)
@@ -0,0 +1,134 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for capture files."""
+
+import os
+import tempfile
+import unittest
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+
+import doctor
+
+from doctor.capabilities import Capabilities
+from doctor.capture import HEADER, CaptureFile, analyze, write_capture
+from doctor.catalog import Table
+
+Row = namedtuple('Row', ['id', 'name', 'created', 'duration', 'ratio', 'config'])
+
+ROWS = [
+    Row(1, 'one', datetime(2023, 5, 1, 12, 30, tzinfo=timezone(timedelta(hours=2))),
+        timedelta(days=1, seconds=5, microseconds=7), Decimal('0.25'), {'start_offset': None}),
+    Row(2, None, None, None, None, None),
+]
+
+
+class Broken(doctor.Rule):
+    """Rule failing with an error that is not a database error."""
+
+    relations = ('example',)
+    message = "Row {id} is broken."
+
+    def evaluate(self, snapshot):
+        """Fail on the first row."""
+        for row in snapshot['example']:
+            yield {'id': row.missing}
+
+
+class Working(doctor.Rule):
+    """Rule reporting all rows."""
+
+    relations = ('example',)
+    message = "Row {id} is named {name}."
+
+    def evaluate(self, snapshot):
+        """Report all rows."""
+        for row in snapshot['example']:
+            yield {'id': row.id, 'name': row.name}
+
+
+class Queried(doctor.Rule):
+    """Rule reporting the captured result of its query."""
+
+    query = "SELECT 1 AS id"
+    message = "Row {id} was queried."
+
+
+class Missing(doctor.Rule):
+    """Rule with a query that is not part of the capture."""
+
+    query = "SELECT 1 AS id"
+    message = "Row {id} is missing."
+
+
+class TestCapture(unittest.TestCase):
+    """Test writing and reading capture files."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.capture')
+        os.close(handle)
+        capabilities = Capabilities(150003, {'timescaledb': '2.11.0'},
+                                    ['_timescaledb_catalog.hypertable'])
+        tables = {'example': Table(ROWS, 'id', list(Row._fields))}
+        results = {'capture_test.Queried': Table([(1,), (2,)], None, ['id'])}
+        write_capture(self.path, capabilities, tables, results)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_round_trip(self):
+        """Test that relations are read back with the same values and types."""
+        with CaptureFile(self.path) as capture_file:
+            table = capture_file.table('example')
+            self.assertEqual([tuple(row) for row in table], [tuple(row) for row in ROWS])
+            self.assertEqual(table.get(1).created, ROWS[0].created)
+            self.assertEqual(table.columns, list(Row._fields))
+            self.assertIn('timescaledb', capture_file.capabilities().extensions)
+            with self.assertRaises(LookupError):
+                capture_file.table('pg_stats')
+            self.assertEqual(capture_file.results('capture_test.Queried'), [{'id': 1}, {'id': 2}])
+
+    def test_version(self):
+        """Test that captures in another format version are rejected."""
+        with open(self.path, 'r+b') as outfile:
+            outfile.write(HEADER.pack(b'TSDRCAP1', 0))
+        with self.assertRaisesRegex(ValueError, "version 1"):
+            CaptureFile(self.path)
+        with open(self.path, 'r+b') as outfile:
+            outfile.write(HEADER.pack(b'PGDMP\0\0\0', 0))
+        with self.assertRaisesRegex(ValueError, "not a capture file"):
+            CaptureFile(self.path)
+
+    def test_failing_rule(self):
+        """Test that a failing rule does not stop the other rules."""
+        rules = {'example': {'Broken': Broken, 'Working': Working}}
+        with mock.patch('doctor.capture.RULES', rules):
+            results = {name: reports for _, name, reports in analyze(self.path)}
+        self.assertIsInstance(results['Broken'], AttributeError)
+        self.assertEqual(results['Working'], ["Row 1 is named one.", "Row 2 is named None."])
+
+    def test_query_rule(self):
+        """Test that rules with a query report their captured results."""
+        rules = {'capture_test': {'Queried': Queried, 'Missing': Missing}}
+        with mock.patch('doctor.capture.RULES', rules):
+            results = {name: reports for _, name, reports in analyze(self.path)}
+            records = {name: reports for _, name, reports in analyze(self.path, True)}
+        self.assertEqual(results['Queried'], ["Row 1 was queried.", "Row 2 was queried."])
+        self.assertEqual([record['fields'] for record in records['Queried']],
+                         [{'id': 1}, {'id': 2}])
+        self.assertIsInstance(results['Missing'], LookupError)
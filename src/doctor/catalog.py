@@ -0,0 +1,319 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshot of catalog relations shared between rules.
+
+Many rules need the same catalog relations, and reading them once for
+each rule is expensive on databases with many chunks. A snapshot reads
+each catalog relation once, in bulk, and keeps the rows in memory so
+that rules can evaluate their checks in Python.
+
+Rules that use the snapshot declare the relations they need in the
+`relations` field and define an `evaluate` method that receives the
+snapshot and yields one dictionary for each mismatching object::
+
+    @doctor.register
+    class DuplicateIndex(doctor.Rule):
+        relations: tuple = ('pg_index', 'pg_class')
+
+        def evaluate(self, snapshot):
+            for index in snapshot['pg_index']:
+                ...
+
+The relations of the catalog are also part of a capture, see
+`doctor.capture`, so that these rules can be evaluated offline.
+"""
+
+import threading
+import time
+
+from collections import namedtuple
+from contextlib import ExitStack
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import NamedTupleCursor
+
+# The relations that can be part of a snapshot. The query is used to
+# read the relation and the key is the column that uniquely identifies
+# each row. If `requires` is set, the relation is only read if that
+# table exists, otherwise it is empty.
+CatalogRelation = namedtuple('CatalogRelation', ['query', 'key', 'requires'])
+
+CATALOG = {
+    'pg_class': CatalogRelation("""
+SELECT c.oid, c.oid::regclass::text AS name, relname, nspname,
+       relkind, relam, relpages, reltuples, relacl::text AS relacl
+  FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+""", 'oid', None),
+    'pg_index': CatalogRelation("""
+SELECT indexrelid, indrelid, indisunique, indisprimary, indnkeyatts,
+       indkey::int2[] AS indkey,
+       indclass::oid[] AS indclass,
+       indcollation::oid[] AS indcollation,
+       indoption::int2[] AS indoption,
+       pg_get_expr(indexprs, indrelid) AS indexprs,
+       pg_get_expr(indpred, indrelid) AS indpred
+  FROM pg_catalog.pg_index
+""", 'indexrelid', None),
+    'pg_stat_user_indexes': CatalogRelation("""
+SELECT relid, indexrelid, schemaname, relname, indexrelname, idx_scan
+  FROM pg_catalog.pg_stat_user_indexes
+""", 'indexrelid', None),
+    'pg_stat_user_tables': CatalogRelation("""
+SELECT relid, schemaname, relname, seq_scan, idx_scan,
+       n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del, n_live_tup, n_dead_tup
+  FROM pg_catalog.pg_stat_user_tables
+""", 'relid', None),
+    'pg_inherits': CatalogRelation("""
+SELECT inhrelid, inhparent FROM pg_catalog.pg_inherits
+""", None, None),
+    'index_column': CatalogRelation("""
+SELECT i.indexrelid, k.position, k.attnum, a.attname, t.typname
+  FROM pg_catalog.pg_index i
+ CROSS JOIN unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+  LEFT JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+  LEFT JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+""", None, None),
+    'pg_stats': CatalogRelation("""
+SELECT schemaname, tablename, attname, inherited, n_distinct
+  FROM pg_catalog.pg_stats
+""", None, None),
+    'relation_size': CatalogRelation("""
+SELECT c.oid, pg_relation_size(c.oid) AS bytes, pg_total_relation_size(c.oid) AS total_bytes
+  FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+ WHERE relkind IN ('r', 'm', 'i', 'p', 'I')
+   AND nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+""", 'oid', None),
+    'pg_settings': CatalogRelation("""
+-- Settings with a unit of memory are converted to bytes by the server.
+SELECT name, setting, unit,
+       CASE WHEN unit ~ 'B$'
+            THEN setting::numeric * pg_size_bytes(CASE WHEN unit = 'B' THEN '1 bytes'
+                                                       WHEN unit ~ '^[0-9]' THEN unit
+                                                       ELSE '1' || unit END)
+       END::bigint AS bytes
+  FROM pg_catalog.pg_settings
+""", 'name', None),
+    'database': CatalogRelation("""
+SELECT d.oid, d.datname, now() AS now
+  FROM pg_catalog.pg_database d
+ WHERE d.datname = current_database()
+""", 'oid', None),
+    'hypertable': CatalogRelation("""
+SELECT id, schema_name, table_name, compressed_hypertable_id,
+       format('%I.%I', schema_name, table_name)::regclass::oid AS relid
+  FROM _timescaledb_catalog.hypertable
+""", 'id', '_timescaledb_catalog.hypertable'),
+    'chunk': CatalogRelation("""
+SELECT id, hypertable_id, schema_name, table_name, compressed_chunk_id,
+       to_regclass(format('%I.%I', schema_name, table_name))::oid AS relid
+  FROM _timescaledb_catalog.chunk
+ WHERE NOT dropped
+""", 'id', '_timescaledb_catalog.chunk'),
+    'chunk_index': CatalogRelation("""
+SELECT chunk_id, index_name, hypertable_id, hypertable_index_name
+  FROM _timescaledb_catalog.chunk_index
+""", None, '_timescaledb_catalog.chunk_index'),
+    # The catalog table behind this view was replaced in TimescaleDB
+    # 2.14, while the view is available in all versions since 2.0.
+    'compression_settings': CatalogRelation("""
+SELECT h.id AS hypertable_id, s.attname, s.segmentby_column_index, s.orderby_column_index
+  FROM timescaledb_information.compression_settings s
+  JOIN _timescaledb_catalog.hypertable h
+    ON h.schema_name = s.hypertable_schema AND h.table_name = s.hypertable_name
+""", None, 'timescaledb_information.compression_settings'),
+    'compression_chunk_size': CatalogRelation("""
+SELECT chunk_id, compressed_chunk_id,
+       uncompressed_heap_size, uncompressed_toast_size, uncompressed_index_size,
+       compressed_heap_size, compressed_toast_size, compressed_index_size,
+       numrows_pre_compression, numrows_post_compression
+  FROM _timescaledb_catalog.compression_chunk_size
+""", 'chunk_id', '_timescaledb_catalog.compression_chunk_size'),
+    'continuous_agg': CatalogRelation("""
+SELECT mat_hypertable_id, raw_hypertable_id, user_view_schema, user_view_name,
+       materialized_only
+  FROM _timescaledb_catalog.continuous_agg
+""", 'mat_hypertable_id', '_timescaledb_catalog.continuous_agg'),
+    'continuous_aggs_watermark': CatalogRelation("""
+SELECT mat_hypertable_id, watermark
+  FROM _timescaledb_catalog.continuous_aggs_watermark
+""", 'mat_hypertable_id', '_timescaledb_catalog.continuous_aggs_watermark'),
+    'bgw_job': CatalogRelation("""
+SELECT id, application_name, schedule_interval, scheduled, hypertable_id, proc_name, config,
+       CASE WHEN jsonb_typeof(config->'compress_after') = 'string'
+            THEN (config->>'compress_after')::interval END AS compress_after
+  FROM _timescaledb_config.bgw_job
+""", 'id', '_timescaledb_config.bgw_job'),
+    'bgw_job_stat': CatalogRelation("""
+SELECT job_id, last_start, last_finish, last_successful_finish,
+       total_runs, total_failures, consecutive_failures, total_duration
+  FROM _timescaledb_internal.bgw_job_stat
+""", 'job_id', '_timescaledb_internal.bgw_job_stat'),
+    'dimensions': CatalogRelation("""
+SELECT hypertable_schema, hypertable_name, dimension_number, column_name,
+       column_type::text AS column_type, time_interval
+  FROM timescaledb_information.dimensions
+""", None, 'timescaledb_information.dimensions'),
+    'chunks': CatalogRelation("""
+SELECT hypertable_schema, hypertable_name, chunk_schema, chunk_name,
+       range_start, range_end, is_compressed,
+       format('%I.%I', chunk_schema, chunk_name)::regclass::oid AS relid
+  FROM timescaledb_information.chunks
+""", None, 'timescaledb_information.chunks'),
+}
+
+
+class Table:
+    """In-memory copy of a catalog relation.
+
+    Rows are stored as named tuples. Lookup by key and grouping by a
+    column are computed on first use and then cached.
+    """
+
+    def __init__(self, rows, key=None, columns=None):
+        self.rows = rows
+        self.key = key
+        self.columns = columns or []
+        self._groups = {}
+        self._lookup = None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, key, default=None):
+        """Get the row with the given key."""
+        if self._lookup is None:
+            self._lookup = {getattr(row, self.key): row for row in self.rows}
+        return self._lookup.get(key, default)
+
+    def group(self, column):
+        """Get a dictionary from values of `column` to list of rows."""
+        if column not in self._groups:
+            groups = {}
+            for row in self.rows:
+                groups.setdefault(getattr(row, column), []).append(row)
+            self._groups[column] = groups
+        return self._groups[column]
+
+
+class Snapshot:
+    """Snapshot of catalog relations for one run.
+
+    Relations are read on demand using `load` and are read only once,
+    even if several rules running concurrently request them. If
+    `capabilities` is given, it is used to check what relations are
+    available instead of asking the server. The time in seconds it took
+    to read each relation is kept in `durations`.
+    """
+
+    def __init__(self, capabilities=None):
+        self.capabilities = capabilities
+        self.durations = {}
+        self._tables = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __getitem__(self, name):
+        return self._tables[name]
+
+    def __contains__(self, name):
+        return name in self._tables
+
+    def load(self, conn, names):
+        """Read the relations in `names` that are not already read.
+
+        The relations are read together using `fetch_tables`, so that
+        they are consistent with each other.
+        """
+        names = sorted(set(names))
+        with self._guard:
+            locks = [self._locks.setdefault(name, threading.Lock()) for name in names]
+        # The locks are taken in name order, so concurrent loads of
+        # overlapping relations cannot deadlock.
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            missing = [name for name in names if name not in self._tables]
+            if missing:
+                self._tables.update(fetch_tables(conn, missing, self.capabilities,
+                                                 self.durations))
+
+
+def fetch_tables(conn, names, capabilities=None, durations=None):
+    """Read several catalog relations from the database.
+
+    If the connection is not in a transaction, the relations are read
+    in a single REPEATABLE READ transaction, so that they are from the
+    same moment. Otherwise, they are read in the current transaction,
+    which is left open. If `durations` is given, the time in seconds
+    it took to read each relation is stored in it.
+
+    Returns a dictionary from relation name to `Table`.
+    """
+    if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+        return _fetch_timed(conn, names, capabilities, durations)
+    with conn.cursor() as cursor:
+        if conn.autocommit:
+            cursor.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        else:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+    try:
+        return _fetch_timed(conn, names, capabilities, durations)
+    finally:
+        if conn.autocommit:
+            with conn.cursor() as cursor:
+                cursor.execute("ROLLBACK")
+        else:
+            conn.rollback()
+
+
+def _fetch_timed(conn, names, capabilities, durations):
+    """Read catalog relations and record the time to read each one."""
+    tables = {}
+    for name in names:
+        start = time.monotonic()
+        tables[name] = fetch_table(conn, name, capabilities)
+        if durations is not None:
+            durations[name] = time.monotonic() - start
+    return tables
+
+
+def fetch_table(conn, name, capabilities=None):
+    """Read a catalog relation from the database."""
+    relation = CATALOG[name]
+    with conn.cursor(cursor_factory=NamedTupleCursor) as cursor:
+        if relation.requires is not None:
+            if capabilities is not None:
+                available = capabilities.has_relation(relation.requires)
+            else:
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS available",
+                               (relation.requires,))
+                available = cursor.fetchone().available
+            if not available:
+                return Table([], relation.key)
+        cursor.execute(relation.query)
+        return Table(cursor.fetchall(), relation.key,
+                     [desc.name for desc in cursor.description])
+
+
+def pretty_size(size):
+    """Format a size in bytes for a message, like pg_size_pretty()."""
+    for unit in ('bytes', 'kB', 'MB', 'GB'):
+        if size < 10 * 1024:
+            return f"{size} {unit}"
+        size = (size + 512) // 1024
+    return f"{size} TB"
@@ -14,35 +14,128 @@
 
 """Command-line interface to Timescale Doctor."""
 
+# Modules using the database driver are imported when they are
+# needed, so that listing rules is fast.
+# pylint: disable=import-outside-toplevel
+
 import argparse
 import getpass
 import os
 import configparser
 
-from doctor import check_rules, list_rules
+from doctor import check_rules, get_capabilities, get_conninfo, list_rules
+from doctor.manifest import rule_infos, select_modules
 from doctor.rules import load_rules
 
 
-def parse_arguments():
-    """Parse arguments to command-line tool."""
-    parser = argparse.ArgumentParser(description=__doc__, add_help=False)
+def add_connection_arguments(parser):
+    """Add arguments for the user, password, host, and port to a parser."""
     parser.add_argument('-U', '--username', dest='user',
                         default=(os.getenv("PGUSER") or getpass.getuser()),
                         help='user name to connect as')
     parser.add_argument('-W', '--password', dest='password',
                         default=os.getenv("PGPASSWORD"),
                         help='Password to use when connecting')
+    parser.add_argument('-p', '--port', metavar='PORT', default='5432',
+                        help='database server port number')
+    parser.add_argument('-h', '--host', metavar='HOSTNAME',
+                        help='database server host or socket directory')
+
+
+# Options that each mode would ignore, by the option selecting the
+# mode, in the order the modes take precedence.
+UNSUPPORTED = [
+    ('analyze', ('fetch_size', 'profile', 'sample', 'time_budget', 'statement_timeout',
+                 'lock_timeout', 'history')),
+    ('capture', ('rules', 'fetch_size', 'profile', 'time_budget', 'statement_timeout',
+                 'lock_timeout', 'history')),
+    ('state', ('time_budget', 'statement_timeout', 'lock_timeout', 'history')),
+    ('watch', ('fetch_size', 'profile', 'sample', 'time_budget', 'lock_timeout', 'history')),
+    ('targets', ('profile', 'history')),
+]
+
+
+def check_unsupported(parser, args):
+    """Reject options that the selected mode would ignore."""
+    for mode, options in UNSUPPORTED:
+        if getattr(args, mode):
+            for option in options:
+                if getattr(args, option) not in (None, '*'):
+                    name = "'--dsn' or a service pattern" if mode == 'targets' else f"'--{mode}'"
+                    parser.error(f"called with '--{option.replace('_', '-')}' together "
+                                 f"with {name}, which does not support it")
+            return
+
+
+def parse_arguments():
+    """Parse arguments to command-line tool."""
+    parser = argparse.ArgumentParser(description=__doc__, add_help=False)
+    add_connection_arguments(parser)
     parser.add_argument('-s', '--service', metavar="NAME",
-                        help="Service used. Read from ~/.pg_services.conf")
+                        help=("Service used. Read from ~/.pg_services.conf. "
+                              "If this is a glob pattern, all matching services are checked"))
+    parser.add_argument('--dsn', metavar='DSN', dest='dsns', action='append',
+                        help=("connection string for a database to check, "
+                              "can be given multiple times to check several databases"))
     parser.add_argument('-d', '--dbname', metavar='DBNAME', dest='dbname',
                         help='name of the database to connect to')
     parser.add_argument('dbname', metavar='DBNAME', nargs='?',
                         default=(os.getenv("PGDATABASE") or getpass.getuser()),
                         help='name of the database to connect to')
-    parser.add_argument('-p', '--port', metavar='PORT', default='5432',
-                        help='database server port number')
-    parser.add_argument('-h', '--host', metavar='HOSTNAME',
-                        help='database server host or socket directory')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                        help=('number of rules to run concurrently, '
+                              'each using a separate connection. When checking '
+                              'several databases, the number of databases to '
+                              'check concurrently'))
+    parser.add_argument('--host-limit', metavar='N', type=int, default=None,
+                        help=('maximum number of databases on the same host to '
+                              'check concurrently when checking several databases'))
+    parser.add_argument('--fetch-size', metavar='ROWS', type=int, default=None,
+                        help=('read rule results through server-side cursors, '
+                              'fetching ROWS rows at a time'))
+    parser.add_argument('--format', choices=['text', 'json', 'ndjson'], default='text',
+                        help=("output format for findings. With 'ndjson', each finding is "
+                              "written as a JSON object on a separate line as soon as it is "
+                              "found, and with 'json' all findings are written as a JSON "
+                              "array. Each object contains the rule, the fields of the "
+                              "finding, and the message, detail, and hint"))
+    parser.add_argument('--profile', nargs='?', const='time', choices=['time', 'explain'],
+                        default=None,
+                        help=("print a report with execution time, rows, and bytes for "
+                              "each rule. With 'explain', also execute each rule query "
+                              "using EXPLAIN (ANALYZE, BUFFERS) to get server time and "
+                              "buffer usage"))
+    parser.add_argument('--sample', metavar='CHUNKS', type=int, default=None,
+                        help=("examine a sample of the chunks of each hypertable in rules "
+                              "that look at every chunk: the CHUNKS newest chunks, the "
+                              "CHUNKS oldest chunks, and CHUNKS random chunks in between. "
+                              "Counts are then estimates with a margin of error. By "
+                              "default, all chunks are examined"))
+    parser.add_argument('--time-budget', metavar='SECONDS', type=float, default=None,
+                        help=("time budget for checking all rules. Cheap rules are "
+                              "executed first, and rules that do not complete within "
+                              "the budget are canceled and reported"))
+    parser.add_argument('--statement-timeout', metavar='SECONDS', type=float, default=None,
+                        help='maximum time for each rule query')
+    parser.add_argument('--lock-timeout', metavar='SECONDS', type=float, default=None,
+                        help='maximum time for each rule to wait for a lock')
+    parser.add_argument('--history', metavar='FILE', default=None,
+                        help=("file with execution times of rules from previous runs, "
+                              "used to order rules with a time budget. It is updated "
+                              "after each run"))
+    parser.add_argument('--state', metavar='FILE', default=None,
+                        help=("check rules incrementally using the state in FILE. Only "
+                              "rules whose inputs changed since the previous run are "
+                              "executed, and only new and resolved findings are shown"))
+    parser.add_argument('--watch', action='store_true',
+                        help=("check rules continuously on a persistent connection, each "
+                              "rule at its own interval, and serve the findings and "
+                              "execution times as Prometheus metrics"))
+    parser.add_argument('--interval', metavar='SECONDS', type=float, default=60.0,
+                        help=("with '--watch', the interval between executions of rules "
+                              "that do not define their own interval"))
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, default=9188,
+                        help="with '--watch', local port to serve metrics on")
     parser.add_argument('--help', action='help', default=argparse.SUPPRESS,
                         help='show this help message and exit')
     parser.add_argument("--verbose", "-v", dest="log_level",
@@ -52,6 +145,18 @@ def parse_arguments():
                         default=argparse.SUPPRESS,
                         help=("List rules matching pattern. "
                               "If no pattern is given, will list all rules"))
+    parser.add_argument('-r', '--rules', metavar='PATTERN', default='*',
+                        help=("only check rules matching PATTERN. Only the rule "
+                              "modules containing matching rules are loaded"))
+    parser.add_argument("--probe", action="store_true",
+                        help=("Together with '--list', connect to the database and "
+                              "show which rules are skipped for it"))
+    parser.add_argument('--capture', metavar='FILE',
+                        help=("capture the catalogs and statistics needed by the rules "
+                              "to FILE instead of checking the rules"))
+    parser.add_argument('--analyze', metavar='FILE',
+                        help=("check the rules against a capture in FILE "
+                              "without connecting to a database"))
     parser.add_argument('--sslmode', metavar='MODE',
                         default=os.getenv("PGSSLMODE"),
                         help='mode for negotiating SSL connection')
@@ -64,28 +169,91 @@ def parse_arguments():
 
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        parser.error("argument -j/--jobs: must be at least 1")
+    if args.host_limit is not None and args.host_limit < 1:
+        parser.error("argument --host-limit: must be at least 1")
+    if args.fetch_size is not None and args.fetch_size < 1:
+        parser.error("argument --fetch-size: must be at least 1")
+    if args.sample is not None and args.sample < 1:
+        parser.error("argument --sample: must be at least 1")
+    for option in ('time_budget', 'statement_timeout', 'lock_timeout'):
+        if getattr(args, option) is not None and getattr(args, option) <= 0:
+            parser.error(f"argument --{option.replace('_', '-')}: must be greater than 0")
+
+    set_targets(parser, args)
+    check_unsupported(parser, args)
+    return parser, args
+
+
+def set_targets(parser, args):
+    """Set connection parameters or the databases to check from services and DSNs."""
+    args.targets = None
     if args.service is not None:
         config = configparser.ConfigParser()
         config.read(os.path.expanduser('~/.pg_service.conf'))
-        args.host = config.get(args.service, 'host')
-        args.port = config.get(args.service, 'port')
-        args.user = config.get(args.service, 'user')
-        args.password = config.get(args.service, 'password')
-        args.dbname = config.get(args.service, 'dbname')
-        args.sslmode = config.get(args.service, 'sslmode', fallback=None)
-
-    return parser, args
+        if args.dsns or any(char in args.service for char in '*?['):
+            from doctor.fleet import service_targets
+            args.targets = service_targets(config, args.service)
+            if not args.targets:
+                parser.error(f"no service matching '{args.service}'")
+        else:
+            args.host = config.get(args.service, 'host')
+            args.port = config.get(args.service, 'port')
+            args.user = config.get(args.service, 'user')
+            args.password = config.get(args.service, 'password')
+            args.dbname = config.get(args.service, 'dbname')
+            args.sslmode = config.get(args.service, 'sslmode', fallback=None)
+    if args.dsns:
+        from doctor.fleet import dsn_target
+        args.targets = (args.targets or []) + [dsn_target(dsn) for dsn in args.dsns]
 
 
 def main():
     """Run application."""
-    load_rules()
     parser, args = parse_arguments()
     if args.show and 'list' not in args:
         parser.error("called with '--show' but without '--list'")
+    elif args.probe and 'list' not in args:
+        parser.error("called with '--probe' but without '--list'")
+    elif args.format != 'text' and (args.capture or args.watch):
+        parser.error("called with '--format' together with '--capture' or '--watch', "
+                     "which do not print findings")
+    elif args.state and args.targets:
+        parser.error("called with '--state' together with '--dsn' or a service "
+                     "pattern, but the state is kept for a single database")
     elif 'list' in args:
         if args.show is None:
             args.show = 'brief'
-        list_rules(args.list, args.show)
+        capabilities = get_capabilities(args) if args.probe else None
+        list_rules(rule_infos(), args.list, args.show, capabilities)
+    elif args.analyze:
+        from doctor.capture import check_capture
+        load_rules(select_modules(args.rules))
+        check_capture(args.analyze, args.format, args.rules)
+    elif args.capture:
+        from doctor.capture import capture_database
+        load_rules()
+        capture_database(get_conninfo(args), args.capture, args.sample)
+    elif args.state:
+        from doctor.profile import Profile
+        from doctor.state import check_incremental
+        load_rules(select_modules(args.rules))
+        profile = Profile(explain=args.profile == 'explain') if args.profile else None
+        check_incremental(get_conninfo(args), args.state, args.format, args.rules,
+                          fetch_size=args.fetch_size, profile=profile, sample=args.sample)
+    elif args.watch:
+        from doctor.watch import select_rules, watch
+        load_rules(select_modules(args.rules))
+        watch(get_conninfo(args), select_rules(args.rules), args.interval,
+              args.metrics_port, args.statement_timeout)
+    elif args.targets:
+        from doctor.fleet import check_fleet
+        load_rules(select_modules(args.rules))
+        limits = (args.time_budget, args.statement_timeout, args.lock_timeout)
+        check_fleet(args.targets, args.jobs, args.host_limit, args.format,
+                    pattern=args.rules, fetch_size=args.fetch_size, sample=args.sample,
+                    limits=limits if any(limit is not None for limit in limits) else None)
     else:
+        load_rules(select_modules(args.rules))
         check_rules(args)
@@ -0,0 +1,156 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Check rules on a fleet of databases.
+
+A fleet is a list of targets, each of which is a database to check.
+Targets can be given as connection strings or as service names from
+the service file. All targets are checked concurrently from a single
+process, and the result for each database is printed as soon as it is
+complete.
+"""
+
+import io
+import sys
+
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import fnmatch
+
+from psycopg2.extensions import make_dsn, parse_dsn
+
+from doctor import run_rules, print_records, print_reports
+from doctor.schedule import Scheduler
+
+Target = namedtuple('Target', ['name', 'host', 'conninfo'])
+
+
+def dsn_target(dsn):
+    """Create a target from a connection string.
+
+    The password is removed from the connection string when used as
+    name of the target, since the name is printed in the output.
+    """
+    params = parse_dsn(dsn)
+    params.pop('password', None)
+    return Target(make_dsn(**params), params.get('host', 'localhost'), {'dsn': dsn})
+
+
+def service_targets(config, pattern):
+    """Create targets for all services matching pattern.
+
+    The `config` is a `ConfigParser` with the service file contents
+    and the `pattern` is a glob pattern for the service names.
+    """
+    return [Target(name, config.get(name, 'host', fallback='localhost'), dict(config[name]))
+            for name in config.sections() if fnmatch(name, pattern)]
+
+
+def _with_target(results, target):
+    """Add the name of the target to the records of `run_rules`."""
+    for category, name, records in results:
+        if not isinstance(records, Exception):
+            records = (dict(record, target=target.name) for record in records)
+        yield category, name, records
+
+
+def check_target(target, output='text', pattern='*', limits=None, **options):
+    """Check rules for a target and return the output as a string.
+
+    Returns a tuple ``(output, failed)`` where `failed` is the list of
+    failed rules returned by `print_reports`. Unless `output` is
+    'text', the output is one JSON record per line, as printed by
+    `print_records`, with the name of the target in the ``target``
+    field of each record.
+
+    Only rules matching `pattern` are checked and the options are
+    passed to `doctor.run_rules`. If `limits` is given, it is a tuple
+    with the time budget, statement timeout, and lock timeout of a
+    `doctor.schedule.Scheduler` created for the target, so that each
+    target has a budget of its own.
+    """
+    scheduler = Scheduler(*limits) if limits is not None else None
+    out = io.StringIO()
+    if output == 'text':
+        results = run_rules(target.conninfo, 1, scheduler, pattern, **options)
+        failed = print_reports(results, file=out)
+    else:
+        results = run_rules(target.conninfo, 1, scheduler, pattern, records=True, **options)
+        failed = print_records(_with_target(results, target), file=out)
+    return out.getvalue(), failed
+
+
+def scan_fleet(targets, jobs=1, host_limit=None, output='text', **options):
+    """Check targets concurrently and yield results as they complete.
+
+    At most `jobs` targets are checked concurrently, and at most
+    `host_limit` of them are on the same host. Each item is a tuple
+    ``(target, result)`` where `result` is either the return value of
+    `check_target` or the exception if checking the target failed, so
+    that a failing target does not stop the other targets. The options
+    are passed to `check_target`.
+    """
+    pending = deque(targets)
+    running = {}
+    per_host = Counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            # Start as many targets as possible, skipping targets on
+            # hosts that already have enough connections.
+            for _ in range(len(pending)):
+                if len(running) >= jobs:
+                    break
+                target = pending.popleft()
+                if host_limit is not None and per_host[target.host] >= host_limit:
+                    pending.append(target)
+                    continue
+                per_host[target.host] += 1
+                running[executor.submit(check_target, target, output, **options)] = target
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = running.pop(future)
+                per_host[target.host] -= 1
+                try:
+                    result = future.result()
+                except Exception as err: # pylint: disable=broad-exception-caught
+                    result = err
+                yield target, result
+
+
+def check_fleet(targets, jobs=1, host_limit=None, output='text', **options):
+    """Check rules for all targets and print the results.
+
+    See `doctor.print_results` for the output formats. With 'json',
+    the records of all targets are printed as a single JSON array. The
+    options are passed to `check_target`.
+    """
+    count = 0
+    for target, result in scan_fleet(targets, jobs, host_limit, output, **options):
+        if isinstance(result, Exception):
+            print(f"[{target.name}] check failed: {result}".rstrip(), file=sys.stderr)
+            continue
+        text, failed = result
+        if output == 'text':
+            print(f"[{target.name}]")
+            print(text, end="", flush=True)
+        elif output == 'json':
+            for line in text.splitlines():
+                print(',\n' if count else '[', line, sep='', end='', flush=True)
+                count += 1
+        else:
+            print(text, end="", flush=True)
+        for fullname, error in failed:
+            print(f"[{target.name}] rule {fullname} failed: {error}".rstrip(), file=sys.stderr)
+    if output == 'json':
+        print(']' if count else '[]')
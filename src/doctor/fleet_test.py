@@ -0,0 +1,68 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for checking a fleet of databases."""
+
+import json
+import unittest
+
+from unittest import mock
+
+from doctor.fleet import Target, check_target, scan_fleet
+
+
+def _check(target, output='text'):
+    """Check a target without connecting, failing for the target 'bad'."""
+    if target.name == 'bad':
+        raise RuntimeError("unexpected")
+    return f"{output} output for {target.name}", []
+
+
+class TestFleet(unittest.TestCase):
+    """Test scanning a fleet of databases."""
+
+    def test_failing_target(self):
+        """Test that a failing target does not stop the other targets."""
+        targets = [Target(name, 'localhost', {}) for name in ('one', 'bad', 'two')]
+        with mock.patch('doctor.fleet.check_target', _check):
+            results = {target.name: result
+                       for target, result in scan_fleet(targets, jobs=2, host_limit=1)}
+        self.assertEqual(results['one'], ("text output for one", []))
+        self.assertEqual(results['two'], ("text output for two", []))
+        self.assertIsInstance(results['bad'], RuntimeError)
+
+    def test_records(self):
+        """Test that records of a target contain the name of the target."""
+        error = RuntimeError("failed")
+        results = [('index', 'UnusedIndex', [{'rule': 'index.UnusedIndex', 'message': "unused"}]),
+                   ('index', 'DuplicateIndex', error)]
+        with mock.patch('doctor.fleet.run_rules', return_value=results):
+            output, failed = check_target(Target('one', 'localhost', {}), 'ndjson')
+        self.assertEqual([json.loads(line) for line in output.splitlines()],
+                         [{'rule': 'index.UnusedIndex', 'message': "unused", 'target': 'one'}])
+        self.assertEqual(failed, [('index.DuplicateIndex', error)])
+
+    def test_options(self):
+        """Test that options are passed on and each target has its own budget."""
+        targets = [Target(name, 'localhost', {}) for name in ('one', 'two')]
+        with mock.patch('doctor.fleet.run_rules', return_value=[]) as run_rules:
+            list(scan_fleet(targets, pattern='index.*', limits=(10.0, 2.0, None), sample=5))
+        self.assertEqual(run_rules.call_count, 2)
+        schedulers = set()
+        for call in run_rules.call_args_list:
+            _, jobs, scheduler, pattern = call.args
+            self.assertEqual((jobs, pattern, call.kwargs), (1, 'index.*', {'sample': 5}))
+            self.assertEqual((scheduler.budget, scheduler.statement_timeout), (10.0, 2.0))
+            schedulers.add(id(scheduler))
+        self.assertEqual(len(schedulers), 2)
@@ -0,0 +1,96 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Manifest of all rules.
+
+The manifest describes each rule with its category, name, description,
+messages, and dependencies, so that rules can be listed and selected
+without importing the rule modules or the database driver. It is
+generated from the rule modules and stored in the rules package::
+
+    python -m doctor.manifest
+
+Rule modules that are not part of the manifest, for example because
+they were added after the manifest was generated, are imported and
+described when reading the manifest, so a stale manifest is slower
+but still complete.
+"""
+
+import json
+import sys
+
+from collections import namedtuple
+from fnmatch import fnmatch
+from inspect import cleandoc
+from os.path import dirname, exists, join
+
+from doctor import RULES
+from doctor.rules import load_rules, rule_modules
+
+MANIFEST = join(dirname(__file__), 'rules', 'manifest.json')
+
+# Description of a rule. The fields are the same as the fields of the
+# rule class, with `doc` being the docstring without indentation.
+# Fields that the rule does not define are None, except
+# `dependencies`, which is empty.
+RuleInfo = namedtuple('RuleInfo', ['category', 'name', 'doc', 'message',
+                                   'detail', 'hint', 'dependencies'])
+
+
+def describe(cls):
+    """Get the description of a rule class."""
+    return RuleInfo(cls.__module__.rpartition('.')[2], cls.__name__, cleandoc(cls.__doc__),
+                    cls.message, getattr(cls, 'detail', None), getattr(cls, 'hint', None),
+                    dict(getattr(cls, 'dependencies', {})))
+
+
+def generate(path=MANIFEST):
+    """Load all rules and write the manifest to `path`."""
+    load_rules()
+    infos = [describe(cls)._asdict() for rules in RULES.values() for cls in rules.values()]
+    infos.sort(key=lambda info: (info['category'], info['name']))
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(infos, outfile, indent=2)
+        outfile.write('\n')
+
+
+def rule_infos(path=MANIFEST):
+    """Get the descriptions of all rules.
+
+    Rules are read from the manifest in `path`. Rule modules that are
+    not part of the manifest are imported and their rules described.
+    """
+    modules = rule_modules()
+    entries = []
+    if exists(path):
+        with open(path, 'r', encoding='utf-8') as infile:
+            entries = json.load(infile)
+    infos = [RuleInfo(**entry) for entry in entries if entry['category'] in modules]
+    known = {info.category for info in infos}
+    missing = [module for module in modules if module not in known]
+    if missing:
+        load_rules(missing)
+        infos.extend(describe(cls) for module in missing
+                     for cls in RULES.get(module, {}).values())
+    return sorted(infos, key=lambda info: (info.category, info.name))
+
+
+def select_modules(pattern, path=MANIFEST):
+    """Get the rule modules with rules matching `pattern`."""
+    return sorted({info.category for info in rule_infos(path)
+                   if fnmatch(f"{info.category}.{info.name}", pattern)})
+
+
+if __name__ == '__main__':
+    generate(sys.argv[1] if len(sys.argv) > 1 else MANIFEST)
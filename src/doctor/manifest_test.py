@@ -0,0 +1,53 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the rule manifest."""
+
+import json
+import os
+import tempfile
+import unittest
+
+from doctor.manifest import MANIFEST, generate, rule_infos, select_modules
+
+
+class TestManifest(unittest.TestCase):
+    """Test the rule manifest."""
+
+    def test_up_to_date(self):
+        """Test that the manifest matches the rule modules."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'manifest.json')
+            generate(path)
+            with open(path, 'r', encoding='utf-8') as infile:
+                expected = json.load(infile)
+        with open(MANIFEST, 'r', encoding='utf-8') as infile:
+            self.assertEqual(json.load(infile), expected,
+                             "manifest is stale, run 'python -m doctor.manifest'")
+
+    def test_missing_modules(self):
+        """Test that rule modules missing from the manifest are described."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'manifest.json')
+            with open(path, 'w', encoding='utf-8') as outfile:
+                json.dump([], outfile)
+            names = {f"{info.category}.{info.name}" for info in rule_infos(path)}
+        self.assertIn('index.DuplicateIndex', names)
+        self.assertIn('hypertable.ChunkPermissions', names)
+
+    def test_select_modules(self):
+        """Test selecting rule modules using a pattern."""
+        self.assertEqual(select_modules('index.*'), ['index'])
+        self.assertEqual(select_modules('*.DuplicateIndex'), ['index'])
+        self.assertEqual(select_modules('nothing.*'), [])
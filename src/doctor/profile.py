@@ -0,0 +1,147 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiling of rule execution.
+
+The profile records, for each rule, the time spent executing the rule,
+the time spent waiting for rows, the time spent formatting messages,
+and the number of rows and bytes returned. Bytes are counted as the
+length of the text representation of each value, which is close to
+what is transferred by the server.
+
+Reading the catalog snapshot is shared by all rules evaluated on it,
+so the time to read each relation is recorded separately, as an entry
+named ``snapshot:`` followed by the name of the relation.
+
+If the profile is created with `explain` set, the query of each rule
+is also executed using ``EXPLAIN (ANALYZE, BUFFERS)`` to get the
+execution time on the server and the number of buffers used. Note
+that this executes each query twice, and the time waiting for rows
+then includes the time for the explain.
+"""
+
+import json
+import threading
+import time
+
+from dataclasses import dataclass
+
+from psycopg2.extensions import cursor as TupleCursor
+
+
+@dataclass
+# pylint: disable-next=too-many-instance-attributes
+class RuleProfile:
+    """Profile for a single rule.
+
+    All times are in seconds. The server time, planning time, and
+    buffers are only available when using explain.
+    """
+
+    name: str
+    wall: float = 0.0
+    query: float = 0.0
+    format: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+    server: float = None
+    planning: float = None
+    shared_hit: int = None
+    shared_read: int = None
+
+
+class Profile:
+    """Profile for all rules in a run."""
+
+    def __init__(self, explain=False):
+        self.explain = explain
+        self.rules = {}
+        self._lock = threading.Lock()
+
+    def rule(self, name):
+        """Get the profile for a rule, creating it if necessary."""
+        with self._lock:
+            return self.rules.setdefault(name, RuleProfile(name))
+
+    def measure(self, name, rows, render):
+        """Render rows and record the profile for a rule.
+
+        This is a generator that yields the result of `render` for
+        each row, for example the formatted message in the same way as
+        `doctor.Rule.execute`.
+        """
+        stats = self.rule(name)
+        start = time.perf_counter()
+        rows = iter(rows)
+        while True:
+            before = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                stats.query += time.perf_counter() - before
+                break
+            after = time.perf_counter()
+            message = render(row)
+            stats.query += after - before
+            stats.format += time.perf_counter() - after
+            stats.rows += 1
+            stats.bytes += sum(len(str(value)) for value in row.values() if value is not None)
+            yield message
+        stats.wall += time.perf_counter() - start
+
+    def record_snapshot(self, snapshot):
+        """Record the time, rows, and bytes of each relation in a snapshot."""
+        for name, duration in snapshot.durations.items():
+            if name not in snapshot:
+                continue
+            stats = self.rule(f"snapshot:{name}")
+            stats.wall += duration
+            stats.query += duration
+            stats.rows += len(snapshot[name])
+            stats.bytes += sum(len(str(value)) for row in snapshot[name]
+                               for value in row if value is not None)
+
+    def analyze(self, name, conn, query):
+        """Execute query using EXPLAIN ANALYZE and record the result."""
+        stats = self.rule(name)
+        query = query.strip().rstrip(';')
+        with conn.cursor(cursor_factory=TupleCursor) as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}")
+            result = cursor.fetchone()[0]
+        # The JSON format is parsed by psycopg2, but older versions
+        # return it as a string.
+        if isinstance(result, str):
+            result = json.loads(result)
+        plan = result[0]
+        stats.server = plan['Execution Time'] / 1000.0
+        stats.planning = plan['Planning Time'] / 1000.0
+        stats.shared_hit = plan['Plan'].get('Shared Hit Blocks')
+        stats.shared_read = plan['Plan'].get('Shared Read Blocks')
+
+    def report(self, file=None):
+        """Print a report with the rules sorted by wall time."""
+        def fmt(value, spec):
+            return '-' if value is None else format(value, spec)
+        header = (f"{'rule':<40} {'wall':>9} {'query':>9} {'server':>9} {'format':>9}"
+                  f" {'rows':>9} {'bytes':>11}")
+        if self.explain:
+            header += f" {'hit':>9} {'read':>9}"
+        print(header, file=file)
+        for stats in sorted(self.rules.values(), key=lambda stats: stats.wall, reverse=True):
+            line = (f"{stats.name:<40} {stats.wall:9.3f} {stats.query:9.3f}"
+                    f" {fmt(stats.server, '9.3f'):>9} {stats.format:9.3f}"
+                    f" {stats.rows:9d} {stats.bytes:11d}")
+            if self.explain:
+                line += f" {fmt(stats.shared_hit, '9d'):>9} {fmt(stats.shared_read, '9d'):>9}"
+            print(line, file=file)
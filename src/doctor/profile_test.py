@@ -0,0 +1,78 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for profiling of rule execution."""
+
+import io
+import unittest
+
+from collections import namedtuple
+from unittest import mock
+
+from doctor.catalog import Snapshot, Table
+from doctor.profile import Profile
+
+Row = namedtuple('Row', ['oid', 'relname'])
+
+
+# pylint: disable-next=unused-argument
+def fetch_tables(conn, names, capabilities=None, durations=None):
+    """Read each relation with two rows in 0.5 seconds."""
+    durations.update((name, 0.5) for name in names)
+    return {name: Table([Row(1, 'one'), Row(2, None)], 'oid') for name in names}
+
+
+class TestProfile(unittest.TestCase):
+    """Test recording and reporting profiles."""
+
+    def test_measure(self):
+        """Test that rows are rendered and counted."""
+        profile = Profile()
+        rows = [{'name': 'abc', 'size': 1234}, {'name': 'de', 'size': None}]
+        messages = list(profile.measure('index.UnusedIndex', rows, lambda row: row['name']))
+        self.assertEqual(messages, ['abc', 'de'])
+        stats = profile.rules['index.UnusedIndex']
+        self.assertEqual(stats.rows, 2)
+        self.assertEqual(stats.bytes, len('abc') + len('1234') + len('de'))
+        self.assertGreaterEqual(stats.wall, stats.query + stats.format)
+        self.assertIsNone(stats.server)
+
+    def test_snapshot(self):
+        """Test that each relation of the snapshot is recorded."""
+        profile = Profile()
+        snapshot = Snapshot()
+        with mock.patch('doctor.catalog.fetch_tables', fetch_tables):
+            snapshot.load(None, ['pg_class', 'pg_index'])
+        profile.record_snapshot(snapshot)
+        stats = profile.rules['snapshot:pg_class']
+        self.assertEqual((stats.wall, stats.query, stats.rows), (0.5, 0.5, 2))
+        self.assertEqual(stats.bytes, len('1') + len('one') + len('2'))
+        self.assertIn('snapshot:pg_index', profile.rules)
+
+    def test_report(self):
+        """Test that rules are reported by wall time, descending."""
+        profile = Profile(explain=True)
+        profile.rule('index.UnusedIndex').wall = 1.0
+        profile.rule('index.DuplicateIndex').wall = 2.0
+        profile.rule('index.DuplicateIndex').shared_hit = 17
+        output = io.StringIO()
+        profile.report(file=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['rule', 'wall', 'query', 'server', 'format', 'rows', 'bytes',
+                          'hit', 'read'])
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         ['index.DuplicateIndex', 'index.UnusedIndex'])
+        self.assertEqual(lines[1].split()[-2:], ['17', '-'])
+        self.assertEqual(lines[2].split()[3], '-')
@@ -0,0 +1,67 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for executing rules."""
+
+import doctor
+
+from doctor import Context
+from doctor.unittest import PostgreSQLTestCase
+
+
+class Numbers(doctor.Rule):
+    """Rule with a finding for each of many rows."""
+
+    query = "SELECT n FROM generate_series(1, 1000) AS n"
+    message = "Row {n}."
+
+
+# pylint: disable-next=too-few-public-methods
+class Recording:
+    """Connection that records the cursors created on it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursors = []
+
+    def cursor(self, *args, **kwargs):
+        """Create a cursor on the connection and record it."""
+        cursor = self.conn.cursor(*args, **kwargs)
+        self.cursors.append(cursor)
+        return cursor
+
+
+class TestFetchSize(PostgreSQLTestCase):
+    """Test reading rule results through server-side cursors."""
+
+    def test_named_cursor(self):
+        """Test that findings are produced before the result is read."""
+        conn = Recording(self.connection)
+        findings = Numbers().execute(conn, Numbers.message, Context(fetch_size=10))
+        self.assertEqual(next(findings), "Row 1.")
+        cursor = conn.cursors[0]
+        self.assertEqual(cursor.name, 'doctor_numbers')
+        self.assertEqual(cursor.itersize, 10)
+        # The cursor is still open on the server, since only the first
+        # batch of rows has been read.
+        with self.connection.cursor() as other:
+            other.execute("SELECT name FROM pg_cursors")
+            self.assertIn('doctor_numbers', [row['name'] for row in other])
+        self.assertEqual(len(list(findings)), 999)
+
+    def test_client_cursor(self):
+        """Test that results are read at once without a fetch size."""
+        conn = Recording(self.connection)
+        self.assertEqual(len(list(Numbers().execute(conn, Numbers.message))), 1000)
+        self.assertIsNone(conn.cursors[0].name)
@@ -17,6 +17,12 @@
 This is the package containing all rules. To add an additional rule,
 add a separate file to this directory and define any rules you deem
 necessary.
+
+The rules are described in ``manifest.json`` in this directory, which
+is used to list and select rules without importing the rule modules.
+After adding or changing a rule, regenerate the manifest using::
+
+    python -m doctor.manifest
 """
 
 import glob
@@ -32,10 +38,18 @@ def is_rule_file(fname):
         return False
     return True
 
-def load_rules():
-    """Load all rules from package."""
-    # Add all files in this directory to be loaded, except __init__.py
+def rule_modules():
+    """Get the names of all rule modules in the package."""
     pyfiles = glob.glob(join(dirname(__file__), "*.py"))
-    modules = [basename(f)[:-3] for f in pyfiles if is_rule_file(f)]
+    return sorted(basename(f)[:-3] for f in pyfiles if is_rule_file(f))
+
+def load_rules(modules=None):
+    """Load rules from package.
+
+    If `modules` is given, only the rule modules with these names are
+    loaded, otherwise all rule modules are loaded.
+    """
+    if modules is None:
+        modules = rule_modules()
     for module in modules:
         importlib.import_module(f".{module}", __name__)
@@ -0,0 +1,266 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for continuous aggregates.
+
+The rules check the refresh policies of continuous aggregates, the
+part of the data that real-time aggregates compute on every read, and
+the compression of the materialized data.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import doctor
+
+from doctor.catalog import pretty_size
+
+# Start of the Unix epoch, which watermarks are relative to.
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _refresh_policies(snapshot):
+    """Get the refresh policies of the continuous aggregates.
+
+    Yields the name of the view of the continuous aggregate and the
+    row of ``bgw_job`` for each refresh policy.
+    """
+    aggregates = snapshot['continuous_agg']
+    names = {(row.nspname, row.relname): row.name for row in snapshot['pg_class']}
+    for job in snapshot['bgw_job']:
+        aggregate = aggregates.get(job.hypertable_id)
+        if job.proc_name == 'policy_refresh_continuous_aggregate' and aggregate is not None:
+            yield names[aggregate.user_view_schema, aggregate.user_view_name], job
+
+
+def _last_run_duration(stat):
+    """Get the duration of the last run of a job, like ``timescaledb_information.job_stats``.
+
+    The duration is unknown while the job is running.
+    """
+    if stat is None or stat.last_finish is None or stat.last_start is None \
+       or stat.last_finish <= stat.last_start:
+        return None
+    return stat.last_finish - stat.last_start
+
+
+def _watermark(snapshot, aggregate):
+    """Get the watermark of a continuous aggregate as a time.
+
+    Materialization ends at the watermark, which is in microseconds
+    since the Unix epoch for time columns. A watermark before the
+    first representable time, as for an aggregate that was never
+    refreshed, is returned as the smallest time.
+    """
+    row = snapshot['continuous_aggs_watermark'].get(aggregate.mat_hypertable_id)
+    if row is None:
+        return None
+    try:
+        return UNIX_EPOCH + timedelta(microseconds=row.watermark)
+    except OverflowError:
+        return datetime.min.replace(tzinfo=timezone.utc)
+
+@doctor.register
+class FullRefresh(doctor.Rule):
+    """Detect continuous aggregates refreshing all data."""
+
+    message: str = (
+        "Refresh policy of continuous aggregate '{view}' has no start offset."
+    )
+    detail: str = (
+        "The refresh policy (job {job_id}) of continuous aggregate '{view}' has"
+        " no start offset, so the refresh window covers all data of the"
+        " hypertable. Every change to old data is then materialized again on"
+        " the next refresh, which runs every {schedule_interval}, and the"
+        " first refresh materializes the whole hypertable."
+    )
+    hint: str = (
+        "Set a start offset for the refresh policy of '{view}' using"
+        " remove_continuous_aggregate_policy() and add_continuous_aggregate_policy()."
+    )
+    relations: tuple = ('bgw_job', 'continuous_agg', 'pg_class')
+    inputs: tuple = ('catalog', 'jobs')
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find refresh policies without a start offset."""
+        for view, job in _refresh_policies(snapshot):
+            if (job.config or {}).get('start_offset') is None:
+                yield {
+                    'view': view,
+                    'job_id': job.id,
+                    'schedule_interval': job.schedule_interval,
+                }
+
+@doctor.register
+class SlowRefresh(doctor.Rule):
+    """Detect refresh policies running for most of their schedule interval."""
+
+    message: str = (
+        "Refresh of continuous aggregate '{view}' took {last_run_duration},"
+        " but runs every {schedule_interval}."
+    )
+    detail: str = (
+        "The last run of the refresh policy (job {job_id}) of continuous"
+        " aggregate '{view}' took {last_run_duration}, which is at least 80%"
+        " of the schedule interval of {schedule_interval}. The refresh then"
+        " keeps a background worker busy most of the time, and will fall"
+        " behind if the runs get any longer."
+    )
+    hint: str = (
+        "Use a smaller refresh window or a longer schedule interval for the"
+        " refresh policy of '{view}'."
+    )
+    relations: tuple = ('bgw_job', 'bgw_job_stat', 'continuous_agg', 'pg_class')
+    inputs: tuple = ('catalog', 'jobs')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find refresh policies running for most of their schedule interval."""
+        stats = snapshot['bgw_job_stat']
+        findings = []
+        for view, job in _refresh_policies(snapshot):
+            duration = _last_run_duration(stats.get(job.id))
+            if duration is not None and duration * 5 >= job.schedule_interval * 4:
+                findings.append((duration, {
+                    'view': view,
+                    'job_id': job.id,
+                    'schedule_interval': job.schedule_interval,
+                    'last_run_duration': duration,
+                }))
+        for _, row in sorted(findings, key=lambda item: item[0], reverse=True):
+            yield row
+
+@doctor.register
+class LargeRealtimeTail(doctor.Rule):
+    """Detect real-time aggregates with much data that is not materialized."""
+
+    message: str = (
+        "Real-time aggregate '{view}' aggregates about {tail_rows} rows that"
+        " are not materialized on every read."
+    )
+    detail: str = (
+        "Continuous aggregate '{view}' is a real-time aggregate, so each read"
+        " aggregates the rows of the hypertable after the materialized data,"
+        " which ends at {watermark}. The {chunk_count} chunks after that have"
+        " about {tail_rows} rows, which makes every read of the aggregate"
+        " expensive."
+    )
+    hint: str = (
+        "Refresh '{view}' more often, or make the refresh policy end closer to"
+        " the current time using a smaller end offset."
+    )
+    relations: tuple = ('continuous_agg', 'continuous_aggs_watermark', 'hypertable',
+                        'dimensions', 'chunks', 'pg_class')
+    inputs: tuple = ('catalog', 'chunks', 'jobs', 'time')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.12'
+    }
+
+    # pylint: disable-next=too-many-locals
+    def evaluate(self, snapshot):
+        """Find real-time aggregates with many rows after the watermark."""
+        hypertables = snapshot['hypertable']
+        pg_class = snapshot['pg_class']
+        names = {(row.nspname, row.relname): row.name for row in pg_class}
+        dimensions = {(row.hypertable_schema, row.hypertable_name): row.column_type
+                      for row in snapshot['dimensions'] if row.dimension_number == 1}
+        chunks = {}
+        for chunk in snapshot['chunks']:
+            chunks.setdefault((chunk.hypertable_schema, chunk.hypertable_name), []).append(chunk)
+        findings = []
+        for aggregate in snapshot['continuous_agg']:
+            hypertable = hypertables.get(aggregate.raw_hypertable_id)
+            if aggregate.materialized_only or hypertable is None:
+                continue
+            key = (hypertable.schema_name, hypertable.table_name)
+            watermark = _watermark(snapshot, aggregate)
+            column_type = dimensions.get(key)
+            if watermark is None or column_type not in ('timestamp with time zone',
+                                                        'timestamp without time zone'):
+                continue
+            # Ranges of chunks of timestamp columns are times without a
+            # time zone in UTC.
+            if column_type == 'timestamp without time zone':
+                watermark = watermark.replace(tzinfo=None)
+            tail = [chunk for chunk in chunks.get(key, [])
+                    if chunk.range_end is not None and chunk.range_end > watermark
+                    and pg_class.get(chunk.relid) is not None]
+            rows = round(sum(max(pg_class.get(chunk.relid).reltuples, 0) for chunk in tail))
+            if tail and rows >= 1000000:
+                findings.append({
+                    'view': names[aggregate.user_view_schema, aggregate.user_view_name],
+                    'watermark': watermark,
+                    'chunk_count': len(tail),
+                    'tail_rows': rows,
+                })
+        yield from sorted(findings, key=lambda row: -row['tail_rows'])
+
+@doctor.register
+class UncompressedMaterialization(doctor.Rule):
+    """Detect continuous aggregates without compression."""
+
+    message: str = (
+        "Continuous aggregate '{view}' is not compressed."
+    )
+    detail: str = (
+        "The materialized data of continuous aggregate '{view}' is stored in"
+        " hypertable '{hypertable}', which uses {size} and does not have"
+        " compression enabled, even though the aggregated hypertable is"
+        " compressed or the materialized data is large."
+    )
+    hint: str = (
+        "Enable compression on '{view}' using ALTER MATERIALIZED VIEW with"
+        " timescaledb.compress and add a compression policy."
+    )
+    relations: tuple = ('continuous_agg', 'hypertable', 'chunk', 'relation_size', 'pg_class')
+    inputs: tuple = ('catalog', 'chunks')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.6'
+    }
+
+    def evaluate(self, snapshot):
+        """Find continuous aggregates without compression that should have it."""
+        hypertables = snapshot['hypertable']
+        sizes = snapshot['relation_size']
+        pg_class = snapshot['pg_class']
+        names = {(row.nspname, row.relname): row.name for row in pg_class}
+        chunks = snapshot['chunk'].group('hypertable_id')
+        findings = []
+        for aggregate in snapshot['continuous_agg']:
+            materialization = hypertables.get(aggregate.mat_hypertable_id)
+            raw = hypertables.get(aggregate.raw_hypertable_id)
+            if materialization is None or raw is None \
+               or materialization.compressed_hypertable_id is not None:
+                continue
+            # The size of the hypertable is the size of the root table and
+            # of all chunks, like hypertable_size().
+            relids = [materialization.relid] + [chunk.relid for chunk
+                                                in chunks.get(materialization.id, [])]
+            size = sum(sizes.get(relid).total_bytes for relid in relids
+                       if sizes.get(relid) is not None)
+            if raw.compressed_hypertable_id is not None or size >= 1024 * 1024 * 1024:
+                findings.append((size, {
+                    'view': names[aggregate.user_view_schema, aggregate.user_view_name],
+                    'hypertable': pg_class.get(materialization.relid).name,
+                    'size': pretty_size(size),
+                }))
+        for _, row in sorted(findings, key=lambda item: -item[0]):
+            yield row
@@ -0,0 +1,141 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for continuous aggregate rules."""
+
+from timescaledb import Hypertable
+
+from doctor.unittest import TimescaleDBTestCase, wait_for_jobs
+from doctor.rules.caggs import (FullRefresh, LargeRealtimeTail, SlowRefresh,
+                                UncompressedMaterialization)
+
+class TestContinuousAggregateRules(TimescaleDBTestCase):
+    """Test continuous aggregate rules.
+
+    This will create a compressed hypertable with a continuous
+    aggregate that is not compressed and has a refresh policy without
+    a start offset, and a real-time aggregate that has not been
+    refreshed, so that all rows of the hypertable are aggregated on
+    every read.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable with a continuous aggregate."""
+        table = Hypertable("readings", "time", {
+            'time': "timestamptz not null",
+            'sensor_id': "integer",
+            'value': "float"
+        })
+        table.create(connection)
+        table.compress(connection, segmentby='sensor_id')
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW readings_daily"
+                " WITH (timescaledb.continuous) AS"
+                " SELECT time_bucket('1 day', time) AS day, avg(value)"
+                " FROM readings GROUP BY day WITH NO DATA"
+            )
+            cursor.execute(
+                "SELECT add_continuous_aggregate_policy('readings_daily',"
+                " start_offset => NULL, end_offset => INTERVAL '1 hour',"
+                " schedule_interval => INTERVAL '1 hour')"
+            )
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW readings_realtime"
+                " WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS"
+                " SELECT time_bucket('1 hour', time) AS hour, max(value)"
+                " FROM readings GROUP BY hour WITH NO DATA"
+            )
+            cursor.execute(
+                "INSERT INTO readings"
+                " SELECT now() - i * INTERVAL '2 seconds', i % 10, random()"
+                "   FROM generate_series(1, 1000000) AS i"
+            )
+            cursor.execute("ANALYZE readings")
+
+    def test_full_refresh(self):
+        """Test rule for detecting refresh policies without start offset."""
+        messages = list(self.run_rule(FullRefresh()))
+        self.assertIn(FullRefresh.message.format(view="readings_daily"), messages)
+
+    def test_uncompressed(self):
+        """Test rule for detecting continuous aggregates without compression."""
+        messages = list(self.run_rule(UncompressedMaterialization()))
+        self.assertIn(UncompressedMaterialization.message.format(view="readings_daily"),
+                      messages)
+
+    def test_realtime_tail(self):
+        """Test rule for detecting real-time aggregates with a large tail."""
+        rows = list(LargeRealtimeTail().fetch(self.connection))
+        self.assertEqual([str(row['view']) for row in rows], ['readings_realtime'])
+        self.assertGreaterEqual(rows[0]['tail_rows'], 1000000)
+
+class TestRefreshJobRules(TimescaleDBTestCase):
+    """Test continuous aggregate rules that read job statistics.
+
+    The refresh policy is run by the scheduler, so the changes of the
+    tests are committed.
+
+    """
+
+    rollback = False
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create continuous aggregate with a refresh policy."""
+        table = Hypertable("measurements", "time", {
+            'time': "timestamptz not null",
+            'value': "float"
+        })
+        table.create(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO measurements"
+                " SELECT time, random()"
+                "   FROM generate_series(now() - INTERVAL '7 days', now(), '1 minute') AS time"
+            )
+            cursor.execute(
+                "CREATE MATERIALIZED VIEW measurements_hourly"
+                " WITH (timescaledb.continuous) AS"
+                " SELECT time_bucket('1 hour', time) AS hour, avg(value)"
+                " FROM measurements GROUP BY hour WITH NO DATA"
+            )
+
+    def test_slow_refresh(self):
+        """Test rule for detecting refresh policies taking most of the interval.
+
+        The policy is run once by the scheduler, and the schedule
+        interval is then set to the duration of that run.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT add_continuous_aggregate_policy('measurements_hourly',"
+                " start_offset => INTERVAL '30 days', end_offset => INTERVAL '1 hour',"
+                " schedule_interval => INTERVAL '1 hour') AS job_id"
+            )
+            job_id = cursor.fetchone()['job_id']
+            wait_for_jobs(self.connection, [job_id])
+            cursor.execute(
+                "SELECT alter_job(job_id, schedule_interval => last_run_duration,"
+                "                 scheduled => false)"
+                "  FROM timescaledb_information.job_stats WHERE job_id = %s",
+                (job_id,)
+            )
+        messages = list(self.run_rule(SlowRefresh()))
+        self.assertEqual(len(messages), 1)
+        self.assertIn("measurements_hourly", messages[0])
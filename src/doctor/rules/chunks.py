@@ -0,0 +1,195 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for chunk sizing.
+
+The recent chunks of a hypertable, including their indexes, should fit
+in memory. The rules compare the size of the four most recent chunks
+of each hypertable with ``shared_buffers`` and ``effective_cache_size``
+and compute the ingest rate from their sizes and time ranges. The
+suggested chunk interval gives chunks that use a quarter of
+``shared_buffers`` at that ingest rate.
+"""
+
+from datetime import timedelta
+
+import doctor
+
+from doctor.catalog import pretty_size
+
+# Relations used to compute the chunk sizes of each hypertable.
+CHUNK_SIZES_RELATIONS = ('chunks', 'dimensions', 'relation_size', 'pg_settings', 'database',
+                         'pg_class')
+
+
+# pylint: disable-next=too-many-locals
+def _chunk_sizes(snapshot):
+    """Compute the sizes of the recent chunks of each hypertable.
+
+    Yields a dictionary with the fields of the messages for each
+    hypertable, together with a dictionary of the values used by the
+    conditions of the rules.
+    """
+    now = snapshot['database'].rows[0].now
+    settings = snapshot['pg_settings']
+    shared_buffers = settings.get('shared_buffers').bytes
+    effective_cache_size = settings.get('effective_cache_size').bytes
+    sizes = snapshot['relation_size']
+    names = {(row.nspname, row.relname): row.name for row in snapshot['pg_class']}
+    dimensions = {(row.hypertable_schema, row.hypertable_name): row
+                  for row in snapshot['dimensions'] if row.dimension_number == 1}
+    hypertables = {}
+    for row in snapshot['chunks']:
+        if row.range_start is not None:
+            hypertables.setdefault((row.hypertable_schema, row.hypertable_name), []).append(row)
+    for key, chunks in hypertables.items():
+        ordered = sorted(chunks, key=lambda row: row.range_end, reverse=True)
+        recent = [(row, sizes.get(row.relid).total_bytes)
+                  for row in ordered[:4] if not row.is_compressed]
+        if not recent or key not in dimensions:
+            continue
+        total = sum(size for _, size in recent)
+        # The time range of the active chunk is only counted up to now,
+        # since it is not yet filled.
+        seconds = (max(min(row.range_end, now) for row, _ in recent)
+                   - min(row.range_start for row, _ in recent)).total_seconds()
+        rate = total / seconds if seconds > 0 else None
+        suggested = max(shared_buffers / 4 / rate, 60) if rate else 60
+        chunk_interval = dimensions[key].time_interval
+        active = sum(size for row, size in recent if row.range_end > now)
+        yield {
+            'hypertable': names[key],
+            'chunk_count': len(chunks),
+            'chunk_interval': chunk_interval,
+            'active_size': pretty_size(active),
+            'chunk_size': pretty_size(round(total / len(recent))),
+            'shared_buffers': pretty_size(shared_buffers),
+            'effective_cache_size': pretty_size(effective_cache_size),
+            'ingest_rate': pretty_size(round(rate * 3600)) if rate is not None else None,
+            'suggested_interval': timedelta(minutes=int(suggested // 60)),
+        }, {
+            'active_bytes': active,
+            'shared_buffers': shared_buffers,
+            'effective_cache_size': effective_cache_size,
+            'suggested_seconds': suggested,
+            'interval_seconds': (chunk_interval.total_seconds()
+                                 if chunk_interval is not None else None),
+        }
+
+@doctor.register
+class ChunksTooLarge(doctor.Rule):
+    """Detect hypertables with active chunks that do not fit in memory."""
+
+    message: str = (
+        "Active chunks of hypertable '{hypertable}' use {active_size}, which does"
+        " not fit in shared_buffers ({shared_buffers})."
+    )
+    detail: str = (
+        "The chunks of hypertable '{hypertable}' that are written to, including"
+        " their indexes, use {active_size}, but shared_buffers is {shared_buffers}"
+        " and effective_cache_size is {effective_cache_size}. Inserts and queries"
+        " on recent data then need to read from disk. With an ingest rate of"
+        " {ingest_rate} per hour, a chunk interval of {suggested_interval} instead"
+        " of {chunk_interval} gives chunks that fit in memory."
+    )
+    hint: str = (
+        "Change the chunk interval of hypertable '{hypertable}' to"
+        " {suggested_interval} using set_chunk_time_interval()."
+    )
+    relations: tuple = CHUNK_SIZES_RELATIONS
+    inputs: tuple = ('catalog', 'chunks', 'settings', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with active chunks larger than shared_buffers.
+
+        Hypertables with active chunks that are also larger than
+        effective_cache_size are reported by `ChunksExceedCache`.
+        """
+        for row, values in _chunk_sizes(snapshot):
+            if values['shared_buffers'] < values['active_bytes'] \
+               <= values['effective_cache_size']:
+                yield row
+
+@doctor.register
+class ChunksExceedCache(doctor.Rule):
+    """Detect hypertables with active chunks that do not fit in the cache."""
+
+    message: str = (
+        "Active chunks of hypertable '{hypertable}' use {active_size}, which does"
+        " not even fit in effective_cache_size ({effective_cache_size})."
+    )
+    detail: str = (
+        "The chunks of hypertable '{hypertable}' that are written to, including"
+        " their indexes, use {active_size}, which is more than the memory"
+        " available for caching data given by effective_cache_size"
+        " ({effective_cache_size}). Inserts and queries on recent data then read"
+        " from disk even when the operating system cache is counted, and index"
+        " updates on every insert cause random reads. With an ingest rate of"
+        " {ingest_rate} per hour, a chunk interval of {suggested_interval} instead"
+        " of {chunk_interval} gives chunks that fit in memory."
+    )
+    hint: str = (
+        "Change the chunk interval of hypertable '{hypertable}' to"
+        " {suggested_interval} using set_chunk_time_interval()."
+    )
+    relations: tuple = CHUNK_SIZES_RELATIONS
+    inputs: tuple = ('catalog', 'chunks', 'settings', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with active chunks larger than effective_cache_size."""
+        for row, values in _chunk_sizes(snapshot):
+            if values['active_bytes'] > values['effective_cache_size']:
+                yield row
+
+@doctor.register
+class ChunksTooSmall(doctor.Rule):
+    """Detect hypertables with many small chunks."""
+
+    message: str = (
+        "Hypertable '{hypertable}' has {chunk_count} chunks of {chunk_size},"
+        " which is small compared to shared_buffers ({shared_buffers})."
+    )
+    detail: str = (
+        "Recent chunks of hypertable '{hypertable}' use {chunk_size} each with a"
+        " chunk interval of {chunk_interval}. With {chunk_count} chunks, planning"
+        " queries on the hypertable is dominated by the number of chunks. With an"
+        " ingest rate of {ingest_rate} per hour, a chunk interval of"
+        " {suggested_interval} gives fewer and larger chunks that still fit in"
+        " memory."
+    )
+    hint: str = (
+        "Change the chunk interval of hypertable '{hypertable}' to"
+        " {suggested_interval} using set_chunk_time_interval()."
+    )
+    relations: tuple = CHUNK_SIZES_RELATIONS
+    inputs: tuple = ('catalog', 'chunks', 'settings', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with many chunks and a much larger suggested interval."""
+        for row, values in _chunk_sizes(snapshot):
+            if row['chunk_count'] >= 100 and values['interval_seconds'] is not None \
+               and values['suggested_seconds'] >= 10 * values['interval_seconds']:
+                yield row
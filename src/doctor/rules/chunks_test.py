@@ -0,0 +1,64 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for chunk sizing rules."""
+
+from datetime import timedelta
+
+from timescaledb import Hypertable
+
+from doctor.unittest import TimescaleDBTestCase
+from doctor.rules.chunks import ChunksExceedCache, ChunksTooLarge, ChunksTooSmall
+
+class TestChunkRules(TimescaleDBTestCase):
+    """Test chunk sizing rules.
+
+    This will create a hypertable with a chunk interval of one minute
+    and a few rows in each chunk, which gives many small chunks.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable with small chunks."""
+        table = Hypertable("conditions", "time", {
+            'time': "timestamptz not null",
+            'device_id': "integer",
+            'temperature': "float"
+        }, chunk_time_interval=timedelta(minutes=1))
+        table.create(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO conditions "
+                "SELECT time, (random()*30)::int, random()*80 - 40 "
+                "FROM generate_series(NOW() - INTERVAL '3 hours', NOW(), '10 seconds') AS time"
+            )
+            cursor.execute("ANALYZE conditions")
+
+    def test_too_small(self):
+        """Test rule for detecting small chunks."""
+        rows = list(ChunksTooSmall().fetch(self.connection))
+        self.assertEqual([str(row['hypertable']) for row in rows], ['conditions'])
+        self.assertGreaterEqual(rows[0]['chunk_count'], 100)
+
+    def test_too_large(self):
+        """Test that small chunks are not reported as too large."""
+        rows = list(ChunksTooLarge().fetch(self.connection))
+        self.assertNotIn('conditions', [str(row['hypertable']) for row in rows])
+
+    def test_exceed_cache(self):
+        """Test that small chunks are not reported as exceeding the cache."""
+        rows = list(ChunksExceedCache().fetch(self.connection))
+        self.assertNotIn('conditions', [str(row['hypertable']) for row in rows])
@@ -12,26 +12,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Rules for compressed hypertables."""
+"""Rules for compressed hypertables.
+
+Besides the statistics of the segment-by columns, the rules look at
+the result of compression in the five most recently compressed chunks
+of each hypertable, so that the rules reflect the current compression
+settings rather than those of old chunks. The number of segments in
+a compressed chunk is estimated from the statistics of its segment-by
+columns, so it is only known for compressed chunks that are analyzed.
+"""
+
+import math
 
 import doctor
 
-LINEAR_QUERY = """
-SELECT format('%I.%I', schema_name, table_name)::regclass AS relation, s.attname
-  FROM _timescaledb_catalog.hypertable_compression c
-  JOIN _timescaledb_catalog.hypertable h ON c.hypertable_id = h.id
-  JOIN pg_stats s
-    ON s.attname = c.attname
-   AND s.schemaname = h.schema_name
-   AND s.tablename = h.table_name
- WHERE segmentby_column_index IS NOT NULL AND inherited AND n_distinct < 0;
-"""
+
+def _segmentby_statistics(snapshot):
+    """Get the statistics of the segment-by columns of each hypertable.
+
+    Yields the name of the hypertable and the row of ``pg_stats`` for
+    the column, including the chunks of the hypertable.
+    """
+    pg_class = snapshot['pg_class']
+    hypertables = snapshot['hypertable']
+    stats = {(row.schemaname, row.tablename, row.attname): row
+             for row in snapshot['pg_stats'] if row.inherited}
+    for row in snapshot['compression_settings']:
+        hypertable = hypertables.get(row.hypertable_id)
+        if row.segmentby_column_index is None or hypertable is None:
+            continue
+        stat = stats.get((hypertable.schema_name, hypertable.table_name, row.attname))
+        if stat is not None:
+            yield pg_class.get(hypertable.relid).name, stat
 
 @doctor.register
 class LinearSegmentBy(doctor.Rule):
     """Detect segmentby column for compressed table."""
 
-    query: str = LINEAR_QUERY
     message: str = (
         "Column '{attname}' in compressed hypertable '{relation}' has no distinct values."
     )
@@ -41,26 +58,21 @@ class LinearSegmentBy(doctor.Rule):
         " with the number of rows of the table."
 
     )
+    relations: tuple = ('compression_settings', 'hypertable', 'pg_stats', 'pg_class')
     dependencies: dict = {
-        'timescaledb': '1.0'
+        'timescaledb': '2.0'
     }
 
-POINTLESS_QUERY = """
-SELECT format('%I.%I', schema_name, table_name)::regclass AS relation, s.attname
-  FROM _timescaledb_catalog.hypertable_compression c
-  JOIN _timescaledb_catalog.hypertable h ON c.hypertable_id = h.id
-  JOIN pg_stats s
-    ON s.attname = c.attname
-   AND s.schemaname = h.schema_name
-   AND s.tablename = h.table_name
- WHERE segmentby_column_index IS NOT NULL AND inherited AND n_distinct = 1;
-"""
+    def evaluate(self, snapshot):
+        """Find segment-by columns where the number of distinct values grows."""
+        for relation, stat in _segmentby_statistics(snapshot):
+            if stat.n_distinct < 0:
+                yield {'relation': relation, 'attname': stat.attname}
 
 @doctor.register
 class PointlessSegmentBy(doctor.Rule):
     """Detect pointless segmentby column in compressed table."""
 
-    query: str = POINTLESS_QUERY
     message: str = (
         "Column '{attname}' in hypertable '{relation}' is superfluous."
     )
@@ -68,6 +80,252 @@ class PointlessSegmentBy(doctor.Rule):
         "Column '{attname}' in hypertable '{relation}' as segment-by column is pointless"
         " since it contains a single value."
     )
+    relations: tuple = ('compression_settings', 'hypertable', 'pg_stats', 'pg_class')
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find segment-by columns with a single value."""
+        for relation, stat in _segmentby_statistics(snapshot):
+            if stat.n_distinct == 1:
+                yield {'relation': relation, 'attname': stat.attname}
+
+# Relations used to compute the batches of the sampled chunks.
+BATCHES_RELATIONS = ('compression_chunk_size', 'chunk', 'hypertable', 'compression_settings',
+                     'pg_stats', 'pg_class')
+
+
+def _segments(size, compressed, columns, stats):
+    """Estimate the number of segments in a compressed chunk.
+
+    `size` is the row of ``compression_chunk_size`` for the chunk and
+    `compressed` the row of ``chunk`` for the compressed chunk. The
+    number of segments is the product of the number of distinct values
+    of the segment-by columns in `columns`. This is too large if the
+    columns are correlated, so it is capped by the number of batches.
+    Returns None if a column has no statistics.
+    """
+    if not columns:
+        return 1
+    rows = size.numrows_post_compression
+    logs = []
+    for column in columns:
+        stat = stats.get((compressed.schema_name, compressed.table_name, column.attname))
+        if stat is None:
+            return None
+        distinct = -stat.n_distinct * rows if stat.n_distinct < 0 else stat.n_distinct
+        logs.append(math.log(max(distinct, 1)))
+    return min(math.exp(sum(logs)), rows)
+
+
+# pylint: disable-next=too-many-locals
+def _batches(snapshot):
+    """Compute the batches of the most recently compressed chunks.
+
+    Yields one dictionary for each hypertable with the fields of the
+    messages of the rules.
+    """
+    chunks = snapshot['chunk']
+    hypertables = snapshot['hypertable']
+    stats = {(row.schemaname, row.tablename, row.attname): row for row in snapshot['pg_stats']}
+    segmentby = {}
+    for row in snapshot['compression_settings']:
+        if row.segmentby_column_index is not None:
+            segmentby.setdefault(row.hypertable_id, []).append(row)
+    sampled = {}
+    for size in snapshot['compression_chunk_size']:
+        chunk = chunks.get(size.chunk_id)
+        compressed = chunks.get(size.compressed_chunk_id)
+        if size.numrows_post_compression > 0 and chunk is not None and compressed is not None:
+            sampled.setdefault(chunk.hypertable_id, []).append((chunk.id, size, compressed))
+    for hypertable_id, samples in sampled.items():
+        hypertable = hypertables.get(hypertable_id)
+        if hypertable is None:
+            continue
+        columns = sorted(segmentby.get(hypertable_id, []),
+                         key=lambda row: row.segmentby_column_index)
+        samples = [(size, _segments(size, compressed, columns, stats))
+                   for _, size, compressed in sorted(samples, key=lambda item: -item[0])[:5]]
+        pre = sum(size.numrows_pre_compression for size, _ in samples)
+        post = sum(size.numrows_post_compression for size, _ in samples)
+        before = sum(size.uncompressed_heap_size + size.uncompressed_toast_size
+                     + size.uncompressed_index_size for size, _ in samples)
+        after = sum(size.compressed_heap_size + size.compressed_toast_size
+                    + size.compressed_index_size for size, _ in samples)
+        segments = [count for _, count in samples]
+        yield {
+            'hypertable': snapshot['pg_class'].get(hypertable.relid).name,
+            'sampled_chunks': len(samples),
+            'rows_per_batch': round(pre / post, 1),
+            'batches_per_segment': (round(post / sum(segments), 1)
+                                    if None not in segments else None),
+            'compression_ratio': round(before / after, 1) if after else None,
+            'segmentby': ', '.join(column.attname for column in columns) or None,
+        }
+
+@doctor.register
+class UnderfilledBatches(doctor.Rule):
+    """Detect compressed hypertables with small batches."""
+
+    message: str = (
+        "Compressed batches of hypertable '{hypertable}' have {rows_per_batch}"
+        " rows on average."
+    )
+    detail: str = (
+        "A compressed batch holds up to 1000 rows of a segment, but in the"
+        " {sampled_chunks} most recently compressed chunks of hypertable"
+        " '{hypertable}' the batches have {rows_per_batch} rows on average."
+        " Each batch has a fixed overhead, so small batches compress poorly"
+        " and are slow to decompress. This happens when the segment-by"
+        " columns ({segmentby}) have so many distinct values that each"
+        " segment only has a few rows in a chunk."
+    )
+    hint: str = (
+        "Use fewer segment-by columns, or columns with fewer distinct values,"
+        " for hypertable '{hypertable}', or use a larger chunk interval."
+    )
+    relations: tuple = BATCHES_RELATIONS
+    inputs: tuple = ('catalog', 'stats', 'chunks')
+    interval: float = 3600.0
     dependencies: dict = {
-        'timescaledb': '1.0'
+        'timescaledb': '2.0'
     }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with less than 100 rows per batch."""
+        for row in _batches(snapshot):
+            if row['rows_per_batch'] < 100:
+                yield row
+
+@doctor.register
+class WideSegments(doctor.Rule):
+    """Detect compressed hypertables with segments of many batches."""
+
+    message: str = (
+        "Segments of compressed hypertable '{hypertable}' have {batches_per_segment}"
+        " batches on average."
+    )
+    detail: str = (
+        "In the {sampled_chunks} most recently compressed chunks of hypertable"
+        " '{hypertable}', each segment has {batches_per_segment} batches of"
+        " {rows_per_batch} rows on average. A query filtering on the segment-by"
+        " columns ({segmentby}) still has to decompress all batches of the"
+        " segment, so segmenting the data gives little benefit."
+    )
+    hint: str = (
+        "Add a segment-by column with more distinct values to hypertable"
+        " '{hypertable}', or use a column that queries filter on."
+    )
+    relations: tuple = BATCHES_RELATIONS
+    inputs: tuple = ('catalog', 'stats', 'chunks')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with at least 1000 batches per segment."""
+        for row in _batches(snapshot):
+            if row['segmentby'] is not None and row['batches_per_segment'] is not None \
+               and row['batches_per_segment'] >= 1000:
+                yield row
+
+@doctor.register
+class LowCompressionRatio(doctor.Rule):
+    """Detect compressed hypertables that compress poorly."""
+
+    message: str = (
+        "Compressed chunks of hypertable '{hypertable}' are only"
+        " {compression_ratio} times smaller than before compression."
+    )
+    detail: str = (
+        "The {sampled_chunks} most recently compressed chunks of hypertable"
+        " '{hypertable}' have a compression ratio of {compression_ratio} with"
+        " {rows_per_batch} rows per batch on average. Compression then saves"
+        " little space, while queries and changes to compressed data still"
+        " pay for decompression."
+    )
+    hint: str = (
+        "Check the segment-by and order-by columns of hypertable '{hypertable}'."
+        " Ordering by columns with slowly changing values compresses better."
+    )
+    relations: tuple = BATCHES_RELATIONS
+    inputs: tuple = ('catalog', 'stats', 'chunks')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find hypertables with a compression ratio below 2."""
+        for row in _batches(snapshot):
+            if row['compression_ratio'] is not None and row['compression_ratio'] < 2:
+                yield row
+
+@doctor.register
+class OrderByMismatch(doctor.Rule):
+    """Detect compressed hypertables ordered by a column that is not filtered on."""
+
+    message: str = (
+        "Hypertable '{hypertable}' is mostly filtered on column '{filter_column}',"
+        " but compressed data is ordered by column '{orderby_column}'."
+    )
+    detail: str = (
+        "Indexes on chunks of hypertable '{hypertable}' are mostly used to filter"
+        " on column '{filter_column}', with {scans} index scans. Compressed"
+        " batches are ordered by column '{orderby_column}', so the minimum and"
+        " maximum of '{filter_column}' in each batch cannot be used to skip"
+        " batches, and queries filtering on '{filter_column}' decompress all"
+        " batches of each segment."
+    )
+    hint: str = (
+        "Consider making '{filter_column}' the first order-by column of"
+        " hypertable '{hypertable}' using timescaledb.compress_orderby."
+    )
+    relations: tuple = ('compression_settings', 'chunk_index', 'chunk', 'hypertable',
+                        'pg_stat_user_indexes', 'index_column', 'pg_class')
+    inputs: tuple = ('catalog', 'scans', 'chunks', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    # pylint: disable-next=too-many-locals
+    def evaluate(self, snapshot):
+        """Find hypertables where the order-by column is not the most filtered column."""
+        segmentby = {}
+        orderby = {}
+        for row in snapshot['compression_settings']:
+            columns = segmentby.setdefault(row.hypertable_id, set())
+            if row.segmentby_column_index is not None:
+                columns.add(row.attname)
+            if row.orderby_column_index == 1:
+                orderby[row.hypertable_id] = row.attname
+        chunks = snapshot['chunk']
+        columns = snapshot['index_column'].group('indexrelid')
+        stats = {(row.schemaname, row.indexrelname): row
+                 for row in snapshot['pg_stat_user_indexes']}
+        scans = {}
+        for row in snapshot['chunk_index']:
+            chunk = chunks.get(row.chunk_id)
+            stat = stats.get((chunk.schema_name, row.index_name)) if chunk is not None else None
+            if row.hypertable_id not in segmentby or stat is None or not stat.idx_scan:
+                continue
+            keys = sorted(columns.get(stat.indexrelid, []), key=lambda column: column.position)
+            first = next((column.attname for column in keys if column.attname is not None
+                          and column.attname not in segmentby[row.hypertable_id]), None)
+            if first is not None:
+                counts = scans.setdefault(row.hypertable_id, {})
+                counts[first] = counts.get(first, 0) + stat.idx_scan
+        hypertables = snapshot['hypertable']
+        pg_class = snapshot['pg_class']
+        for hypertable_id, counts in scans.items():
+            column, count = max(counts.items(), key=lambda item: item[1])
+            if orderby.get(hypertable_id) is not None and orderby[hypertable_id] != column:
+                yield {
+                    'hypertable': pg_class.get(hypertables.get(hypertable_id).relid).name,
+                    'filter_column': column,
+                    'scans': count,
+                    'orderby_column': orderby[hypertable_id],
+                }
@@ -17,28 +17,30 @@
 from timescaledb import Hypertable
 
 from doctor.unittest import TimescaleDBTestCase
-from doctor.rules.compression import LinearSegmentBy, PointlessSegmentBy
+from doctor.rules.compression import LinearSegmentBy, PointlessSegmentBy, UnderfilledBatches
 
 class TestCompressionRules(TimescaleDBTestCase):
     """Test compression rules.
 
     This will create a hypertable where we segment-by a column that
     has unique values (the time column) and a column that has only a
-    single value (user_id).
+    single value (user_id). Since every row is a segment of its own,
+    the compressed batches have a single row.
 
     """
 
-    def setUp(self):
-        """Set up unit tests for compression rules."""
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable for compression rules."""
         table = Hypertable("conditions", "time", {
                            'time': "timestamptz not null",
                            'device_id': "integer",
                            'user_id': "integer",
                            'temperature': "float"
         })
-        table.create(self.connection)
+        table.create(connection)
 
-        with self.connection.cursor() as cursor:
+        with connection.cursor() as cursor:
             cursor.execute(
                 "INSERT INTO conditions "
                 "SELECT time, (random()*30)::int, 1, random()*80 - 40 "
@@ -51,13 +53,7 @@ class TestCompressionRules(TimescaleDBTestCase):
                 ")"
                 )
             cursor.execute("ANALYZE conditions")
-        self.connection.commit()
-
-    def tearDown(self):
-        """Tear down compression rules test."""
-        with self.connection.cursor() as cursor:
-            cursor.execute("DROP TABLE conditions")
-        self.connection.commit()
+            cursor.execute("SELECT compress_chunk(chunk) FROM show_chunks('conditions') chunk")
 
     def test_segmentby(self):
         """Test rule for detecting bad choice for segment-by column."""
@@ -68,3 +64,10 @@ class TestCompressionRules(TimescaleDBTestCase):
                       messages)
         self.assertIn(PointlessSegmentBy.message.format(attname="user_id", relation="conditions"),
                       messages)
+
+    def test_batches(self):
+        """Test rule for detecting small compressed batches."""
+        messages = self.run_rule(UnderfilledBatches())
+        self.assertIn(UnderfilledBatches.message.format(hypertable="conditions",
+                                                        rows_per_batch="1.0"),
+                      messages)
@@ -16,25 +16,7 @@
 
 import doctor
 
-CANDIDATE_QUERY = """
-SELECT relid::regclass AS table,
-       pt.typname AS coltype,
-       psui.idx_scan,
-       attname AS colname
-  FROM pg_catalog.pg_stat_user_indexes AS psui
-  LEFT JOIN pg_catalog.pg_inherits ON (inhparent=relid OR inhrelid=relid)
-  JOIN pg_catalog.pg_index USING (indexrelid)
-  JOIN pg_catalog.pg_attribute ON (attrelid=relid AND attnum=ANY(indkey))
-  JOIN pg_catalog.pg_type AS pt ON (atttypid=pt.oid)
-  JOIN pg_catalog.pg_stat_user_tables AS psut USING (relid)
-  JOIN pg_catalog.pg_class AS pc ON (pc.oid=relid)
-  JOIN pg_catalog.pg_class AS pci ON (pci.oid=indexrelid)
-  WHERE pg_inherits IS NULL
-    AND pt.typname IN ('timestamp', 'timestamptz')
-    AND psui.idx_scan > 0
-    AND n_live_tup + n_dead_tup > 0
-    AND pc.relpages > 10;
-"""
+from doctor.sample import CHUNK_SAMPLE, confidence, estimate
 
 CANDIDATE_DETAIL = """
 Table might benefit from being transformed to a hypertable.
@@ -50,23 +32,68 @@ Table might benefit from being transformed to a hypertable.
 class HypertableCandidate(doctor.Rule):
     """Detect candidate hypertable."""
 
-    query: str = CANDIDATE_QUERY
     detail: str = CANDIDATE_DETAIL
     message: str = "Table {table} might benefit from being transformed to a hypertable."
+    relations: tuple = ('pg_stat_user_indexes', 'pg_stat_user_tables', 'pg_inherits',
+                        'pg_index', 'index_column', 'pg_class')
+
+    def evaluate(self, snapshot):
+        """Find tables with indexes on time columns that are used."""
+        pg_class = snapshot['pg_class']
+        pg_index = snapshot['pg_index']
+        stats = snapshot['pg_stat_user_tables']
+        columns = snapshot['index_column'].group('indexrelid')
+        inherited = {oid for row in snapshot['pg_inherits']
+                     for oid in (row.inhrelid, row.inhparent)}
+        for row in snapshot['pg_stat_user_indexes']:
+            table = pg_class.get(row.relid)
+            stat = stats.get(row.relid)
+            if row.relid in inherited or not row.idx_scan or table is None or stat is None:
+                continue
+            if stat.n_live_tup + stat.n_dead_tup <= 0 or table.relpages <= 10:
+                continue
+            if pg_index.get(row.indexrelid) is None or pg_class.get(row.indexrelid) is None:
+                continue
+            # Each column is reported once, even if it is used several
+            # times in the index.
+            seen = set()
+            for column in columns.get(row.indexrelid, []):
+                if column.typname in ('timestamp', 'timestamptz') and column.attnum not in seen:
+                    seen.add(column.attnum)
+                    yield {
+                        'table': table.name,
+                        'coltype': column.typname,
+                        'idx_scan': row.idx_scan,
+                        'colname': column.attname,
+                    }
 
-PERMISSION_QUERY = """
-WITH tables AS (
-    SELECT format('%I.%I', ht.schema_name, ht.table_name)::regclass as hypertable,
-           format('%I.%I', ch.schema_name, ch.table_name)::regclass as chunk
-      FROM _timescaledb_catalog.hypertable ht
-      JOIN _timescaledb_catalog.chunk ch
-        ON ch.hypertable_id = ht.id
-     WHERE NOT dropped)
-SELECT hypertable,
-       chunk
-  FROM tables
- WHERE (SELECT relacl FROM pg_class WHERE oid = hypertable)
-       IS DISTINCT FROM (SELECT relacl FROM pg_class WHERE oid = chunk);
+PERMISSION_QUERY = f"""
+WITH {CHUNK_SAMPLE},
+chunk_acls AS (
+    SELECT ch.hypertable_id, ch.id, ch.weight, cl.oid,
+           cl.relacl::text AS relacl,
+           row_number() OVER (PARTITION BY ch.hypertable_id, cl.relacl::text
+                              ORDER BY ch.id) AS acl_rank
+      FROM chunk_sample ch
+      JOIN pg_catalog.pg_namespace ns ON ns.nspname = ch.schema_name
+      JOIN pg_catalog.pg_class cl ON cl.relnamespace = ns.oid AND cl.relname = ch.table_name),
+mismatches AS (
+    SELECT ca.*, ht.schema_name, ht.table_name,
+           ca.relacl IS DISTINCT FROM cl.relacl::text AS mismatch
+      FROM chunk_acls ca
+      JOIN _timescaledb_catalog.hypertable ht ON ht.id = ca.hypertable_id
+      JOIN pg_catalog.pg_namespace ns ON ns.nspname = ht.schema_name
+      JOIN pg_catalog.pg_class cl ON cl.relnamespace = ns.oid AND cl.relname = ht.table_name)
+SELECT format('%I.%I', schema_name, table_name)::regclass AS hypertable,
+       {estimate('mismatch')} AS chunk_count,
+       count(DISTINCT relacl) FILTER (WHERE mismatch) AS acl_count,
+       string_agg(oid::regclass::text, ', ' ORDER BY relacl, id)
+           FILTER (WHERE mismatch AND acl_rank <= 3) AS samples,
+       {confidence('mismatch')} AS confidence
+  FROM mismatches
+ GROUP BY schema_name, table_name
+HAVING bool_or(mismatch)
+ ORDER BY chunk_count DESC;
 """
 
 @doctor.register
@@ -74,7 +101,16 @@ class ChunkPermissions(doctor.Rule):
     """Detect bad chunk permissions."""
 
     query: str = PERMISSION_QUERY
-    message: str = "Chunk '{chunk}' have different permissions from hypertable '{hypertable}'."
+    message: str = ("{chunk_count} chunks of hypertable '{hypertable}' have different"
+                    " permissions from the hypertable, for example {samples}.")
+    detail: str = ("Chunks of hypertable '{hypertable}' have {acl_count} different sets of"
+                   " permissions that are not the same as the permissions of the hypertable."
+                   " {confidence}")
+    hint: str = ("Grant or revoke the privileges on hypertable '{hypertable}' again to"
+                 " give all chunks the same permissions as the hypertable.")
+    inputs: tuple = ('catalog', 'chunks')
+    interval: float = 3600.0
+    sampled: bool = True
     dependencies: dict = {
         'timescaledb': '1.0'
     }
@@ -22,17 +22,11 @@ from doctor.unittest import TimescaleDBTestCase
 class TestHypertableRules(TimescaleDBTestCase):
     """Test hypertable rules."""
 
-    def setUp(self):
-        """Set up unit tests for hypertable rules."""
-        print(__file__)
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable for hypertable rules."""
         fname = join(dirname(__file__), "sql/setup.hypertable_test.sql")
-        with self.connection.cursor() as cursor, open(fname, "r", encoding="ascii") as infile:
-            cursor.execute(infile.read())
-
-    def tearDown(self):
-        """Tear down compression rules test."""
-        fname = join(dirname(__file__), "sql/teardown.hypertable_test.sql")
-        with self.connection.cursor() as cursor, open(fname, "r", encoding="ascii") as infile:
+        with connection.cursor() as cursor, open(fname, "r", encoding="ascii") as infile:
             cursor.execute(infile.read())
 
     def test_chunk_permissions(self):
@@ -47,5 +41,6 @@ class TestHypertableRules(TimescaleDBTestCase):
             cursor.execute(f"REVOKE SELECT ON {row['chunk']} FROM PUBLIC")
         messages = []
         messages.extend(self.run_rule(ChunkPermissions()))
-        message = ChunkPermissions.message.format(chunk=row['chunk'], hypertable="conditions")
+        message = ChunkPermissions.message.format(chunk_count=1, samples=row['chunk'],
+                                                  hypertable="conditions")
         self.assertIn(message, messages)
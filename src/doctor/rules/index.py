@@ -15,45 +15,314 @@
 """Rules for indexes."""
 
 from dataclasses import dataclass
+from fnmatch import fnmatchcase
 
 import doctor
 
-UNUSED_QUERY = """
-SELECT relid::regclass as relation,
-       indexrelname,
-       pg_size_pretty(pg_relation_size(i.indexrelid)) AS index_size
-FROM pg_stat_user_indexes ui JOIN pg_index i USING (indexrelid)
-WHERE NOT indisunique
-  AND idx_scan = 0
-  AND schemaname NOT LIKE '_timescaledb%';
-"""
+from doctor.catalog import pretty_size
+
+# Object identifier of the B-tree access method, which is fixed.
+BTREE_AM = 403
+
+
+def _in_timescaledb(row):
+    """Check if a row of pg_class is in a TimescaleDB schema."""
+    return row is not None and row.nspname.startswith('_timescaledb')
+
+
+def _size(sizes, oid):
+    """Get the size of a relation from the relation_size snapshot relation.
+
+    Relations that are not in the snapshot, because they were created
+    while it was read, are counted as empty.
+    """
+    row = sizes.get(oid)
+    return row.bytes if row is not None and row.bytes is not None else 0
 
 @doctor.register
 @dataclass
 class UnusedIndex(doctor.Rule):
     """Find all unused indexes."""
 
-    query: str = UNUSED_QUERY
     message: str = "index '{indexrelname}' on table '{relation}' is not used"
     detail: str = "Index {indexrelname} is not used and occupied {index_size}."
     hint: str = ("Since the index '{indexrelname}' on table '{relation}' is not used,"
                  " you can remove it.")
+    relations: tuple = ('pg_stat_user_indexes', 'pg_index', 'pg_inherits', 'pg_class',
+                        'relation_size')
+    inputs: tuple = ('catalog', 'scans')
+
+    def evaluate(self, snapshot):
+        """Find indexes that were never scanned."""
+        pg_class = snapshot['pg_class']
+        pg_index = snapshot['pg_index']
+        sizes = snapshot['relation_size']
+        hypertables = {row.inhparent for row in snapshot['pg_inherits']
+                       if _in_timescaledb(pg_class.get(row.inhrelid))}
+        for row in snapshot['pg_stat_user_indexes']:
+            index = pg_index.get(row.indexrelid)
+            # Schemas are skipped like with the pattern '_timescaledb%'
+            # of LIKE, where the underscore matches any character.
+            if index is None or index.indisunique or row.idx_scan != 0 \
+               or fnmatchcase(row.schemaname, '?timescaledb*') or index.indrelid in hypertables:
+                continue
+            yield {
+                'relation': pg_class.get(row.relid).name,
+                'indexrelname': row.indexrelname,
+                'index_size': pretty_size(_size(sizes, row.indexrelid)),
+            }
+
+@doctor.register
+class UnusedHypertableIndex(doctor.Rule):
+    """Find unused indexes on hypertables.
+
+    Each index on a hypertable has a copy on each chunk, so the number
+    of scans and the size of the index are summed over the chunks.
+    """
+
+    relations: tuple = ('chunk_index', 'chunk', 'hypertable', 'pg_stat_user_indexes',
+                        'pg_index', 'pg_class', 'relation_size')
+    inputs: tuple = ('catalog', 'scans', 'chunks')
+    interval: float = 3600.0
+    message: str = "index '{indexrelname}' on hypertable '{relation}' is not used"
+    detail: str = ("Index {indexrelname} is not used on any of the {chunk_count} chunks"
+                   " and occupied {index_size} in total.")
+    hint: str = ("Since the index '{indexrelname}' on hypertable '{relation}' is not used,"
+                 " you can remove it.")
+    dependencies: dict = {
+        'timescaledb': '1.0'
+    }
+
+    # pylint: disable-next=too-many-locals
+    def evaluate(self, snapshot):
+        """Find indexes on hypertables that were never scanned on any chunk."""
+        pg_index = snapshot['pg_index']
+        sizes = snapshot['relation_size']
+        chunks = snapshot['chunk']
+        hypertables = snapshot['hypertable']
+        stats = {(row.schemaname, row.indexrelname): row
+                 for row in snapshot['pg_stat_user_indexes']}
+        groups = {}
+        for row in snapshot['chunk_index']:
+            chunk = chunks.get(row.chunk_id)
+            hypertable = hypertables.get(row.hypertable_id)
+            if chunk is None or hypertable is None \
+               or hypertable.schema_name.startswith('_timescaledb'):
+                continue
+            stat = stats.get((chunk.schema_name, row.index_name))
+            index = pg_index.get(stat.indexrelid) if stat is not None else None
+            if index is None or index.indisunique:
+                continue
+            group = groups.setdefault((hypertable.id, row.hypertable_index_name), [0, 0, 0])
+            group[0] += 1
+            group[1] += stat.idx_scan
+            group[2] += _size(sizes, stat.indexrelid)
+        pg_class = snapshot['pg_class']
+        findings = sorted(((key, group) for key, group in groups.items() if group[1] == 0),
+                          key=lambda item: -item[1][2])
+        for (hypertable_id, name), (count, _, size) in findings:
+            yield {
+                'relation': pg_class.get(hypertables.get(hypertable_id).relid).name,
+                'indexrelname': name,
+                'chunk_count': count,
+                'index_size': pretty_size(size),
+            }
+
+# Relations used to compare the indexes of each table.
+INDEX_RELATIONS = ('pg_index', 'pg_class', 'pg_stat_user_tables',
+                   'hypertable', 'chunk', 'chunk_index', 'relation_size')
+
+
+def _writes(row):
+    """Get the number of row writes to a table that update its indexes."""
+    if row is None:
+        return 0
+    return row.n_tup_ins + row.n_tup_upd - row.n_tup_hot_upd
+
+
+def _chunk_totals(snapshot):
+    """Sum the sizes of chunk indexes and the writes to chunks.
+
+    Returns a dictionary from hypertable index to the bytes used by
+    its chunk indexes, and a dictionary from hypertable to the number
+    of row writes to its chunks that updated the indexes.
+    """
+    pg_class = snapshot['pg_class']
+    relation_size = snapshot['relation_size']
+    hypertables = snapshot['hypertable']
+    chunks = snapshot['chunk']
+    sizes = {}
+    writes = {}
+    if len(chunks) == 0:
+        return sizes, writes
+    names = {(row.nspname, row.relname): row.oid for row in pg_class}
+    for row in snapshot['chunk_index']:
+        chunk = chunks.get(row.chunk_id)
+        hypertable = hypertables.get(row.hypertable_id)
+        if chunk is None or hypertable is None:
+            continue
+        index = names.get((chunk.schema_name, row.index_name))
+        parent = names.get((hypertable.schema_name, row.hypertable_index_name))
+        if index is not None and parent is not None:
+            sizes[parent] = sizes.get(parent, 0) + _size(relation_size, index)
+    stats = snapshot['pg_stat_user_tables']
+    for chunk in chunks:
+        hypertable = hypertables.get(chunk.hypertable_id)
+        if hypertable is not None:
+            writes[hypertable.relid] = (writes.get(hypertable.relid, 0)
+                                        + _writes(stats.get(chunk.relid)))
+    return sizes, writes
+
+
+def _table_indexes(snapshot):
+    """Get the indexes of each table with their sizes.
+
+    Yields the name of the table, the number of row writes to the
+    table that updated its indexes, and a list of ``(index, bytes)``.
+
+    Indexes on system tables and on chunks are not included. Instead, the sizes of the chunk
+    indexes are added to the index on the hypertable and the writes to
+    the chunks are added to the hypertable, so that each index of a
+    hypertable is compared only once.
+    """
+    pg_class = snapshot['pg_class']
+    relation_size = snapshot['relation_size']
+    stats = snapshot['pg_stat_user_tables']
+    sizes, writes = _chunk_totals(snapshot)
+    excluded = {chunk.relid for chunk in snapshot['chunk']}
+    for relid, indexes in snapshot['pg_index'].group('indrelid').items():
+        table = pg_class.get(relid)
+        if relid in excluded or table is None or table.nspname == 'information_schema' \
+           or table.nspname.startswith(('pg_', '_timescaledb')):
+            continue
+        # Indexes that are not in pg_class were created or dropped
+        # while the snapshot was read, and are skipped.
+        yield (table.name, writes.get(relid, 0) + _writes(stats.get(relid)),
+               [(index, sizes.get(index.indexrelid, 0) + _size(relation_size, index.indexrelid))
+                for index in indexes if pg_class.get(index.indexrelid) is not None])
+
+
+def _duplicates(indexes, pg_class):
+    """Group indexes with the same definition.
+
+    Names and storage parameters of the indexes are not compared, since
+    they do not change what an index can be used for. Expressions and
+    predicates are compared as deparsed by the server, so equivalent
+    expressions written differently are also found.
+
+    Returns a list of ``(index, bytes)`` lists. In each list, the first
+    index is the one to keep: a primary key, a unique index, or else
+    the oldest index.
+    """
+    groups = {}
+    for index, size in indexes:
+        signature = (pg_class.get(index.indexrelid).relam, tuple(index.indkey),
+                     index.indnkeyatts, tuple(index.indclass), tuple(index.indoption),
+                     tuple(index.indcollation), index.indexprs, index.indpred)
+        groups.setdefault(signature, []).append((index, size))
+    return [sorted(group, key=lambda item: (not item[0].indisprimary,
+                                            not item[0].indisunique,
+                                            item[0].indexrelid))
+            for group in groups.values()]
+
+
+def _covers(index, other, pg_class):
+    """Check if the keys of `index` are the first keys of `other`.
+
+    Only B-tree indexes are compared, since other access methods
+    cannot use a prefix of the keys. Unique indexes are never covered,
+    since they also enforce a constraint, and neither are indexes with
+    expressions or included columns.
+    """
+    count = index.indnkeyatts
+    return (index.indexprs is None and not index.indisunique
+            and len(index.indkey) == count < other.indnkeyatts
+            and pg_class.get(index.indexrelid).relam == BTREE_AM
+            and pg_class.get(other.indexrelid).relam == BTREE_AM
+            and index.indpred == other.indpred
+            and index.indkey == other.indkey[:count]
+            and index.indclass == other.indclass[:count]
+            and index.indoption == other.indoption[:count]
+            and index.indcollation == other.indcollation[:count])
+
+
+def _ranked(findings):
+    """Order findings by size and then by writes, both descending."""
+    for _, _, finding in sorted(findings, key=lambda item: (-item[0], -item[1])):
+        yield finding
 
-DUPLICATE_INDEX_QUERY = """
-SELECT indrelid::regclass as relation,
-       a.indexrelid::regclass as index1,
-       b.indexrelid::regclass as index2
-  FROM pg_index a JOIN pg_index b USING (indrelid, indkey)
- WHERE a.indexrelid != b.indexrelid;
-"""
 
 @doctor.register
 @dataclass
 class DuplicateIndex(doctor.Rule):
-    """Find duplicate indexes."""
+    """Find duplicate indexes.
+
+    Each index that duplicates another index is reported once, together
+    with the index to keep. Indexes on hypertables are reported for the
+    hypertable rather than for each chunk.
+    """
 
-    query: str = DUPLICATE_INDEX_QUERY
+    relations: tuple = INDEX_RELATIONS
+    inputs: tuple = ('catalog', 'chunks')
+    interval: float = 3600.0
     message: str = "index '{index1}' and '{index2}' seems to be duplicates"
     detail: str = ("Index '{index1}' and '{index2}' are on the same relation "
-                   "'{relation}' and has the same keys.")
-    hint: str = "You might want to remove one of the indexes to save space."
+                   "'{relation}' and has the same definition. Index '{index2}' uses"
+                   " {size} and is updated for {writes} rows written to '{relation}'.")
+    hint: str = "You might want to remove index '{index2}' to save space and make writes cheaper."
+
+    def evaluate(self, snapshot):
+        """Find indexes on the same relation with the same definition."""
+        pg_class = snapshot['pg_class']
+        findings = []
+        for relation, writes, indexes in _table_indexes(snapshot):
+            for (keep, _), *duplicates in _duplicates(indexes, pg_class):
+                findings.extend((size, writes, {
+                    'relation': relation,
+                    'index1': pg_class.get(keep.indexrelid).name,
+                    'index2': pg_class.get(index.indexrelid).name,
+                    'size': pretty_size(size),
+                    'writes': writes,
+                }) for index, size in duplicates)
+        yield from _ranked(findings)
+
+@doctor.register
+@dataclass
+class RedundantIndex(doctor.Rule):
+    """Find indexes covered by another index.
+
+    An index is covered by another index if its keys are the first
+    keys of the other index. Duplicate indexes are reported by
+    `DuplicateIndex` and only the index to keep is compared here.
+    """
+
+    relations: tuple = INDEX_RELATIONS
+    inputs: tuple = ('catalog', 'chunks')
+    interval: float = 3600.0
+    message: str = "index '{index}' is covered by index '{covering}'"
+    detail: str = ("The keys of index '{index}' on relation '{relation}' are the first"
+                   " keys of index '{covering}', so queries that can use '{index}' can"
+                   " also use '{covering}'. Index '{index}' uses {size} and is updated"
+                   " for {writes} rows written to '{relation}'.")
+    hint: str = "You might want to remove index '{index}' to save space and make writes cheaper."
+
+    def evaluate(self, snapshot):
+        """Find indexes on the same relation where one is a prefix of the other."""
+        pg_class = snapshot['pg_class']
+        findings = []
+        for relation, writes, indexes in _table_indexes(snapshot):
+            keep = [group[0] for group in _duplicates(indexes, pg_class)]
+            for index, size in keep:
+                # The covering index with the fewest keys is reported,
+                # since it is the closest match.
+                covering = [other for other, _ in keep if _covers(index, other, pg_class)]
+                if covering:
+                    other = min(covering, key=lambda row: (row.indnkeyatts, row.indexrelid))
+                    findings.append((size, writes, {
+                        'relation': relation,
+                        'index': pg_class.get(index.indexrelid).name,
+                        'covering': pg_class.get(other.indexrelid).name,
+                        'size': pretty_size(size),
+                        'writes': writes,
+                    }))
+        yield from _ranked(findings)
@@ -14,36 +14,114 @@
 
 """Unit tests for index checking rules."""
 
-from timescaledb import Table
+from timescaledb import Hypertable, Index, Table
 
-from doctor.unittest import PostgreSQLTestCase
-from doctor.rules.index import DuplicateIndex
+from doctor.unittest import PostgreSQLTestCase, TimescaleDBTestCase
+from doctor.rules.index import DuplicateIndex, RedundantIndex, UnusedHypertableIndex, UnusedIndex
 
 class TestIndexRules(PostgreSQLTestCase):
     """Test index checking rules."""
 
-    def setUp(self):
-        """Set up unit tests for index checking rules."""
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create tables with duplicate, redundant, and unused indexes."""
         table = Table("with_duplicate_index", {
             "one": "int",
             "two": "int",
         })
-        table.create(self.connection)
+        table.create(connection)
 
-        with self.connection.cursor() as cursor:
+        with connection.cursor() as cursor:
             cursor.execute("CREATE INDEX index_one ON with_duplicate_index(one,two)")
-            cursor.execute("CREATE INDEX index_two ON with_duplicate_index(one,two)")
-        self.connection.commit()
-
-    def tearDown(self):
-        """Tear down unit tests for index checking rules."""
-        with self.connection.cursor() as cursor:
-            cursor.execute("DROP TABLE with_duplicate_index")
-        self.connection.commit()
+            cursor.execute("CREATE INDEX index_two ON with_duplicate_index(one,two)"
+                           " WITH (fillfactor = 50)")
+            cursor.execute("CREATE INDEX index_three ON with_duplicate_index(one)")
+            cursor.execute("CREATE TABLE inheritance_parent (value int)")
+            cursor.execute("CREATE INDEX parent_value ON inheritance_parent(value)")
+            cursor.execute("CREATE TABLE inheritance_child () INHERITS (inheritance_parent)")
 
     def test_duplicate(self):
         """Test rule for detecting duplicate index."""
         messages = []
         messages.extend(self.run_rule(DuplicateIndex()))
-        self.assertIn(DuplicateIndex.message.format(index1="index_one", index2="index_two"),
+        self.assertEqual(messages,
+                         [DuplicateIndex.message.format(index1="index_one", index2="index_two")])
+
+    def test_redundant(self):
+        """Test rule for detecting index covered by another index."""
+        messages = list(self.run_rule(RedundantIndex()))
+        self.assertEqual(messages,
+                         [RedundantIndex.message.format(index="index_three", covering="index_one")])
+
+    def test_unused_inheritance(self):
+        """Test that unused indexes on parents of plain inheritance are reported."""
+        messages = list(self.run_rule(UnusedIndex()))
+        self.assertIn(UnusedIndex.message.format(indexrelname="parent_value",
+                                                 relation="inheritance_parent"),
+                      messages)
+
+class TestHypertableIndexRules(TimescaleDBTestCase):
+    """Test index checking rules for hypertables."""
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable with an index that is never used."""
+        table = Hypertable("with_unused_index", "time", {
+            "time": "timestamptz not null",
+            "value": "float",
+        })
+        table.create(connection)
+        Index("unused_value", table.name, ["value"]).create(connection)
+        Index("duplicate_value", table.name, ["value"]).create(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO with_unused_index "
+                "SELECT time, random() "
+                "FROM generate_series(NOW() - INTERVAL '30 days', NOW(), '1 hour') AS time"
+            )
+
+    def test_unused(self):
+        """Test that unused indexes are reported for the hypertable only."""
+        messages = list(self.run_rule(UnusedHypertableIndex()))
+        self.assertIn(UnusedHypertableIndex.message.format(indexrelname="unused_value",
+                                                           relation="with_unused_index"),
                       messages)
+        messages = list(self.run_rule(UnusedIndex()))
+        self.assertNotIn(UnusedIndex.message.format(indexrelname="unused_value",
+                                                    relation="with_unused_index"),
+                         messages)
+
+    def test_duplicate(self):
+        """Test that duplicate indexes are reported once for the hypertable."""
+        messages = list(self.run_rule(DuplicateIndex()))
+        self.assertEqual(messages,
+                         [DuplicateIndex.message.format(index1="unused_value",
+                                                        index2="duplicate_value")])
+
+class TestQuotedSchemaIndexRules(TimescaleDBTestCase):
+    """Test index checking rules for hypertables in schemas that need quoting."""
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable with duplicate indexes in a quoted schema."""
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE SCHEMA "Sensor Data"')
+            cursor.execute('CREATE TABLE "Sensor Data".readings (time timestamptz not null,'
+                           ' value float)')
+            cursor.execute("""SELECT create_hypertable('"Sensor Data".readings', 'time')""")
+            cursor.execute('CREATE INDEX first_value ON "Sensor Data".readings(value)')
+            cursor.execute('CREATE INDEX second_value ON "Sensor Data".readings(value)')
+            cursor.execute(
+                'INSERT INTO "Sensor Data".readings '
+                "SELECT time, random() "
+                "FROM generate_series(NOW() - INTERVAL '30 days', NOW(), '1 hour') AS time"
+            )
+            cursor.execute('ANALYZE "Sensor Data".readings')
+
+    def test_duplicate_size(self):
+        """Test that the sizes of the chunk indexes are added to the hypertable index."""
+        rows = list(DuplicateIndex().fetch(self.connection))
+        self.assertEqual([row['index2'] for row in rows], ['"Sensor Data".second_value'])
+        # The index on the hypertable itself is a single empty page.
+        self.assertNotEqual(rows[0]['size'], '8192 bytes')
@@ -0,0 +1,240 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for background jobs.
+
+The rules read the job statistics that TimescaleDB keeps for each job,
+which are totals over all runs and the times of the last run. Since
+there is no history of runs, a job is considered to get slower if its
+last run took much longer than the average of all runs.
+
+Background workers are shared by all databases of the server, but the
+rules only see the jobs of the current database.
+"""
+
+from datetime import timedelta
+
+import doctor
+
+# Relations read by the rules.
+JOBS_RELATIONS = ('bgw_job', 'bgw_job_stat', 'hypertable', 'database', 'pg_class')
+
+
+def _truncate(value):
+    """Truncate an interval to whole seconds for showing it."""
+    return value and timedelta(days=value.days, seconds=value.seconds)
+
+
+def _jobs(snapshot):
+    """Get the jobs with their statistics.
+
+    Returns a list of dictionaries with the fields of each job, where
+    `duration` is the duration of the current run if the job is
+    running, and otherwise of the last run.
+    """
+    now = snapshot['database'].rows[0].now
+    stats = snapshot['bgw_job_stat']
+    hypertables = snapshot['hypertable']
+    pg_class = snapshot['pg_class']
+    jobs = []
+    for job in snapshot['bgw_job']:
+        stat = stats.get(job.id)
+        if stat is None:
+            continue
+        hypertable = hypertables.get(job.hypertable_id)
+        known = stat.last_finish is not None and stat.last_start is not None
+        running = stat.last_finish < stat.last_start if known else None
+        # The duration of the current run, if the job is running, and
+        # otherwise of the last run.
+        if running:
+            duration = now - stat.last_start
+        else:
+            duration = stat.last_finish - stat.last_start if known else None
+        jobs.append({
+            'job_id': job.id,
+            'application_name': job.application_name,
+            'schedule_interval': job.schedule_interval,
+            'scheduled': job.scheduled,
+            'target': ('no hypertable' if hypertable is None
+                       else f"hypertable '{pg_class.get(hypertable.relid).name}'"),
+            'total_runs': stat.total_runs,
+            'total_failures': stat.total_failures,
+            'consecutive_failures': stat.consecutive_failures,
+            'last_success': stat.last_successful_finish or 'never',
+            'running': running,
+            'duration': duration,
+            'average': stat.total_duration / stat.total_runs if stat.total_runs else None,
+        })
+    return jobs
+
+@doctor.register
+class FailingJob(doctor.Rule):
+    """Detect jobs that fail repeatedly."""
+
+    message: str = (
+        "Job {job_id} ({application_name}) for {target} failed {consecutive_failures}"
+        " times in a row."
+    )
+    detail: str = (
+        "Job {job_id} ({application_name}) for {target} failed the last"
+        " {consecutive_failures} times it ran, and {total_failures} of"
+        " {total_runs} runs in total. The last successful run finished at"
+        " {last_success}. While the job fails, the policy it implements is not"
+        " applied."
+    )
+    hint: str = (
+        "Check the server log for the errors of job {job_id}, and run it"
+        " manually using run_job() to see the error."
+    )
+    relations: tuple = JOBS_RELATIONS
+    inputs: tuple = ('jobs',)
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find jobs that failed at least three times in a row."""
+        jobs = [job for job in _jobs(snapshot) if job['consecutive_failures'] >= 3]
+        for job in sorted(jobs, key=lambda job: -job['consecutive_failures']):
+            yield {key: job[key] for key in ('job_id', 'application_name', 'target',
+                                             'consecutive_failures', 'total_failures',
+                                             'total_runs', 'last_success')}
+
+@doctor.register
+class GrowingJobDuration(doctor.Rule):
+    """Detect jobs that take longer than they used to."""
+
+    message: str = (
+        "Last run of job {job_id} ({application_name}) for {target} took {duration},"
+        " more than twice the average of {average}."
+    )
+    detail: str = (
+        "The last run of job {job_id} ({application_name}) for {target} took"
+        " {duration}, while the average of all {total_runs} runs is {average}."
+        " The job is getting slower, usually because the data it processes in"
+        " each run is growing."
+    )
+    hint: str = (
+        "Check whether job {job_id} has more data to process in each run than"
+        " before, for example because it fell behind."
+    )
+    relations: tuple = JOBS_RELATIONS
+    inputs: tuple = ('jobs',)
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find jobs whose last run took more than twice the average."""
+        jobs = [job for job in _jobs(snapshot)
+                if job['running'] is False and job['total_runs'] >= 10
+                and job['average'] is not None
+                and job['duration'] >= max(2 * job['average'], timedelta(minutes=1))]
+        for job in sorted(jobs, key=lambda job: job['duration'], reverse=True):
+            yield {
+                'job_id': job['job_id'],
+                'application_name': job['application_name'],
+                'target': job['target'],
+                'total_runs': job['total_runs'],
+                'duration': _truncate(job['duration']),
+                'average': _truncate(job['average']),
+            }
+
+@doctor.register
+class OverlappingJob(doctor.Rule):
+    """Detect jobs running longer than their schedule interval."""
+
+    message: str = (
+        "The {run} run of job {job_id} ({application_name}) for {target} took"
+        " {duration}, longer than the schedule interval of {schedule_interval}."
+    )
+    detail: str = (
+        "Job {job_id} ({application_name}) for {target} is scheduled to run"
+        " every {schedule_interval}, but the {run} run took {duration}. The"
+        " next run cannot start when it is scheduled, so the job falls behind"
+        " and keeps a background worker busy all the time."
+    )
+    hint: str = (
+        "Increase the schedule interval of job {job_id} using alter_job(), or"
+        " make each run process less data."
+    )
+    relations: tuple = JOBS_RELATIONS
+    inputs: tuple = ('jobs', 'time')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find jobs whose current or last run took longer than the schedule interval."""
+        jobs = [job for job in _jobs(snapshot)
+                if job['scheduled'] and job['duration'] is not None
+                and job['duration'] >= job['schedule_interval']]
+        for job in sorted(jobs, key=lambda job: job['duration'], reverse=True):
+            yield {
+                'job_id': job['job_id'],
+                'application_name': job['application_name'],
+                'target': job['target'],
+                'schedule_interval': job['schedule_interval'],
+                'duration': _truncate(job['duration']),
+                'run': 'current' if job['running'] else 'last',
+            }
+
+@doctor.register
+class TooManyJobs(doctor.Rule):
+    """Detect jobs needing more background workers than are available."""
+
+    message: str = (
+        "Jobs need {busy_workers} background workers on average, but"
+        " timescaledb.max_background_workers is {max_workers}."
+    )
+    detail: str = (
+        "The {job_count} scheduled jobs of the database need {busy_workers}"
+        " background workers on average, computed from the average duration"
+        " and the schedule interval of each job, and {running_count} jobs are"
+        " running now. With timescaledb.max_background_workers set to"
+        " {max_workers}, of which one is used by the scheduler, jobs have to"
+        " wait for a worker and start late. Other databases on the server"
+        " use the same workers."
+    )
+    hint: str = (
+        "Increase timescaledb.max_background_workers, and max_worker_processes"
+        " accordingly, or schedule the jobs less often."
+    )
+    relations: tuple = JOBS_RELATIONS + ('pg_settings',)
+    inputs: tuple = ('jobs', 'settings')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find whether the jobs need more background workers than available."""
+        jobs = [job for job in _jobs(snapshot)
+                if job['scheduled'] and job['schedule_interval'] > timedelta(0)]
+        busy_workers = round(sum(job['average'] / job['schedule_interval']
+                                 for job in jobs if job['average'] is not None), 1)
+        running_count = sum(1 for job in jobs if job['running'])
+        setting = snapshot['pg_settings'].get('timescaledb.max_background_workers')
+        max_workers = int(setting.setting)
+        # One background worker is used by the scheduler of the database.
+        if max(running_count, busy_workers) >= max_workers - 1:
+            yield {
+                'job_count': len(jobs),
+                'running_count': running_count,
+                'busy_workers': busy_workers,
+                'max_workers': max_workers,
+            }
@@ -0,0 +1,79 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for background job rules."""
+
+from timescaledb import Hypertable
+
+from doctor.unittest import TimescaleDBTestCase, wait_for_jobs
+from doctor.rules.jobs import FailingJob, GrowingJobDuration, OverlappingJob, TooManyJobs
+
+class TestJobRules(TimescaleDBTestCase):
+    """Test background job rules.
+
+    This will create a hypertable with a retention policy that is not
+    scheduled, so the rules run against the job catalogs of the server
+    without finding anything.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertable with a retention policy."""
+        table = Hypertable("events", "time", {
+            'time': "timestamptz not null",
+            'kind': "text",
+        })
+        table.create(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT alter_job(add_retention_policy('events', INTERVAL '1 year'),"
+                           " scheduled => false)")
+
+    def test_healthy(self):
+        """Test that a healthy job is not reported."""
+        for rule in (FailingJob(), GrowingJobDuration(), OverlappingJob(), TooManyJobs()):
+            self.assertEqual(list(self.run_rule(rule)), [], type(rule).__name__)
+
+class TestFailingJobRules(TimescaleDBTestCase):
+    """Test background job rules with a job that fails.
+
+    The job is run by the scheduler, so the changes of the tests are
+    committed.
+
+    """
+
+    rollback = False
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create a procedure for a custom job that always fails."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE PROCEDURE failing_job(job_id int, config jsonb)"
+                " LANGUAGE plpgsql AS $$BEGIN RAISE EXCEPTION 'job failed'; END$$"
+            )
+
+    def test_failing(self):
+        """Test rule for detecting jobs that fail repeatedly."""
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT add_job('failing_job', INTERVAL '1 second',"
+                           " retry_period => INTERVAL '1 second') AS job_id")
+            job_id = cursor.fetchone()['job_id']
+            wait_for_jobs(self.connection, [job_id], runs=3)
+            cursor.execute("SELECT alter_job(%s, scheduled => false)", (job_id,))
+        rows = list(FailingJob().fetch(self.connection))
+        self.assertEqual([row['job_id'] for row in rows], [job_id])
+        self.assertGreaterEqual(rows[0]['consecutive_failures'], 3)
+        self.assertEqual(rows[0]['target'], 'no hypertable')
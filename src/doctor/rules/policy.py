@@ -0,0 +1,215 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for compression and retention policies.
+
+Chunks that are no longer written to should be compressed or dropped
+by a policy. The rules report hypertables where this does not happen,
+ordered by the size of the chunks involved. The space that compression
+would reclaim is estimated using the compression ratio of the chunks
+of the hypertable that are already compressed or, if there are none,
+of all compressed chunks in the database.
+
+Only hypertables partitioned by time are checked, since the policies
+of hypertables partitioned by integers use integer thresholds.
+"""
+
+import doctor
+
+from doctor.catalog import pretty_size
+
+# Common table expression with the sizes before and after compression
+# of the compressed chunks of each hypertable.
+# Expression for the estimated bytes reclaimed by compressing `bytes`,
+# given `ratios` of the hypertable as `r` and `totals` as `t`.
+# Relations used to find chunks that are not compressed by a policy.
+POLICY_RELATIONS = ('bgw_job', 'hypertable', 'chunk', 'chunks', 'compression_chunk_size',
+                    'relation_size', 'database', 'pg_class')
+
+
+def _ratios(snapshot):
+    """Sum the sizes of compressed chunks before and after compression.
+
+    Returns a dictionary from hypertable schema and name to a tuple
+    ``(before, after)``, and the same tuple for all hypertables.
+    """
+    chunks = snapshot['chunk']
+    hypertables = snapshot['hypertable']
+    ratios = {}
+    for row in snapshot['compression_chunk_size']:
+        chunk = chunks.get(row.chunk_id)
+        hypertable = hypertables.get(chunk.hypertable_id) if chunk is not None else None
+        if hypertable is None:
+            continue
+        before, after = ratios.get((hypertable.schema_name, hypertable.table_name), (0, 0))
+        ratios[hypertable.schema_name, hypertable.table_name] = (
+            before + row.uncompressed_heap_size + row.uncompressed_toast_size
+            + row.uncompressed_index_size,
+            after + row.compressed_heap_size + row.compressed_toast_size
+            + row.compressed_index_size)
+    totals = (sum(before for before, _ in ratios.values()),
+              sum(after for _, after in ratios.values()))
+    return ratios, totals
+
+
+def _reclaimable(size, ratio, totals):
+    """Estimate the bytes reclaimed by compressing `size` bytes.
+
+    The compression ratio of the hypertable is used if it has
+    compressed chunks, and otherwise the ratio of all hypertables.
+    """
+    for before, after in (ratio, totals):
+        if before:
+            return pretty_size(round(size - size * after / before))
+    return 'an unknown amount'
+
+
+def _policy_chunks(snapshot, matches):
+    """Find the chunks of each hypertable that a policy should handle.
+
+    `matches` is called with the row of ``timescaledb_information.chunks``
+    for each uncompressed chunk, and returns the keys of the groups of
+    chunks that the chunk is reported in. Each key starts with the
+    schema and name of the hypertable. Yields the key and a dictionary
+    with the fields common to the policy rules for each group, ordered
+    by the size of the chunks, descending.
+    """
+    sizes = snapshot['relation_size']
+    names = {(row.nspname, row.relname): row.name for row in snapshot['pg_class']}
+    groups = {}
+    for chunk in snapshot['chunks']:
+        if chunk.is_compressed:
+            continue
+        for key in matches(chunk):
+            group = groups.setdefault(key, [0, None, 0])
+            group[0] += 1
+            if group[1] is None or chunk.range_start < group[1]:
+                group[1] = chunk.range_start
+            group[2] += sizes.get(chunk.relid).total_bytes
+    ratios, totals = _ratios(snapshot)
+    for key, (count, oldest, size) in sorted(groups.items(), key=lambda item: -item[1][2]):
+        yield key, {
+            'hypertable': names[key[:2]],
+            'chunk_count': count,
+            'oldest': oldest,
+            'size': pretty_size(size),
+            'reclaimable': _reclaimable(size, ratios.get(key[:2], (None, None)), totals),
+        }
+
+
+def _jobs(snapshot, *procedures):
+    """Get the jobs running one of `procedures` together with their hypertable.
+
+    Jobs without a hypertable are skipped, like in a join with
+    ``timescaledb_information.jobs``.
+    """
+    hypertables = snapshot['hypertable']
+    for job in snapshot['bgw_job']:
+        hypertable = hypertables.get(job.hypertable_id)
+        if job.proc_name in procedures and hypertable is not None:
+            yield job, (hypertable.schema_name, hypertable.table_name)
+
+@doctor.register
+class LaggingCompression(doctor.Rule):
+    """Detect chunks that the compression policy should have compressed."""
+
+    message: str = (
+        "Hypertable '{hypertable}' has {chunk_count} uncompressed chunks ({size})"
+        " older than the compression policy allows."
+    )
+    detail: str = (
+        "The compression policy of hypertable '{hypertable}' compresses chunks"
+        " older than {compress_after}, but {chunk_count} chunks using {size} are"
+        " older than that and still not compressed, the oldest starting at"
+        " {oldest}. Compressing them would reclaim about {reclaimable}. This"
+        " usually means that the policy job is failing, is paused, or cannot"
+        " keep up."
+    )
+    hint: str = (
+        "Check the job statistics of the compression policy of hypertable"
+        " '{hypertable}' in timescaledb_information.job_stats, or compress"
+        " the chunks using compress_chunk()."
+    )
+    relations: tuple = POLICY_RELATIONS
+    inputs: tuple = ('catalog', 'chunks', 'jobs', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find chunks older than the compression policy allows."""
+        now = snapshot['database'].rows[0].now
+        policies = {}
+        for job, hypertable in _jobs(snapshot, 'policy_compression'):
+            if job.compress_after is not None:
+                policies.setdefault(hypertable, []).append(job)
+
+        def matches(chunk):
+            # A chunk is only lagging if the policy had a chance to run
+            # after the chunk became old enough to be compressed.
+            hypertable = (chunk.hypertable_schema, chunk.hypertable_name)
+            return [hypertable + (job.compress_after,) for job in policies.get(hypertable, [])
+                    if chunk.range_end is not None
+                    and chunk.range_end < now - job.compress_after - job.schedule_interval]
+
+        for key, row in _policy_chunks(snapshot, matches):
+            row['compress_after'] = key[2]
+            yield row
+
+@doctor.register
+class MissingPolicy(doctor.Rule):
+    """Detect hypertables with neither a compression nor a retention policy."""
+
+    message: str = (
+        "Hypertable '{hypertable}' has no compression or retention policy"
+        " and {chunk_count} uncompressed chunks ({size}) that are no longer"
+        " written to."
+    )
+    detail: str = (
+        "Hypertable '{hypertable}' has neither a compression policy nor a"
+        " retention policy, so all chunks are kept uncompressed. There are"
+        " {chunk_count} chunks using {size} with a time range that has ended,"
+        " the oldest starting at {oldest}. Compressing them would reclaim"
+        " about {reclaimable}, and queries scanning them would read less data."
+    )
+    hint: str = (
+        "Add a compression policy using add_compression_policy() or a"
+        " retention policy using add_retention_policy() to hypertable"
+        " '{hypertable}'."
+    )
+    relations: tuple = POLICY_RELATIONS
+    inputs: tuple = ('catalog', 'chunks', 'jobs', 'time')
+    interval: float = 3600.0
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+    def evaluate(self, snapshot):
+        """Find chunks that have ended of hypertables without policies."""
+        now = snapshot['database'].rows[0].now
+        policies = {hypertable for _, hypertable
+                    in _jobs(snapshot, 'policy_compression', 'policy_retention')}
+
+        def matches(chunk):
+            # Chunks that are no longer written to, since their time
+            # range has ended.
+            hypertable = (chunk.hypertable_schema, chunk.hypertable_name)
+            if chunk.range_end is not None and chunk.range_end < now \
+               and hypertable not in policies:
+                return [hypertable]
+            return []
+
+        for _, row in _policy_chunks(snapshot, matches):
+            yield row
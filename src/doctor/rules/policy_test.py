@@ -0,0 +1,63 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for policy rules."""
+
+from timescaledb import Hypertable
+
+from doctor.unittest import TimescaleDBTestCase
+from doctor.rules.policy import LaggingCompression, MissingPolicy
+
+class TestPolicyRules(TimescaleDBTestCase):
+    """Test policy rules.
+
+    This will create two hypertables with two months of data. The
+    first one has no policies and the second one has a compression
+    policy that is paused, so old chunks are never compressed.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertables for policy rules."""
+        columns = {
+            'time': "timestamptz not null",
+            'device_id': "integer",
+            'temperature': "float"
+        }
+        unmanaged = Hypertable("unmanaged", "time", columns)
+        lagging = Hypertable("lagging", "time", columns)
+        for table in (unmanaged, lagging):
+            table.create(connection)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table.name} "
+                    "SELECT time, (random()*30)::int, random()*80 - 40 "
+                    "FROM generate_series(NOW() - INTERVAL '60 days', NOW(), '1 hour') AS time"
+                )
+        lagging.compress(connection, segmentby='device_id')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT alter_job(add_compression_policy('lagging', INTERVAL '7 days'),"
+                           " scheduled => false)")
+
+    def test_missing(self):
+        """Test rule for detecting hypertables without policies."""
+        rows = list(MissingPolicy().fetch(self.connection))
+        self.assertEqual([str(row['hypertable']) for row in rows], ['unmanaged'])
+
+    def test_lagging(self):
+        """Test rule for detecting chunks that should be compressed."""
+        rows = list(LaggingCompression().fetch(self.connection))
+        self.assertEqual([str(row['hypertable']) for row in rows], ['lagging'])
+        self.assertGreater(rows[0]['chunk_count'], 0)
@@ -1,2 +0,0 @@
-DROP MATERIALIZED VIEW conditions_summary_hourly;
-DROP TABLE conditions;
@@ -0,0 +1,172 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for planner statistics of chunks.
+
+Queries on hypertables are planned using the statistics of each chunk,
+so chunks without statistics, or with statistics that no longer match
+the data, give bad plans. The rules compare the activity of each chunk
+since it was last analyzed with the number of rows in the chunk, and
+report the result once for each hypertable.
+
+Autovacuum is compared using the server settings, so per-table
+settings other than ``autovacuum_enabled`` are not taken into account.
+Compressed chunks are not checked. With a sample size, the chunks are
+sampled as described in `doctor.sample`.
+"""
+
+import doctor
+
+from doctor.sample import CHUNK_SAMPLE, confidence, estimate
+
+CHUNK_STATISTICS_QUERY = r"""
+WITH {chunk_sample},
+settings AS (
+    SELECT current_setting('autovacuum_analyze_threshold')::float8 AS threshold,
+           current_setting('autovacuum_analyze_scale_factor')::float8 AS scale_factor,
+           current_setting('autovacuum_naptime')::interval AS naptime,
+           current_setting('autovacuum') AS autovacuum,
+           current_setting('autovacuum_max_workers') AS max_workers,
+           -- Insert counts are since the statistics were reset.
+           extract(epoch FROM now() - coalesce(
+               (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()),
+               pg_postmaster_start_time())) AS seconds),
+chunk_stats AS (
+    SELECT ch.hypertable_id, ch.weight, s.n_tup_ins, s.n_mod_since_analyze,
+           greatest(c.reltuples, 0) AS reltuples,
+           greatest(s.last_analyze, s.last_autoanalyze) AS last_analyzed,
+           -- The statistics counters are lost on a crash, so a chunk
+           -- is only never analyzed if it also has no statistics.
+           CASE WHEN s.last_analyze IS NULL AND s.last_autoanalyze IS NULL
+                THEN pg_relation_size(c.oid) > 0
+                     AND NOT EXISTS (SELECT FROM pg_stats st
+                                      WHERE st.schemaname = s.schemaname
+                                        AND st.tablename = s.relname)
+                ELSE false END AS never_analyzed,
+           coalesce((SELECT NOT option_value::bool FROM pg_options_to_table(c.reloptions)
+                      WHERE option_name = 'autovacuum_enabled'), false) AS autovacuum_disabled
+      FROM chunk_sample ch
+      JOIN pg_stat_user_tables s ON s.schemaname = ch.schema_name AND s.relname = ch.table_name
+      JOIN pg_class c ON c.oid = s.relid
+     WHERE ch.compressed_chunk_id IS NULL),
+chunks AS (
+    SELECT cs.*, settings.*,
+           last_analyzed IS NOT NULL
+           AND n_mod_since_analyze >= greatest(reltuples, threshold) AS stale,
+           n_mod_since_analyze > threshold + scale_factor * reltuples
+           AND coalesce(last_analyzed, '-infinity') < now() - 10 * naptime AS overdue
+      FROM chunk_stats cs CROSS JOIN settings),
+hypertables AS (
+    SELECT format('%I.%I', h.schema_name, h.table_name)::regclass AS hypertable,
+           {chunk_count} AS chunk_count,
+           {never_analyzed} AS never_analyzed,
+           {stale} AS stale,
+           {overdue} AS overdue,
+           {disabled} AS disabled,
+           round(sum(n_mod_since_analyze * weight))::bigint AS modified,
+           coalesce(min(last_analyzed)::text, 'never') AS oldest_analyze,
+           round((sum(n_tup_ins * weight) / nullif(max(seconds), 0))::numeric, 1)
+               AS ingest_rate,
+           max(autovacuum) AS autovacuum, max(max_workers) AS max_workers,
+           max(naptime)::text AS naptime, max(scale_factor) AS scale_factor,
+           {confidence} AS confidence
+      FROM chunks
+      JOIN _timescaledb_catalog.hypertable h ON h.id = chunks.hypertable_id
+     WHERE h.schema_name NOT LIKE '\_timescaledb%'
+     GROUP BY h.id, h.schema_name, h.table_name)
+SELECT * FROM hypertables
+"""
+
+
+def _chunk_statistics(condition):
+    """Get the query for the chunk statistics of each hypertable.
+
+    The number of chunks and the number of rows are estimated if the
+    rule is executed with a sample size, and `condition` is the chunks
+    that the confidence note is for.
+    """
+    return CHUNK_STATISTICS_QUERY.format(
+        chunk_sample=CHUNK_SAMPLE, chunk_count=estimate(),
+        never_analyzed=estimate('never_analyzed'), stale=estimate('stale'),
+        overdue=estimate('overdue'), disabled=estimate('autovacuum_disabled'),
+        confidence=confidence(condition))
+
+STALE_QUERY = _chunk_statistics('never_analyzed OR stale') + """
+ WHERE never_analyzed > 0 OR stale > 0
+ ORDER BY modified DESC;
+"""
+
+@doctor.register
+class StaleStatistics(doctor.Rule):
+    """Detect hypertables with chunks that have missing or stale statistics."""
+
+    query: str = STALE_QUERY
+    message: str = (
+        "Hypertable '{hypertable}' has {never_analyzed} chunks that were never"
+        " analyzed and {stale} chunks with stale statistics."
+    )
+    detail: str = (
+        "Of the {chunk_count} uncompressed chunks of hypertable '{hypertable}',"
+        " {never_analyzed} chunks have data but were never analyzed, and"
+        " {stale} chunks had at least as many rows changed as they had rows"
+        " when they were last analyzed. In total, {modified} rows were changed"
+        " since the chunks were analyzed, and the oldest analyze was at"
+        " {oldest_analyze}. Queries touching these chunks are planned using"
+        " wrong estimates. {confidence}"
+    )
+    hint: str = (
+        "Run ANALYZE on hypertable '{hypertable}', or on the chunks listed by"
+        " show_chunks(), and check that autovacuum is running."
+    )
+    inputs: tuple = ('catalog', 'stats', 'chunks', 'settings', 'time')
+    interval: float = 3600.0
+    sampled: bool = True
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
+
+LAG_QUERY = _chunk_statistics('overdue') + """
+ WHERE overdue > 0 OR disabled > 0 OR autovacuum = 'off'
+ ORDER BY ingest_rate DESC NULLS LAST;
+"""
+
+@doctor.register
+class AutoanalyzeLag(doctor.Rule):
+    """Detect hypertables where autovacuum does not analyze chunks in time."""
+
+    query: str = LAG_QUERY
+    message: str = (
+        "Autovacuum does not keep up with hypertable '{hypertable}', {overdue}"
+        " chunks are overdue for analyze."
+    )
+    detail: str = (
+        "Hypertable '{hypertable}' receives {ingest_rate} rows per second on"
+        " average. {overdue} of its chunks passed the autoanalyze threshold but"
+        " were not analyzed within ten times autovacuum_naptime ({naptime}), and"
+        " autovacuum is disabled for {disabled} chunks. With autovacuum set to"
+        " {autovacuum}, autovacuum_max_workers set to {max_workers}, and"
+        " autovacuum_analyze_scale_factor set to {scale_factor}, the statistics"
+        " of recent chunks lag behind the data. {confidence}"
+    )
+    hint: str = (
+        "Enable autovacuum for the chunks of '{hypertable}', or increase"
+        " autovacuum_max_workers or autovacuum_vacuum_cost_limit so that"
+        " autovacuum keeps up with the ingest rate."
+    )
+    inputs: tuple = ('catalog', 'stats', 'chunks', 'settings', 'time')
+    interval: float = 3600.0
+    sampled: bool = True
+    dependencies: dict = {
+        'timescaledb': '2.0'
+    }
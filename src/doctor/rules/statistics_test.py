@@ -0,0 +1,60 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for statistics rules."""
+
+from timescaledb import Hypertable
+
+from doctor import Context
+from doctor.unittest import TimescaleDBTestCase
+from doctor.rules.statistics import StaleStatistics
+
+class TestStatisticsRules(TimescaleDBTestCase):
+    """Test statistics rules.
+
+    This will create two hypertables with a few weeks of data, where
+    only the second one is analyzed.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertables with and without statistics."""
+        columns = {
+            'time': "timestamptz not null",
+            'host': "text",
+            'load': "float"
+        }
+        for name in ("unanalyzed", "analyzed"):
+            Hypertable(name, "time", columns).create(connection)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {name} SELECT time, 'host' || (random()*5)::int, random()"
+                    " FROM generate_series(NOW() - INTERVAL '3 weeks', NOW(), '10 minutes') time"
+                )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE analyzed")
+
+    def test_stale(self):
+        """Test rule for detecting chunks without statistics."""
+        rows = list(StaleStatistics().fetch(self.connection))
+        self.assertEqual([str(row['hypertable']) for row in rows], ['unanalyzed'])
+        self.assertEqual(rows[0]['never_analyzed'], rows[0]['chunk_count'])
+
+    def test_sample(self):
+        """Test that counts are estimated from a sample of chunks."""
+        rows = list(StaleStatistics().fetch(self.connection, Context(sample=1)))
+        self.assertEqual([str(row['hypertable']) for row in rows], ['unanalyzed'])
+        self.assertEqual(rows[0]['never_analyzed'], rows[0]['chunk_count'])
+        self.assertTrue(rows[0]['confidence'].startswith("Estimated from 3 of"))
@@ -0,0 +1,169 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rules for the query workload on hypertables.
+
+The rules read the statistics of ``pg_stat_statements`` for the current
+database and match the statements against the hypertables by name. Only
+statements using at least one percent of the total execution time are
+considered, and findings are ordered by total execution time and then
+by the number of shared blocks read. The rules are only executed if
+``pg_stat_statements`` is in ``shared_preload_libraries``, since no
+statistics are collected otherwise.
+
+Statements are matched using their text, so the rules cannot see the
+plan of a statement. A statement without a condition on the time
+column of the hypertable in its ``WHERE`` clause cannot exclude any
+chunks, and a statement reading at least as many blocks as a chunk
+has in each call is probably scanning whole chunks.
+"""
+
+import doctor
+
+WORKLOAD_QUERY = r"""
+WITH hypertables AS (
+    SELECT h.hypertable_schema, h.hypertable_name, d.column_name AS time_column,
+           count(c.chunk_name) AS chunk_count,
+           coalesce(avg(pg_relation_size(format('%I.%I', c.chunk_schema, c.chunk_name)::regclass))
+                        FILTER (WHERE NOT c.is_compressed), 0)
+               / current_setting('block_size')::int AS chunk_blocks
+      FROM timescaledb_information.hypertables h
+      JOIN timescaledb_information.dimensions d
+        ON d.hypertable_schema = h.hypertable_schema
+       AND d.hypertable_name = h.hypertable_name
+       AND d.dimension_number = 1
+      LEFT JOIN timescaledb_information.chunks c
+        ON c.hypertable_schema = h.hypertable_schema
+       AND c.hypertable_name = h.hypertable_name
+     GROUP BY h.hypertable_schema, h.hypertable_name, d.column_name),
+statements AS (
+    SELECT s.*, sum(s.total_exec_time) OVER () AS database_time
+      FROM pg_stat_statements s
+     WHERE s.dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+       -- The statements of these rules are not part of the workload.
+       AND s.query !~* '\mpg_stat_statements\M'),
+workload AS (
+    SELECT format('%I.%I', h.hypertable_schema, h.hypertable_name)::regclass AS hypertable,
+           h.time_column, h.chunk_count, h.chunk_blocks::bigint AS chunk_blocks,
+           left(regexp_replace(s.query, '\s+', ' ', 'g'), 80) AS query,
+           s.calls, round(s.total_exec_time::numeric) AS total_time,
+           round(s.mean_exec_time::numeric, 1) AS mean_time,
+           s.shared_blks_read,
+           (s.shared_blks_hit + s.shared_blks_read) / s.calls AS blocks_per_call,
+           s.temp_blks_written,
+           pg_size_pretty(s.temp_blks_written * current_setting('block_size')::bigint) AS temp_size,
+           s.query ~* ('\mwhere\M.*\m' || h.time_column || '\M') AS time_predicate
+      FROM statements s
+      JOIN hypertables h
+        ON s.query ~* ('\m' || regexp_replace(h.hypertable_name, '\W', '\\\&', 'g') || '\M')
+     WHERE s.calls > 0
+       AND s.total_exec_time >= s.database_time / 100
+       AND s.query ~* '^\s*(select|with|update|delete)\M')
+SELECT * FROM workload
+"""
+
+NO_TIME_PREDICATE_QUERY = WORKLOAD_QUERY + """
+ WHERE NOT time_predicate AND chunk_count > 1
+ ORDER BY total_time DESC, shared_blks_read DESC;
+"""
+
+@doctor.register
+class MissingTimePredicate(doctor.Rule):
+    """Detect expensive statements on hypertables without a time condition."""
+
+    query: str = NO_TIME_PREDICATE_QUERY
+    message: str = (
+        "Statement on hypertable '{hypertable}' has no condition on '{time_column}'"
+        " and used {total_time} ms in {calls} calls: {query}"
+    )
+    detail: str = (
+        "The statement \"{query}\" uses hypertable '{hypertable}' but has no"
+        " condition on the time column '{time_column}' in its WHERE clause, so"
+        " it cannot exclude any of the {chunk_count} chunks. It was called"
+        " {calls} times using {total_time} ms in total, {mean_time} ms on"
+        " average, and read {shared_blks_read} shared blocks."
+    )
+    hint: str = (
+        "Add a condition on '{time_column}' to the statement, so that only the"
+        " chunks in the time range are scanned."
+    )
+    inputs: tuple = ('catalog', 'chunks', 'time')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0',
+        'pg_stat_statements': '1.8',
+    }
+
+CHUNK_SCAN_QUERY = WORKLOAD_QUERY + """
+ WHERE chunk_blocks >= 1000 AND blocks_per_call >= chunk_blocks
+ ORDER BY total_time DESC, shared_blks_read DESC;
+"""
+
+@doctor.register
+class LargeChunkScans(doctor.Rule):
+    """Detect expensive statements on hypertables that read whole chunks."""
+
+    query: str = CHUNK_SCAN_QUERY
+    message: str = (
+        "Statement on hypertable '{hypertable}' reads {blocks_per_call} blocks in"
+        " each call, more than a chunk has: {query}"
+    )
+    detail: str = (
+        "The statement \"{query}\" uses hypertable '{hypertable}' and reads"
+        " {blocks_per_call} blocks in each call, while a chunk of the hypertable"
+        " has {chunk_blocks} blocks on average. This usually means that chunks are"
+        " scanned sequentially. It was called {calls} times using {total_time} ms"
+        " in total and read {shared_blks_read} shared blocks."
+    )
+    hint: str = (
+        "Check the plan of the statement using EXPLAIN and add an index on"
+        " hypertable '{hypertable}' that matches the conditions of the statement."
+    )
+    inputs: tuple = ('catalog', 'chunks', 'time')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0',
+        'pg_stat_statements': '1.8',
+    }
+
+TEMP_SPILL_QUERY = WORKLOAD_QUERY + """
+ WHERE temp_blks_written > 0
+ ORDER BY total_time DESC, shared_blks_read DESC;
+"""
+
+@doctor.register
+class TempFileSpill(doctor.Rule):
+    """Detect expensive statements on hypertables that write temporary files."""
+
+    query: str = TEMP_SPILL_QUERY
+    message: str = (
+        "Statement on hypertable '{hypertable}' wrote {temp_size} of temporary"
+        " files: {query}"
+    )
+    detail: str = (
+        "The statement \"{query}\" uses hypertable '{hypertable}' and wrote"
+        " {temp_size} to temporary files in {calls} calls, since sorts or hashes"
+        " did not fit in work_mem. It used {total_time} ms in total, {mean_time} ms"
+        " on average."
+    )
+    hint: str = (
+        "Increase work_mem for the statement, or add an index on hypertable"
+        " '{hypertable}' that gives the rows in the order the statement needs."
+    )
+    inputs: tuple = ('catalog', 'chunks', 'time')
+    interval: float = 600.0
+    dependencies: dict = {
+        'timescaledb': '2.0',
+        'pg_stat_statements': '1.8',
+    }
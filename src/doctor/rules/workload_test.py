@@ -0,0 +1,86 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for workload rules."""
+
+from datetime import timedelta
+
+from timescaledb import Hypertable
+
+from doctor.unittest import TimescaleDBTestCase
+from doctor.rules.workload import LargeChunkScans, MissingTimePredicate, TempFileSpill
+
+class TestWorkloadRules(TimescaleDBTestCase):
+    """Test workload rules.
+
+    This will create a hypertable with a month of data in several
+    chunks, and a hypertable with a single chunk that is large enough
+    to be reported when scanned in full. The statistics of
+    ``pg_stat_statements`` are kept for each database, so the
+    statements of the fixture are not seen by the tests.
+
+    """
+
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create hypertables and the pg_stat_statements extension."""
+        table = Hypertable("conditions", "time", {
+            'time': "timestamptz not null",
+            'device_id': "integer",
+            'temperature': "float"
+        })
+        table.create(connection)
+        Hypertable("readings", "time", {
+            'time': "timestamptz not null",
+            'value': "float"
+        }, chunk_time_interval=timedelta(days=365)).create(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+            cursor.execute(
+                "INSERT INTO conditions "
+                "SELECT time, (random()*30)::int, random()*80 - 40 "
+                "FROM generate_series(NOW() - INTERVAL '30 days', NOW(), '1 minute') AS time"
+            )
+            cursor.execute(
+                "INSERT INTO readings "
+                "SELECT NOW() - i * INTERVAL '1 second', random() "
+                "FROM generate_series(1, 300000) AS i"
+            )
+            cursor.execute("ANALYZE readings")
+
+    def test_missing_time_predicate(self):
+        """Test rule for detecting statements without a time condition."""
+        with self.connection.cursor() as cursor:
+            for device in range(10):
+                cursor.execute("SELECT avg(temperature) FROM conditions WHERE device_id = %s",
+                               (device,))
+        rows = list(MissingTimePredicate().fetch(self.connection))
+        self.assertIn('conditions', [str(row['hypertable']) for row in rows])
+
+    def test_large_chunk_scans(self):
+        """Test rule for detecting statements reading whole chunks."""
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM readings WHERE value > 0.5")
+        rows = list(LargeChunkScans().fetch(self.connection))
+        self.assertIn('readings', [str(row['hypertable']) for row in rows])
+        self.assertNotIn('conditions', [str(row['hypertable']) for row in rows])
+
+    def test_temp_file_spill(self):
+        """Test rule for detecting statements writing temporary files."""
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET LOCAL work_mem = '64kB'")
+            cursor.execute("SELECT temperature FROM conditions ORDER BY temperature OFFSET 40000")
+        rows = list(TempFileSpill().fetch(self.connection))
+        self.assertIn('conditions', [str(row['hypertable']) for row in rows])
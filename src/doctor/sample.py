@@ -0,0 +1,99 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stratified sampling of chunks.
+
+Rules that look at every chunk take time proportional to the number of
+chunks. Such rules can read the chunks through the ``chunk_sample``
+common table expression in `CHUNK_SAMPLE` instead of reading the chunk
+catalog directly. It contains all chunks, unless the rule is executed
+with a sample size, in which case it contains, for each hypertable:
+
+1. the newest chunks,
+2. the oldest chunks, and
+3. a random sample of the remaining chunks,
+
+with the sample size number of chunks in each stratum. Each chunk has
+a weight, which is the number of chunks it represents, so the number
+of chunks is estimated by summing the weights. Only the chunk catalog
+is read in full, so the time spent on each chunk is bounded by three
+times the sample size for each hypertable.
+
+The sample size is passed to the query using the ``doctor.sample``
+setting, which is set for the transaction by `Rule.fetch` when the
+`doctor.Context` has a sample size and the rule sets `sampled`.
+"""
+
+SETTING = 'doctor.sample'
+
+# A chunk is in the middle stratum if it is neither one of the newest
+# nor one of the oldest chunks. Chunk identifiers are assigned in
+# creation order, so they are used to order the chunks.
+CHUNK_SAMPLE = r"""
+sample AS (
+    SELECT coalesce(nullif(current_setting('doctor.sample', true), ''), '0')::int AS size),
+chunk_strata AS (
+    SELECT ch.*,
+           s.size > 0
+           AND row_number() OVER (PARTITION BY ch.hypertable_id ORDER BY ch.id) > s.size
+           AND row_number() OVER (PARTITION BY ch.hypertable_id ORDER BY ch.id DESC) > s.size
+               AS middle
+      FROM _timescaledb_catalog.chunk ch CROSS JOIN sample s
+     WHERE NOT ch.dropped),
+chunk_shuffled AS (
+    SELECT ch.*,
+           count(*) FILTER (WHERE middle) OVER (PARTITION BY hypertable_id) AS middle_count,
+           row_number() OVER (PARTITION BY hypertable_id, middle ORDER BY random()) AS shuffled
+      FROM chunk_strata ch),
+chunk_sample AS (
+    SELECT ch.*,
+           CASE WHEN ch.middle AND ch.middle_count > s.size
+                THEN ch.middle_count::float8 / s.size ELSE 1 END AS weight
+      FROM chunk_shuffled ch CROSS JOIN sample s
+     WHERE NOT ch.middle OR ch.shuffled <= s.size)
+"""
+
+
+def estimate(condition='true'):
+    """Get an aggregate estimating the number of chunks matching `condition`.
+
+    The aggregate is used on rows from ``chunk_sample`` and gives the
+    exact number of chunks if all chunks are examined.
+    """
+    return f"coalesce(round(sum(weight) FILTER (WHERE {condition})), 0)::bigint"
+
+
+def confidence(condition='true'):
+    """Get an aggregate with a note on the confidence of `estimate`.
+
+    The margin of error is only computed for the random sample of the
+    middle stratum, since the newest and oldest chunks are examined in
+    full. It is a 95% confidence interval using the Agresti-Coull
+    adjustment, so that it is not zero when no sampled chunk matches.
+    """
+    middle = "weight > 1"
+    matching = f"count(*) FILTER (WHERE {middle} AND {condition})"
+    sampled = f"count(*) FILTER (WHERE {middle})"
+    total = f"sum(weight) FILTER (WHERE {middle})"
+    ratio = f"(({matching} + 2.0) / ({sampled} + 4))"
+    return f"""
+           CASE WHEN {sampled} = 0
+                THEN format('All %s chunks were examined.', count(*))
+                ELSE format('Estimated from %s of %s chunks, where the %s newest and'
+                            ' oldest chunks were examined in full. The margin of error'
+                            ' is %s chunks at 95%% confidence.',
+                            count(*), round(sum(weight)), count(*) - {sampled},
+                            round(1.96 * {total} * sqrt({ratio} * (1 - {ratio})
+                                                        / {sampled} * (1 - {sampled} / {total}))))
+           END"""
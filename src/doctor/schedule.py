@@ -0,0 +1,227 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scheduling of rules within a time budget.
+
+The scheduler orders rules so that cheap rules are executed first and
+limits the time each rule can run using ``statement_timeout`` and
+``lock_timeout``. When the time budget is exhausted, rules that have
+not started are not executed, and rules that are running are canceled
+by the server when their statement timeout expires.
+
+The cost of a rule is taken from the history file, if there is one,
+which contains the wall time of each rule from previous runs.
+Otherwise, the `cost` field of the rule is used, which is an estimate
+of the execution time in seconds. Rules without either are estimated
+by `Scheduler.estimate`: rules evaluated on the catalog snapshot cost
+the time it took to read their relations into the snapshot, and the
+cost of a rule query is the total cost from ``EXPLAIN`` converted to
+seconds.
+
+The catalog snapshot is read before any rule is executed, within the
+default time limits, so reading it is charged to the time budget.
+"""
+
+import json
+import os
+import threading
+import time
+
+from psycopg2 import Error, OperationalError, errorcodes
+from psycopg2.extensions import QueryCanceledError, cursor as TupleCursor
+
+# Default cost estimate for rules that do not define a cost and whose
+# cost could not be estimated.
+DEFAULT_COST = 1.0
+
+# Rough execution time in seconds of one unit of planner cost, which
+# is the cost of reading one page sequentially. It is only used to
+# compare estimates with measured times from the history.
+SECONDS_PER_COST_UNIT = 1e-5
+
+# Weight of the latest measurement when updating the history.
+HISTORY_WEIGHT = 0.5
+
+
+class Incomplete(Exception):
+    """Rule did not complete within the time limits."""
+
+
+# pylint: disable-next=too-many-instance-attributes
+class Scheduler:
+    """Schedule rules within a time budget.
+
+    budget: Time budget in seconds for all rules, or None for no
+      budget.
+
+    statement_timeout: Default statement timeout in seconds for each
+      rule, or None for no timeout. A rule can override it using the
+      `timeout` field.
+
+    lock_timeout: Lock timeout in seconds for each rule, or None for
+      no timeout.
+
+    history: Path to a JSON file with the wall time of rules from
+      previous runs, or None to use only the estimates in the rules.
+    """
+
+    def __init__(self, budget=None, statement_timeout=None, lock_timeout=None, history=None):
+        self.budget = budget
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.history = history
+        self.costs = {}
+        self.estimates = {}
+        self.deadline = None
+        self._lock = threading.Lock()
+        if history is not None and os.path.exists(history):
+            with open(history, 'r', encoding='utf-8') as infile:
+                self.costs = json.load(infile)
+
+    def start(self):
+        """Start the time budget."""
+        if self.budget is not None:
+            self.deadline = time.monotonic() + self.budget
+
+    def remaining(self):
+        """Get the remaining time of the budget, or None if there is no budget."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def cost(self, cls):
+        """Get the estimated cost of a rule in seconds."""
+        name = cls.fullname()
+        if name in self.costs:
+            return self.costs[name]
+        return getattr(cls, 'cost', self.estimates.get(name, DEFAULT_COST))
+
+    def estimate(self, conn, rules, snapshot=None):
+        """Estimate the cost of rules given as ``(category, name, cls)``.
+
+        Only rules without a measured time in the history and without
+        a `cost` field are estimated. Rules evaluated on the catalog
+        snapshot are estimated using the time it took to read their
+        relations into `snapshot`. Queries are planned within the lock
+        timeout, and rules whose query cannot be planned or whose
+        relations are not in the snapshot keep the default cost.
+        """
+        lock = int(self.lock_timeout * 1000) if self.lock_timeout is not None else 0
+        for _, _, cls in rules:
+            name = cls.fullname()
+            if name in self.costs or hasattr(cls, 'cost') or name in self.estimates:
+                continue
+            if hasattr(cls, 'evaluate'):
+                if snapshot is not None and all(relation in snapshot
+                                                for relation in cls.relations):
+                    self.estimates[name] = sum(snapshot.durations.get(relation, 0.0)
+                                               for relation in cls.relations)
+                continue
+            query = cls.query.strip().rstrip(';')
+            try:
+                with conn.cursor(cursor_factory=TupleCursor) as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", (f"{lock}ms",))
+                    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+                    result = cursor.fetchone()[0]
+                # The JSON format is parsed by psycopg2, but older
+                # versions return it as a string.
+                if isinstance(result, str):
+                    result = json.loads(result)
+                self.estimates[name] = result[0]['Plan']['Total Cost'] * SECONDS_PER_COST_UNIT
+            except Error:
+                pass
+            finally:
+                conn.rollback()
+
+    def order(self, rules):
+        """Order rules given as ``(category, name, cls)`` by cost."""
+        return sorted(rules, key=lambda rule: self.cost(rule[2]))
+
+    def timeouts(self, cls):
+        """Get statement and lock timeout for a rule in milliseconds.
+
+        A value of zero means that there is no timeout. The statement
+        timeout is never longer than the remaining time budget.
+        """
+        limits = [getattr(cls, 'timeout', self.statement_timeout), self.remaining()]
+        limits = [limit for limit in limits if limit is not None]
+        statement = max(int(min(limits) * 1000), 1) if limits else 0
+        lock = int(self.lock_timeout * 1000) if self.lock_timeout is not None else 0
+        return statement, lock
+
+    def limit(self, conn, cls=None):
+        """Set the time limits of a rule for the current transaction.
+
+        Without a rule, the default time limits are set.
+        """
+        statement, lock = self.timeouts(cls)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true),"
+                           "       set_config('lock_timeout', %s, true)",
+                           (f"{statement}ms", f"{lock}ms"))
+
+    def load(self, conn, snapshot, names):
+        """Read catalog relations into a snapshot within the time limits.
+
+        The time limits have to be set for the transaction using
+        `limit`. If reading is canceled, the transaction is rolled back
+        and the relations are left out of the snapshot, so that each
+        rule reads the relations it needs when it is executed, within
+        the time limits of the rule.
+        """
+        try:
+            snapshot.load(conn, names)
+        except QueryCanceledError:
+            conn.rollback()
+        except OperationalError as err:
+            if err.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+                raise
+            conn.rollback()
+
+    def run(self, conn, cls, func, *args):
+        """Run ``func(*args)`` for a rule within the time limits.
+
+        Returns the result of `func`, or an `Incomplete` exception if
+        the rule was not started or was canceled.
+        """
+        if self.remaining() == 0.0:
+            return Incomplete("not started, time budget exhausted")
+        self.limit(conn, cls)
+        start = time.monotonic()
+        try:
+            result = func(*args)
+        except QueryCanceledError:
+            conn.rollback()
+            return Incomplete(f"canceled after {time.monotonic() - start:.1f}s")
+        except OperationalError as err:
+            if err.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+                raise
+            conn.rollback()
+            return Incomplete("canceled, could not acquire lock")
+        self.record(cls, time.monotonic() - start)
+        return result
+
+    def record(self, cls, elapsed):
+        """Record the wall time of a rule in the history."""
+        name = cls.fullname()
+        with self._lock:
+            if name in self.costs:
+                elapsed = HISTORY_WEIGHT * elapsed + (1 - HISTORY_WEIGHT) * self.costs[name]
+            self.costs[name] = elapsed
+
+    def save(self):
+        """Save the history, if there is a history file."""
+        if self.history is not None:
+            with open(self.history, 'w', encoding='utf-8') as outfile:
+                json.dump(self.costs, outfile, indent=2, sort_keys=True)
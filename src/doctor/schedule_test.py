@@ -0,0 +1,65 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for scheduling rules."""
+
+import unittest
+
+from unittest import mock
+
+from doctor.catalog import Snapshot, Table
+from doctor.rules.index import DuplicateIndex, UnusedIndex
+from doctor.rules.jobs import FailingJob
+from doctor.schedule import DEFAULT_COST, Scheduler
+
+
+# pylint: disable-next=unused-argument
+def fetch_tables(conn, names, capabilities=None, durations=None):
+    """Read empty relations, each taking 0.1 seconds."""
+    durations.update((name, 0.1) for name in names)
+    return {name: Table([]) for name in names}
+
+
+class TestScheduler(unittest.TestCase):
+    """Test ordering rules by cost."""
+
+    RULES = [('jobs', 'FailingJob', FailingJob),
+             ('index', 'UnusedIndex', UnusedIndex),
+             ('index', 'DuplicateIndex', DuplicateIndex)]
+
+    def test_estimates(self):
+        """Test that rules are ordered by estimated cost."""
+        scheduler = Scheduler()
+        # Rules evaluated on the snapshot are estimated without
+        # using the connection.
+        scheduler.estimate(None, self.RULES[2:])
+        self.assertEqual(scheduler.cost(DuplicateIndex), DEFAULT_COST)
+        snapshot = Snapshot()
+        with mock.patch('doctor.catalog.fetch_tables', fetch_tables):
+            snapshot.load(None, DuplicateIndex.relations)
+        scheduler.estimate(None, self.RULES[2:], snapshot)
+        scheduler.estimates['index.UnusedIndex'] = 2.0
+        self.assertAlmostEqual(scheduler.cost(DuplicateIndex), 0.1 * len(DuplicateIndex.relations))
+        self.assertEqual(scheduler.cost(FailingJob), DEFAULT_COST)
+        self.assertEqual([name for _, name, _ in scheduler.order(self.RULES)],
+                         ['DuplicateIndex', 'FailingJob', 'UnusedIndex'])
+
+    def test_history(self):
+        """Test that measured times take precedence over estimates."""
+        scheduler = Scheduler()
+        scheduler.estimates['index.UnusedIndex'] = 0.5
+        scheduler.record(UnusedIndex, 5.0)
+        self.assertEqual(scheduler.cost(UnusedIndex), 5.0)
+        self.assertEqual([name for _, name, _ in scheduler.order(self.RULES)],
+                         ['FailingJob', 'DuplicateIndex', 'UnusedIndex'])
@@ -0,0 +1,281 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental checking of rules.
+
+The state file keeps a fingerprint of the inputs of each rule together
+with the findings of the rule from the previous run. A rule is only
+executed again if the fingerprint of its inputs has changed, and only
+findings that are new or resolved since the previous run are reported.
+
+The fingerprint is computed from a few components, each of which is
+read with a single query for the whole run:
+
+catalog: The oid, file node, number of tuples, and permissions of all
+  relations in ``pg_class``.
+
+stats: The time of the last analyze of all user tables.
+
+scans: The user indexes that were never scanned. Only whether an index
+  was scanned is part of the component, so it does not change on every
+  run of a busy database.
+
+chunks: The highest chunk id and the number of chunks in TimescaleDB.
+
+jobs: The configuration and statistics of the background jobs in
+  TimescaleDB.
+
+settings: The server settings.
+
+extensions: The installed extensions and their versions.
+
+time: The time of the run, which is different for each run. Rules
+  that compare with the current time, or read statistics that change
+  all the time, depend on it and are executed on every run.
+
+Rules can declare what components they depend on in the `inputs`
+field. If no inputs are declared, the rule depends on all components
+in `DEFAULT_INPUTS`, which are all components except ``time``.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import sys
+import time
+
+from fnmatch import fnmatch
+
+import psycopg2
+
+from psycopg2.extensions import make_dsn
+from psycopg2.extras import RealDictCursor
+
+from doctor import RULES, Context, print_results
+from doctor.capabilities import Capabilities
+from doctor.catalog import Snapshot
+
+COMPONENTS = ('catalog', 'stats', 'scans', 'chunks', 'jobs', 'settings', 'extensions', 'time')
+
+DEFAULT_INPUTS = tuple(component for component in COMPONENTS if component != 'time')
+
+FINGERPRINT_QUERY = """
+SELECT (SELECT coalesce(sum(hashtext(format('%s:%s:%s:%s:%s', oid, relfilenode, relnatts,
+                                            reltuples::bigint, relacl))), 0)
+          FROM pg_catalog.pg_class) AS catalog,
+       (SELECT coalesce(sum(hashtext(format('%s:%s:%s', relid,
+                                            last_analyze, last_autoanalyze))), 0)
+          FROM pg_catalog.pg_stat_user_tables) AS stats,
+       (SELECT coalesce(sum(hashtext(indexrelid::text)), 0)
+          FROM pg_catalog.pg_stat_user_indexes
+         WHERE idx_scan = 0) AS scans,
+       (SELECT coalesce(sum(hashtext(format('%s=%s', name, setting))), 0)
+          FROM pg_catalog.pg_settings
+         WHERE source NOT IN ('client', 'session')) AS settings
+"""
+
+CHUNKS_QUERY = """
+SELECT format('%s:%s', max(id), count(*)) AS chunks
+  FROM _timescaledb_catalog.chunk
+ WHERE NOT dropped
+"""
+
+JOBS_QUERY = """
+SELECT coalesce(sum(hashtext(format('%s:%s', j, s))), 0) AS jobs
+  FROM _timescaledb_config.bgw_job j
+  LEFT JOIN _timescaledb_internal.bgw_job_stat s ON s.job_id = j.id
+"""
+
+
+def fetch_components(conn, capabilities):
+    """Read the fingerprint components from the database."""
+    with conn.cursor() as cursor:
+        cursor.execute(FINGERPRINT_QUERY)
+        components = {key: str(value) for key, value in cursor.fetchone().items()}
+        components['chunks'] = None
+        if capabilities.has_relation('_timescaledb_catalog.chunk'):
+            cursor.execute(CHUNKS_QUERY)
+            components['chunks'] = cursor.fetchone()['chunks']
+        components['jobs'] = None
+        if capabilities.has_relation('_timescaledb_internal.bgw_job_stat'):
+            cursor.execute(JOBS_QUERY)
+            components['jobs'] = str(cursor.fetchone()['jobs'])
+    components['extensions'] = json.dumps({name: str(version) for name, version
+                                           in sorted(capabilities.extensions.items())})
+    components['time'] = str(time.time())
+    return components
+
+
+def definition(cls):
+    """Get the definition of a rule for the fingerprint.
+
+    This is the query of the rule, or for rules evaluated in Python,
+    the source of the module of the rule, since the evaluation can
+    use any function in the module.
+    """
+    if hasattr(cls, 'query'):
+        return cls.query
+    try:
+        return inspect.getsource(sys.modules[cls.__module__])
+    except (OSError, TypeError):
+        return cls.__name__
+
+
+def fingerprint(cls, components):
+    """Compute the fingerprint of the inputs of a rule.
+
+    The definition of the rule is part of the fingerprint, so a rule
+    is executed again if it changes.
+    """
+    digest = hashlib.sha1()
+    for text in (definition(cls), cls.message):
+        digest.update(text.encode('utf-8'))
+    for component in getattr(cls, 'inputs', DEFAULT_INPUTS):
+        digest.update(f"{component}={components[component]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class State:
+    """State of previous runs, stored in a JSON file.
+
+    The state contains one entry for each database, identified by the
+    connection parameters without password, and each entry contains
+    the fingerprint and findings for each rule.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.databases = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as infile:
+                self.databases = json.load(infile)
+
+    def rules(self, conninfo):
+        """Get the state for the rules of a database."""
+        params = {key: value for key, value in conninfo.items() if key != 'password'}
+        return self.databases.setdefault(make_dsn(**params), {})
+
+    def save(self):
+        """Save the state, replacing the file atomically."""
+        tmpname = f"{self.path}.tmp"
+        with open(tmpname, 'w', encoding='utf-8') as outfile:
+            json.dump(self.databases, outfile, indent=2, sort_keys=True)
+        os.replace(tmpname, self.path)
+
+
+def diff_findings(before, after):
+    """Get reports for findings that are new or resolved."""
+    known, current = set(before), set(after)
+    reports = [f"[new] {finding}" for finding in after if finding not in known]
+    reports.extend(f"[resolved] {finding}" for finding in before if finding not in current)
+    return reports
+
+
+def diff_records(fullname, before, records):
+    """Get records for findings of a rule that are new or resolved.
+
+    Records of new findings are the records of the rule with the
+    field ``change`` set to "new". The state only keeps the messages
+    of findings, so records of resolved findings only have the rule,
+    the category, and the message, with ``change`` set to "resolved".
+    """
+    known = set(before)
+    current = {record['message'] for record in records}
+    changes = [dict(record, change='new') for record in records
+               if record['message'] not in known]
+    changes.extend({'rule': fullname, 'category': fullname.partition('.')[0],
+                    'message': finding, 'change': 'resolved'}
+                   for finding in before if finding not in current)
+    return changes
+
+
+def run_incremental(conninfo, state, pattern='*', **options):
+    """Run rules with changed inputs and yield the changed findings.
+
+    Yields the same items as `doctor.run_rules`, but the reports of
+    each rule are the findings that are new since the previous run,
+    prefixed with "[new]", and the findings that are resolved,
+    prefixed with "[resolved]". If `records` is set in the options,
+    the reports are records as produced by `diff_records` instead.
+    Rules whose inputs did not change are not executed and have no
+    reports, and only rules matching `pattern` are considered at all.
+    """
+    conn = psycopg2.connect(**conninfo, cursor_factory=RealDictCursor)
+    try:
+        capabilities = Capabilities.fetch(conn)
+        components = fetch_components(conn, capabilities)
+        context = Context(capabilities, Snapshot(capabilities), **options)
+        yield from _run_changed(conn, context, components, state.rules(conninfo), pattern)
+    finally:
+        conn.close()
+
+
+def _run_changed(conn, context, components, previous, pattern='*'):
+    """Run rules whose fingerprint is not the same as in `previous`.
+
+    Rules not matching `pattern` are skipped and keep their previous
+    fingerprint and findings. A rule that fails is reported with the error and keeps its
+    previous fingerprint, so that it is executed again on the next run.
+    """
+    changed = []
+    for category, rules in RULES.items():
+        for name, cls in rules.items():
+            if not fnmatch(f"{category}.{name}", pattern):
+                continue
+            if not context.capabilities.satisfies(cls):
+                continue
+            entry = previous.setdefault(cls.fullname(), {'fingerprint': None, 'findings': []})
+            digest = fingerprint(cls, components)
+            if entry['fingerprint'] != digest:
+                changed.append((category, name, cls, entry, digest))
+    # The relations of all rules to run are read at once, so that the
+    # rules see the catalog at the same moment.
+    conn.rollback()
+    context.snapshot.load(conn, {relation for _, _, cls, _, _ in changed
+                                 if hasattr(cls, 'evaluate') for relation in cls.relations})
+    if context.profile is not None:
+        context.profile.record_snapshot(context.snapshot)
+    for category, name, cls, entry, digest in changed:
+        try:
+            if context.records:
+                records = list(cls().records(conn, context))
+                findings = [record['message'] for record in records]
+            else:
+                findings = list(cls().execute(conn, cls.message, context))
+        except Exception as err: # pylint: disable=broad-exception-caught
+            conn.rollback()
+            yield category, name, err
+            continue
+        if context.records:
+            yield category, name, diff_records(cls.fullname(), entry['findings'], records)
+        else:
+            yield category, name, diff_findings(entry['findings'], findings)
+        entry.update(fingerprint=digest, findings=findings)
+
+
+def check_incremental(conninfo, path, output='text', pattern='*', **options):
+    """Check rules incrementally and print new and resolved findings.
+
+    See `doctor.print_results` for the output formats. The options are
+    passed to `run_incremental`, and if there is a ``profile`` among
+    them, it is reported when done.
+    """
+    state = State(path)
+    results = run_incremental(conninfo, state, pattern, records=output != 'text', **options)
+    for fullname, error in print_results(results, output):
+        print(f"rule {fullname} failed: {error}".rstrip(), file=sys.stderr)
+    state.save()
+    if options.get('profile') is not None:
+        options['profile'].report(file=sys.stderr)
@@ -0,0 +1,126 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for incremental checking."""
+
+import unittest
+
+from unittest import mock
+
+import doctor
+
+from doctor import Context
+from doctor.capabilities import Capabilities
+from doctor.rules.index import DuplicateIndex, UnusedIndex
+from doctor.rules.jobs import OverlappingJob
+from doctor.state import COMPONENTS, _run_changed, diff_findings, diff_records, fingerprint
+
+
+class Broken(doctor.Rule):
+    """Rule failing with an error that is not a database error."""
+
+    relations = ('pg_class',)
+    message = "Row {id} is broken."
+
+    # pylint: disable-next=unused-argument
+    def evaluate(self, snapshot):
+        """Fail when evaluated."""
+        raise ValueError("broken")
+
+
+class Working(doctor.Rule):
+    """Rule with a single finding."""
+
+    relations = ('pg_class',)
+    message = "Row {id} works."
+
+    # pylint: disable-next=unused-argument
+    def evaluate(self, snapshot):
+        """Report one row."""
+        yield {'id': 1}
+
+
+class TestFingerprint(unittest.TestCase):
+    """Test the fingerprint of the inputs of rules."""
+
+    COMPONENTS = {component: '1' for component in COMPONENTS}
+
+    def test_inputs(self):
+        """Test that only the declared inputs change the fingerprint."""
+        components = dict(self.COMPONENTS, jobs='2')
+        self.assertEqual(fingerprint(UnusedIndex, self.COMPONENTS),
+                         fingerprint(UnusedIndex, components))
+        self.assertNotEqual(fingerprint(OverlappingJob, self.COMPONENTS),
+                            fingerprint(OverlappingJob, components))
+
+    def test_time(self):
+        """Test that rules depending on the time are always executed."""
+        components = dict(self.COMPONENTS, time='2')
+        self.assertNotEqual(fingerprint(OverlappingJob, self.COMPONENTS),
+                            fingerprint(OverlappingJob, components))
+        self.assertEqual(fingerprint(DuplicateIndex, self.COMPONENTS),
+                         fingerprint(DuplicateIndex, components))
+
+    def test_definition(self):
+        """Test that rules evaluated in Python are fingerprinted by their source."""
+        class Changed(DuplicateIndex):
+            """Rule with the same name but in another module."""
+        Changed.__name__ = DuplicateIndex.__name__
+        self.assertNotEqual(fingerprint(DuplicateIndex, self.COMPONENTS),
+                            fingerprint(Changed, self.COMPONENTS))
+
+    def test_diff_findings(self):
+        """Test reporting new and resolved findings."""
+        self.assertEqual(diff_findings(['a', 'b'], ['b', 'c']), ['[new] c', '[resolved] a'])
+
+    def test_diff_records(self):
+        """Test reporting new and resolved findings as records."""
+        records = [{'rule': 'index.DuplicateIndex', 'message': message} for message in 'bc']
+        self.assertEqual(diff_records('index.DuplicateIndex', ['a', 'b'], records), [
+            {'rule': 'index.DuplicateIndex', 'message': 'c', 'change': 'new'},
+            {'rule': 'index.DuplicateIndex', 'category': 'index', 'message': 'a',
+             'change': 'resolved'},
+        ])
+
+
+class TestRunChanged(unittest.TestCase):
+    """Test running the rules with changed inputs."""
+
+    def test_failing_rule(self):
+        """Test that a failing rule does not stop the other rules."""
+        conn = mock.MagicMock()
+        context = Context(Capabilities(150003, {}, []), mock.MagicMock())
+        previous = {}
+        rules = {'state_test': {'Broken': Broken, 'Working': Working}}
+        with mock.patch('doctor.state.RULES', rules):
+            results = {name: reports for _, name, reports
+                       in _run_changed(conn, context, TestFingerprint.COMPONENTS, previous)}
+        self.assertIsInstance(results['Broken'], ValueError)
+        self.assertEqual(results['Working'], ['[new] Row 1 works.'])
+        self.assertIsNone(previous['state_test.Broken']['fingerprint'])
+        self.assertEqual(previous['state_test.Working']['findings'], ['Row 1 works.'])
+
+    def test_pattern(self):
+        """Test that rules not matching the pattern keep their state."""
+        conn = mock.MagicMock()
+        context = Context(Capabilities(150003, {}, []), mock.MagicMock())
+        previous = {'state_test.Broken': {'fingerprint': 'old', 'findings': ['Row 2 is broken.']}}
+        rules = {'state_test': {'Broken': Broken, 'Working': Working}}
+        with mock.patch('doctor.state.RULES', rules):
+            results = [name for _, name, _
+                       in _run_changed(conn, context, TestFingerprint.COMPONENTS, previous,
+                                       'state_test.Work*')]
+        self.assertEqual(results, ['Working'])
+        self.assertEqual(previous['state_test.Broken'],
+                         {'fingerprint': 'old', 'findings': ['Row 2 is broken.']})
@@ -14,10 +14,26 @@
 
 """Unit tests support for Timescale Doctor rules.
 
+One container is started for each image and shared by all test cases
+in the session. The container is stopped when the session ends.
+
+Each test case class gets a separate database, so test case classes
+can run in parallel. The fixture of a test case class is created once,
+using `create_fixture`, in a template database, and the database for
+the test case class is created as a copy of the template. Each test
+then runs in a transaction that is rolled back when the test is done,
+so tests do not have to remove what they create.
+
 """
 
+import atexit
+import hashlib
 import os
+import re
+import threading
+import time
 import unittest
+import uuid
 
 from abc import ABCMeta
 
@@ -26,6 +42,122 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from testcontainers.postgres import PostgresContainer
 
+# Running containers, by image name and command.
+_CONTAINERS = {}
+_CONTAINERS_LOCK = threading.Lock()
+
+
+def get_container(image, command=None):
+    """Get the container for an image, starting it on first use.
+
+    If `command` is given, the container runs that command instead of
+    the default command of the image. The container is stopped when
+    the interpreter exits.
+    """
+    with _CONTAINERS_LOCK:
+        if (image, command) not in _CONTAINERS:
+            container = PostgresContainer(image)
+            if command is not None:
+                container.with_command(command)
+            container.start()
+            atexit.register(container.stop)
+            _CONTAINERS[image, command] = container
+        return _CONTAINERS[image, command]
+
+
+def connect(container, dbname=None, **kwargs):
+    """Connect to a database in a container.
+
+    If `dbname` is not given, connect to the default database of the
+    container.
+    """
+    url = container.get_connection_url().replace("+psycopg2", "")
+    if dbname is not None:
+        kwargs['dbname'] = dbname
+    return psycopg2.connect(url, **kwargs)
+
+
+def database_name(prefix, cls):
+    """Get a database name for a test case class.
+
+    The name is unique for the class and is a valid identifier that
+    fits within the maximum identifier length.
+    """
+    fullname = f"{cls.__module__}.{cls.__qualname__}"
+    digest = hashlib.sha1(fullname.encode('utf-8')).hexdigest()[:8]
+    return f"{prefix}_{re.sub('[^a-z0-9]', '_', cls.__name__.lower())[:40]}_{digest}"
+
+
+def create_template(container, name, fixture):
+    """Create a template database using `fixture`, if it does not exist.
+
+    The template does not allow connections once it is created, so
+    that copies can be made from it at any time.
+    """
+    admin = connect(container)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (name,))
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if cursor.fetchone() is None:
+                cursor.execute(f"CREATE DATABASE {name}")
+                try:
+                    conn = connect(container, name, cursor_factory=RealDictCursor)
+                    try:
+                        fixture(conn)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                except Exception:
+                    cursor.execute(f"DROP DATABASE {name}")
+                    raise
+                cursor.execute(f"ALTER DATABASE {name}"
+                               " WITH IS_TEMPLATE true ALLOW_CONNECTIONS false")
+            cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (name,))
+    finally:
+        admin.close()
+
+
+def execute_admin(container, statement):
+    """Execute a statement outside a transaction, for example CREATE DATABASE."""
+    admin = connect(container)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(statement)
+    finally:
+        admin.close()
+
+
+def wait_for_jobs(connection, job_ids, runs=1, timeout=60.0):
+    """Wait for the scheduler to run TimescaleDB jobs.
+
+    The transaction is committed, so that the scheduler sees the jobs,
+    and the scheduler of the database is started, since the launcher
+    only looks for new databases at intervals. Returns when each job
+    in `job_ids` has run at least `runs` times, and fails if that takes
+    longer than `timeout` seconds.
+    """
+    connection.commit()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT _timescaledb_functions.start_background_workers()")
+        connection.commit()
+        deadline = time.monotonic() + timeout
+        while True:
+            cursor.execute("SELECT count(*) AS done FROM timescaledb_information.job_stats"
+                           " WHERE job_id = ANY(%s) AND total_runs >= %s",
+                           (list(job_ids), runs))
+            done = cursor.fetchone()['done']
+            connection.commit()
+            if done == len(job_ids):
+                return
+            if time.monotonic() > deadline:
+                raise AssertionError(f"jobs {job_ids} did not run {runs} times"
+                                     f" within {timeout} seconds")
+            time.sleep(0.5)
+
+
 class TestCase(unittest.TestCase, metaclass=ABCMeta):
     """Base class for Timescale Doctor unit tests.
 
@@ -33,9 +165,19 @@ class TestCase(unittest.TestCase, metaclass=ABCMeta):
     requirements of the test case. Subclasses of this class add the
     actual container and is the test case class that should be used.
 
+    Override `create_fixture` to create the tables and data used by
+    the tests of the class. If `rollback` is false, the changes made
+    by each test are committed instead of rolled back, and are seen by
+    the following tests of the class.
+
+    If `container_command` is set, the container is started with that
+    command, for example to pass server settings.
+
     """
 
     container_name = None
+    container_command = None
+    rollback = True
 
     @property
     def connection(self):
@@ -51,26 +193,48 @@ class TestCase(unittest.TestCase, metaclass=ABCMeta):
         """Run rule and return messages."""
         return rule.execute(self.connection, rule.message)
 
+    @classmethod
+    def create_fixture(cls, connection):
+        """Create the fixture for the tests of the class.
+
+        This is called once for each session with a connection to the
+        template database for the class. The transaction is committed
+        after the fixture is created.
+        """
+
     @classmethod
     def setUpClass(cls):
-        """Start a container and create a connection for all tests."""
+        """Create a database from the template and connect to it."""
         assert cls.container_name is not None
-        cls.__container = PostgresContainer(cls.container_name).start()
-        connstring = cls.__container.get_connection_url().replace("+psycopg2", "")
-        cls.__connection = psycopg2.connect(connstring, cursor_factory=RealDictCursor)
+        cls.__container = get_container(cls.container_name, cls.container_command)
+        template = database_name('template', cls)
+        create_template(cls.__container, template, cls.create_fixture)
+        cls.__dbname = f"{database_name('test', cls)}_{uuid.uuid4().hex[:8]}"
+        execute_admin(cls.__container, f"CREATE DATABASE {cls.__dbname} TEMPLATE {template}")
+        cls.__connection = connect(cls.__container, cls.__dbname,
+                                   cursor_factory=RealDictCursor)
 
     @classmethod
     def tearDownClass(cls):
-        """Close the connection and stop the container."""
+        """Close the connection and drop the database."""
         cls.__connection.close()
-        cls.__container.stop()
+        execute_admin(cls.__container, f"DROP DATABASE {cls.__dbname}")
+
+    def tearDown(self):
+        """Roll back or commit the changes made by the test."""
+        if self.rollback:
+            self.connection.rollback()
+        else:
+            self.connection.commit()
 
 class TimescaleDBTestCase(TestCase):
     """Base class for test cases that need TimescaleDB.
 
     It will read the container name from the environment variable
     "TEST_CONTAINER_TIMESCALE" if present, or default to
-    "timescaledb:latest-pg15".
+    "timescaledb:latest-pg15". The server is started with
+    ``pg_stat_statements`` preloaded, so that statement statistics
+    are collected.
 
     Typical usage::
 
@@ -82,6 +246,7 @@ class TimescaleDBTestCase(TestCase):
     """
 
     container_name = os.environ.get('TEST_CONTAINER_TIMESCALE', 'timescale/timescaledb:latest-pg15')
+    container_command = "postgres -c shared_preload_libraries=timescaledb,pg_stat_statements"
 
 class PostgreSQLTestCase(TestCase):
     """Base class for test cases that use plain PostgreSQL.
@@ -0,0 +1,254 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Continuous checking of rules in a long-running process.
+
+In watch mode, a single connection is kept open and the query of each
+rule is prepared once for the connection. Each rule is then executed
+at its own interval, given by the `interval` field of the rule, so
+cheap rules can run often and expensive catalog scans more seldom.
+
+The current findings and the execution time of each rule are served
+in the Prometheus text format on a local HTTP endpoint::
+
+    curl http://localhost:9188/metrics
+
+If the connection is lost, it is opened again and the queries are
+prepared again when the next rule is due.
+"""
+
+import dataclasses
+import heapq
+import signal
+import sys
+import threading
+import time
+
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+
+from psycopg2.extras import RealDictCursor
+
+from doctor import RULES, Context
+from doctor.capabilities import Capabilities
+from doctor.catalog import Snapshot
+
+# Interval in seconds for rules that do not define an interval.
+DEFAULT_INTERVAL = 60.0
+
+DEFAULT_METRICS_PORT = 9188
+
+# Metrics for each rule, as name, type, help text, and a function to
+# get the value from the `RuleStatus` of the rule.
+METRICS = [
+    ('doctor_rule_runs_total', 'counter', "Number of executions of the rule.",
+     lambda status: status.runs),
+    ('doctor_rule_errors_total', 'counter', "Number of executions of the rule that failed.",
+     lambda status: status.errors),
+    ('doctor_rule_duration_seconds', 'gauge', "Execution time of the last execution.",
+     lambda status: f"{status.duration:.6f}"),
+    ('doctor_rule_timestamp_seconds', 'gauge', "Time of the last execution.",
+     lambda status: f"{status.timestamp:.3f}"),
+    ('doctor_rule_findings', 'gauge', "Number of findings of the last successful execution.",
+     lambda status: len(status.findings)),
+]
+
+
+@dataclasses.dataclass
+class RuleStatus:
+    """Status of a rule from its executions in watch mode."""
+
+    runs: int = 0
+    errors: int = 0
+    duration: float = None
+    timestamp: float = None
+    findings: list = dataclasses.field(default_factory=list)
+    error: str = None
+
+
+def _label(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Watcher:
+    """Execute rules on a persistent connection at their intervals.
+
+    rules: List of ``(category, name, cls)`` for the rules to execute.
+
+    interval: Interval in seconds for rules that do not define an
+      interval.
+    """
+
+    def __init__(self, conninfo, rules, interval=DEFAULT_INTERVAL):
+        self.conninfo = conninfo
+        self.rules = rules
+        self.interval = interval
+        self.status = {cls.fullname(): RuleStatus() for _, _, cls in rules}
+        self._conn = None
+        self._context = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Connect to the database and prepare the rule queries."""
+        conn = psycopg2.connect(**self.conninfo, cursor_factory=RealDictCursor)
+        # Each statement is a transaction of its own, so the
+        # connection is not left idle in a transaction between runs.
+        conn.autocommit = True
+        capabilities = Capabilities.fetch(conn)
+        statements = {}
+        with conn.cursor() as cursor:
+            for category, name, cls in self.rules:
+                if hasattr(cls, 'evaluate') or not capabilities.satisfies(cls):
+                    continue
+                statement = f"doctor_{category}_{name}".lower()
+                try:
+                    cursor.execute(f"PREPARE {statement} AS {cls.query}")
+                except psycopg2.Error:
+                    # The rule is executed without a prepared statement
+                    # and the error is reported when it runs.
+                    continue
+                statements[cls.fullname()] = statement
+        self._conn = conn
+        self._context = Context(capabilities, statements=statements)
+
+    def close(self):
+        """Close the connection, if it is open."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def run_rule(self, cls):
+        """Execute a rule and update its status."""
+        start = time.monotonic()
+        try:
+            if self._conn is None:
+                self.connect()
+            if not self._context.capabilities.satisfies(cls):
+                return
+            # The snapshot is created for each execution, so that
+            # rules evaluating the catalog see the current catalog.
+            context = dataclasses.replace(self._context,
+                                          snapshot=Snapshot(self._context.capabilities))
+            findings = list(cls().execute(self._conn, cls.message, context))
+            error = None
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as err:
+            self.close()
+            findings, error = None, err
+        except Exception as err: # pylint: disable=broad-exception-caught
+            findings, error = None, err
+        with self._lock:
+            status = self.status[cls.fullname()]
+            status.runs += 1
+            status.duration = time.monotonic() - start
+            status.timestamp = time.time()
+            if error is None:
+                status.findings, status.error = findings, None
+            else:
+                status.errors += 1
+                status.error = str(error).strip()
+        if error is not None:
+            print(f"rule {cls.fullname()} failed: {status.error}", file=sys.stderr)
+
+    def run(self, stop):
+        """Execute rules at their intervals until `stop` is set."""
+        queue = [(0.0, index) for index in range(len(self.rules))]
+        while queue and not stop.is_set():
+            due, index = queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                stop.wait(delay)
+                continue
+            cls = self.rules[index][2]
+            self.run_rule(cls)
+            heapq.heapreplace(queue, (time.monotonic() + getattr(cls, 'interval', self.interval),
+                                      index))
+
+    def metrics(self):
+        """Get the status of all rules in the Prometheus text format."""
+        with self._lock:
+            rules = [(f'rule="{fullname}",category="{fullname.partition(".")[0]}"', status)
+                     for fullname, status in sorted(self.status.items()) if status.runs > 0]
+            lines = []
+            for metric, kind, text, value in METRICS:
+                lines.append(f"# HELP {metric} {text}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.extend(f"{metric}{{{labels}}} {value(status)}" for labels, status in rules)
+            lines.append("# HELP doctor_finding Current findings, with the message as a label.")
+            lines.append("# TYPE doctor_finding gauge")
+            for labels, status in rules:
+                lines.extend(f'doctor_finding{{{labels},message="{_label(finding)}"}} 1'
+                             for finding in sorted(set(status.findings)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics of the watcher of the server."""
+
+    # pylint: disable-next=invalid-name
+    def do_GET(self):
+        """Serve the metrics on /metrics."""
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.watcher.metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Do not log requests."""
+
+
+def serve_metrics(watcher, port, address='localhost'):
+    """Serve the metrics of a watcher in a background thread."""
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    server.watcher = watcher
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def watch(conninfo, rules, interval=DEFAULT_INTERVAL, port=DEFAULT_METRICS_PORT,
+          statement_timeout=None):
+    """Check rules continuously until interrupted or terminated.
+
+    `rules` is a list of ``(category, name, cls)``, for example from
+    `select_rules`.
+    """
+    if statement_timeout is not None:
+        conninfo = dict(conninfo, options=f"-c statement_timeout={int(statement_timeout * 1000)}")
+    watcher = Watcher(conninfo, rules, interval)
+    server = serve_metrics(watcher, port)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        watcher.run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        watcher.close()
+
+
+def select_rules(pattern='*'):
+    """Get the loaded rules with a full name matching `pattern`."""
+    return [(category, name, cls)
+            for category, rules in RULES.items()
+            for name, cls in rules.items()
+            if fnmatch(f"{category}.{name}", pattern)]
@@ -0,0 +1,127 @@
+# Copyright 2023 Timescale, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for watch mode."""
+
+import io
+import unittest
+
+from contextlib import redirect_stderr
+from unittest import mock
+
+import psycopg2
+
+import doctor
+
+from doctor.capabilities import Capabilities
+from doctor.watch import Watcher
+
+
+class Quoting(doctor.Rule):
+    """Rule with a finding that has to be escaped in a label."""
+
+    relations = ()
+    message = 'Say "{word}" \\ {word}\n{word}'
+
+    # pylint: disable-next=unused-argument
+    def evaluate(self, snapshot):
+        """Report a single finding."""
+        yield {'word': 'hi'}
+
+
+class Broken(doctor.Rule):
+    """Rule failing with an error that is not a database error."""
+
+    relations = ()
+    message = "Row {id} is broken."
+
+    # pylint: disable-next=unused-argument
+    def evaluate(self, snapshot):
+        """Fail when evaluated."""
+        raise ValueError("broken")
+
+
+class Disconnecting(doctor.Rule):
+    """Rule losing the connection on its first execution."""
+
+    relations = ()
+    message = "Row {id} works."
+    calls = 0
+
+    # pylint: disable-next=unused-argument
+    def evaluate(self, snapshot):
+        """Fail on the first execution and report a row afterwards."""
+        Disconnecting.calls += 1
+        if Disconnecting.calls == 1:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        yield {'id': 1}
+
+
+class TestWatcher(unittest.TestCase):
+    """Test executing rules and serving metrics in watch mode."""
+
+    def setUp(self):
+        patch = mock.patch('doctor.watch.Capabilities.fetch',
+                           return_value=Capabilities(150003, {}, []))
+        patch.start()
+        self.addCleanup(patch.stop)
+        patch = mock.patch('doctor.watch.psycopg2.connect')
+        self.connect = patch.start()
+        self.addCleanup(patch.stop)
+        rules = [('watch_test', cls.__name__, cls) for cls in (Quoting, Broken, Disconnecting)]
+        self.watcher = Watcher({'dbname': 'test'}, rules)
+
+    def test_run_rule(self):
+        """Test that findings and errors are recorded for each rule."""
+        with redirect_stderr(io.StringIO()) as errors:
+            self.watcher.run_rule(Quoting)
+            self.watcher.run_rule(Broken)
+        status = self.watcher.status['watch_test.Quoting']
+        self.assertEqual((status.runs, status.errors), (1, 0))
+        self.assertEqual(status.findings, ['Say "hi" \\ hi\nhi'])
+        status = self.watcher.status['watch_test.Broken']
+        self.assertEqual((status.runs, status.errors, status.error), (1, 1, "broken"))
+        self.assertIn("rule watch_test.Broken failed: broken", errors.getvalue())
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_reconnect(self):
+        """Test that the connection is opened again after it was lost."""
+        Disconnecting.calls = 0
+        with redirect_stderr(io.StringIO()):
+            self.watcher.run_rule(Disconnecting)
+        self.connect.return_value.close.assert_called_once()
+        status = self.watcher.status['watch_test.Disconnecting']
+        self.assertEqual((status.runs, status.errors, status.findings), (1, 1, []))
+        self.watcher.run_rule(Disconnecting)
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertEqual((status.runs, status.errors, status.error), (2, 1, None))
+        self.assertEqual(status.findings, ["Row 1 works."])
+
+    def test_metrics(self):
+        """Test the metrics of rules that were executed."""
+        with redirect_stderr(io.StringIO()):
+            self.watcher.run_rule(Quoting)
+            self.watcher.run_rule(Broken)
+        lines = self.watcher.metrics().splitlines()
+        labels = 'rule="watch_test.Quoting",category="watch_test"'
+        self.assertIn(f'doctor_rule_runs_total{{{labels}}} 1', lines)
+        self.assertIn(f'doctor_rule_findings{{{labels}}} 1', lines)
+        self.assertIn(f'doctor_finding{{{labels},message="Say \\"hi\\" \\\\ hi\\nhi"}} 1',
+                      lines)
+        labels = 'rule="watch_test.Broken",category="watch_test"'
+        self.assertIn(f'doctor_rule_errors_total{{{labels}}} 1', lines)
+        self.assertIn(f'doctor_rule_findings{{{labels}}} 0', lines)
+        # Rules that have not been executed have no metrics.
+        self.assertFalse([line for line in lines if 'Disconnecting' in line])
+        self.assertIn('# TYPE doctor_finding gauge', lines)
@@ -37,16 +37,53 @@ class Table(SQL):
             coldefs = ",".join(f"{name} {defn}" for name, defn in self.columns.items())
             cursor.execute(f"CREATE TABLE {self.name} ({coldefs})")
 
-# pylint: disable-next=too-few-public-methods
 class Hypertable(Table):
-    """Class for a TimescaleDB hypertable."""
+    """Class for a TimescaleDB hypertable.
+
+    If `chunk_time_interval` is given, it is used as the interval of
+    each chunk. It is an integer for integer partitioning columns and
+    a `datetime.timedelta` for time partitioning columns.
+    """
 
-    def __init__(self, name, partcol, columns):
+    def __init__(self, name, partcol, columns, chunk_time_interval=None):
         super().__init__(name, columns)
         self.partcol = partcol
+        self.chunk_time_interval = chunk_time_interval
 
     def create(self, conn):
         super().create(conn)
         with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM create_hypertable(%s, %s)",
-                           (self.name, self.partcol))
+            if self.chunk_time_interval is None:
+                cursor.execute("SELECT * FROM create_hypertable(%s, %s)",
+                               (self.name, self.partcol))
+            else:
+                cursor.execute("SELECT * FROM create_hypertable(%s, %s,"
+                               " chunk_time_interval => %s)",
+                               (self.name, self.partcol, self.chunk_time_interval))
+
+    def compress(self, conn, segmentby=None):
+        """Enable compression on the hypertable.
+
+        Chunks are not compressed, use ``compress_chunk`` for that.
+        """
+        options = "timescaledb.compress"
+        if segmentby is not None:
+            options += f", timescaledb.compress_segmentby = '{segmentby}'"
+        with conn.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {self.name} SET ({options})")
+
+# pylint: disable-next=too-few-public-methods
+class Index(SQL):
+    """Class for an index on a table."""
+
+    def __init__(self, name, table, columns, unique=False):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+
+    def create(self, conn):
+        unique = "UNIQUE " if self.unique else ""
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE {unique}INDEX {self.name}"
+                           f" ON {self.table} ({', '.join(self.columns)})")